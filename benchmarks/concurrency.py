@@ -0,0 +1,90 @@
+"""
+Measure how the throughput of the /environment endpoint scales with the number of
+concurrent requests. Requires a running service connected to a local Postgres and a
+sender registered for the environment endpoint:
+
+    uvicorn iot_data_receiver.main:app --port 7770
+    python benchmarks/concurrency.py --key <KEY> -c 1 -c 10 -c 100
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from itertools import count
+
+import click
+import httpx
+from rich.console import Console
+from rich.table import Table
+
+console = Console()
+
+_timestamps = count()
+_start = datetime(2000, 1, 1)
+
+
+def get_payload(batch_size: int) -> dict:
+    timestamps = [
+        (_start + timedelta(seconds=next(_timestamps))).isoformat()
+        for _ in range(batch_size)
+    ]
+    return {"timestamp": timestamps, "temperature": [21.0] * batch_size}
+
+
+async def run(
+    url: str, key: str, n_requests: int, concurrency: int, batch_size: int
+) -> tuple[float, int]:
+    semaphore = asyncio.Semaphore(concurrency)
+    failed = 0
+
+    async with httpx.AsyncClient(
+        base_url=url,
+        headers={"access_token": key},
+        limits=httpx.Limits(max_connections=concurrency),
+        timeout=60,
+    ) as client:
+
+        async def send() -> None:
+            nonlocal failed
+            async with semaphore:
+                response = await client.post(
+                    "/environment", json=get_payload(batch_size)
+                )
+                if response.status_code != 200:
+                    failed += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[send() for _ in range(n_requests)])
+        return time.perf_counter() - start, failed
+
+
+@click.command()
+@click.option("--url", default="http://localhost:7770", help="URL of the service")
+@click.option("--key", required=True, help="API key of a registered sender")
+@click.option("--requests", "n_requests", default=500, help="Requests per run")
+@click.option(
+    "--concurrency",
+    "-c",
+    multiple=True,
+    type=int,
+    default=[1, 10, 50, 100, 200],
+    help="Number of concurrent requests. Can be passed multiple times",
+)
+@click.option("--batch_size", default=1, help="Readings per request")
+def main(url, key, n_requests, concurrency, batch_size):
+    table = Table("Concurrency", "Requests", "Failed", "Time (s)", "Requests/s")
+    for n_concurrent in concurrency:
+        elapsed, failed = asyncio.run(
+            run(url, key, n_requests, n_concurrent, batch_size)
+        )
+        table.add_row(
+            str(n_concurrent),
+            str(n_requests),
+            str(failed),
+            f"{elapsed:.2f}",
+            f"{n_requests / elapsed:.1f}",
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
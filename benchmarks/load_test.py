@@ -0,0 +1,444 @@
+"""
+Reproducible load test of the /environment endpoint. The service is started in a
+subprocess against a throwaway schema on the Postgres configured in config/ (the schema
+is set with the IOTRECEIVER_db__schema environment variable), senders
+are provisioned with the code path of the create_sender cli tool and registered via
+/register. Every combination of concurrency and batch size is then driven with the
+same number of requests. With --workers and --pool_size the service is restarted for
+every combination of the number of uvicorn workers and the size of the connection pool:
+
+    python benchmarks/load_test.py run --senders 10 -c 1 -c 50 -b 1 -b 100 \\
+        --output results/$(git rev-parse --short HEAD).json
+    python benchmarks/load_test.py run -w 1 -w 2 -w 4 -p 5 -p 10 -p 20 -c 50 -b 100
+    python benchmarks/load_test.py compare results/abc1234.json results/def5678.json
+
+The results (requests/s, rows/s and latency percentiles) are written as JSON, so runs
+on different commits can be compared.
+"""
+import asyncio
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from itertools import cycle, product
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import click
+import httpx
+from concurrency import get_payload
+from data_organizer.config import OrganizerConfig
+from data_organizer.db.connection import DatabaseConnection
+from rich.console import Console
+from rich.table import Table
+
+from iot_data_receiver.cli_tools import add_sender
+from iot_data_receiver.database import get_connection_settings
+
+console = Console(stderr=True)
+
+INIT_SCRIPT = Path(__file__).parent.parent / "scripts" / "database_init_commands.sql"
+INIT_SCHEMA = "iot_receiver"
+
+
+def get_percentile(sorted_values: Sequence[float], quantile: float) -> float:
+    """Nearest-rank percentile of the sorted values"""
+    if not sorted_values:
+        return math.nan
+    rank = max(math.ceil(quantile * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_config(config_base: str, schema: str) -> OrganizerConfig:
+    config = OrganizerConfig(name="IoTLoadTest", config_dir_base=config_base)
+    config.settings.db.schema = schema
+    return config
+
+
+def setup_schema(config: OrganizerConfig, n_senders: int) -> List[str]:
+    """Create the tables of the init script in the schema and add senders"""
+    schema = config.settings.db.schema
+    init_commands = INIT_SCRIPT.read_text().replace(
+        f"CREATE SCHEMA {INIT_SCHEMA};", f"CREATE SCHEMA IF NOT EXISTS {schema};"
+    )
+    init_commands = init_commands.replace(f"{INIT_SCHEMA}.", f"{schema}.")
+
+    keys = []
+    with DatabaseConnection(
+        **get_connection_settings(config.settings.db), name="IoTLoadTest"
+    ) as db:
+        # Executed without parameters, so the % in the trigger function is kept
+        connection = db.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(init_commands)
+            connection.commit()
+        finally:
+            connection.close()
+        for i in range(n_senders):
+            token, _ = add_sender(
+                db,
+                config.tables["senders"],
+                f"load_test_{i}",
+                **config.settings.auth.hashing.to_dict(),
+            )
+            keys.append(token)
+
+    return keys
+
+
+def drop_schema(config: OrganizerConfig) -> None:
+    with DatabaseConnection(
+        **get_connection_settings(config.settings.db), name="IoTLoadTest"
+    ) as db:
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql(
+                f"DROP SCHEMA IF EXISTS {config.settings.db.schema} CASCADE"
+            )
+            connection.commit()
+
+
+def start_service(
+    config_base: str,
+    schema: str,
+    port: int,
+    workers: int,
+    pool_size: Optional[int],
+) -> subprocess.Popen:
+    """
+    Start the service with uvicorn. The service reads its configuration from config/
+    in its working directory, so it is started in the parent of config_base and the
+    schema (and pool size) are overwritten by environment variables.
+    """
+    config_dir = Path(config_base).resolve()
+    if config_dir.name != "config":
+        raise click.ClickException(
+            "The service reads its configuration from a directory named config. "
+            "Pass --url to test a service started with another configuration"
+        )
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "iot_data_receiver.main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+            "--workers",
+            str(workers),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        cwd=config_dir.parent,
+        env={
+            **os.environ,
+            "PYTHONPATH": str(Path(__file__).parent.parent),
+            "IOTRECEIVER_db__schema": schema,
+            **(
+                {"IOTRECEIVER_db__pool_size": str(pool_size)}
+                if pool_size is not None
+                else {}
+            ),
+        },
+    )
+
+
+def wait_for_service(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/health").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise click.ClickException(f"Service at {url} did not become healthy")
+
+
+def register_senders(url: str, keys: Sequence[str]) -> None:
+    for key in keys:
+        response = httpx.post(
+            f"{url}/register",
+            json={"endpoint": "environment", "fields": ["timestamp", "temperature"]},
+            headers={"access_token": key},
+            timeout=60,
+        )
+        response.raise_for_status()
+
+
+async def run(
+    url: str, keys: Sequence[str], n_requests: int, concurrency: int, batch_size: int
+) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    sender_keys = cycle(keys)
+    latencies: List[float] = []
+    failed = 0
+
+    async with httpx.AsyncClient(
+        base_url=url,
+        limits=httpx.Limits(max_connections=concurrency),
+        timeout=60,
+    ) as client:
+
+        async def send(key: str) -> None:
+            nonlocal failed
+            async with semaphore:
+                payload = get_payload(batch_size)
+                request_start = time.perf_counter()
+                response = await client.post(
+                    "/environment", json=payload, headers={"access_token": key}
+                )
+                latencies.append(time.perf_counter() - request_start)
+                if response.status_code != 200:
+                    failed += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[send(next(sender_keys)) for _ in range(n_requests)])
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    succeeded = n_requests - failed
+    return {
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "requests": n_requests,
+        "failed": failed,
+        "seconds": elapsed,
+        "requests_per_second": succeeded / elapsed,
+        "rows_per_second": succeeded * batch_size / elapsed,
+        "latency_ms": {
+            name: get_percentile(latencies, quantile) * 1000
+            for name, quantile in [("p50", 0.5), ("p95", 0.95), ("p99", 0.99)]
+        },
+    }
+
+
+def print_results(results: Sequence[Dict[str, Any]]) -> None:
+    table = Table(
+        "Workers",
+        "Pool size",
+        "Concurrency",
+        "Batch size",
+        "Failed",
+        "Requests/s",
+        "Rows/s",
+        "p50 (ms)",
+        "p95 (ms)",
+        "p99 (ms)",
+    )
+    for result in results:
+        table.add_row(
+            str(result.get("workers", "-")),
+            str(result.get("pool_size") or "-"),
+            str(result["concurrency"]),
+            str(result["batch_size"]),
+            str(result["failed"]),
+            f"{result['requests_per_second']:.1f}",
+            f"{result['rows_per_second']:.1f}",
+            *[f"{value:.2f}" for value in result["latency_ms"].values()],
+        )
+    console.print(table)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("run")
+@click.option("--config_base", default="config", help="Directory of the config files")
+@click.option(
+    "--schema",
+    default="iot_receiver_load_test",
+    help="Schema created (and dropped) for the test",
+)
+@click.option("--port", default=7771, help="Port of the started service")
+@click.option(
+    "--url",
+    default=None,
+    help="Use an already running service (connected to --schema) instead",
+)
+@click.option("--senders", "n_senders", default=10, help="Number of senders")
+@click.option("--requests", "n_requests", default=1000, help="Requests per run")
+@click.option("--warmup", default=50, help="Requests before the first run")
+@click.option(
+    "--concurrency",
+    "-c",
+    multiple=True,
+    type=int,
+    default=[1, 10, 50],
+    help="Number of concurrent requests. Can be passed multiple times",
+)
+@click.option(
+    "--batch_size",
+    "-b",
+    multiple=True,
+    type=int,
+    default=[1, 100],
+    help="Readings per request. Can be passed multiple times",
+)
+@click.option(
+    "--workers",
+    "-w",
+    multiple=True,
+    type=int,
+    default=[1],
+    help="Number of uvicorn workers. Can be passed multiple times",
+)
+@click.option(
+    "--pool_size",
+    "-p",
+    multiple=True,
+    type=int,
+    help="Connection pool size of each worker (default: the configured one). Can be "
+    "passed multiple times",
+)
+@click.option("--output", default=None, help="JSON file for the results")
+@click.option("--keep_schema", is_flag=True, help="Do not drop the schema afterwards")
+def run_load_test(
+    config_base,
+    schema,
+    port,
+    url,
+    n_senders,
+    n_requests,
+    warmup,
+    concurrency,
+    batch_size,
+    workers,
+    pool_size,
+    output,
+    keep_schema,
+):
+    """Run the load test and write the results as JSON"""
+    pool_sizes = pool_size or [None]
+    if url is not None and (len(workers) > 1 or pool_size):
+        raise click.ClickException(
+            "--workers and --pool_size can not be changed for a service passed by --url"
+        )
+    config = get_config(config_base, schema)
+    drop_schema(config)
+    console.print(f"Provisioning {n_senders} senders in schema [i]{schema}[/i]")
+    keys = setup_schema(config, n_senders)
+
+    results = []
+    registered = False
+    try:
+        for n_workers, n_pool in product(workers, pool_sizes):
+            service = None
+            service_url = url
+            if service_url is None:
+                service_url = f"http://127.0.0.1:{port}"
+                console.print(f"Starting {n_workers} worker(s), pool size {n_pool}")
+                service = start_service(config_base, schema, port, n_workers, n_pool)
+            try:
+                wait_for_service(service_url, timeout=30)
+                if not registered:
+                    register_senders(service_url, keys)
+                    registered = True
+                if warmup:
+                    asyncio.run(run(service_url, keys, warmup, max(concurrency), 1))
+
+                for n_concurrent, n_rows in product(concurrency, batch_size):
+                    console.print(
+                        f"Running concurrency {n_concurrent}, batch size {n_rows}"
+                    )
+                    result = asyncio.run(
+                        run(service_url, keys, n_requests, n_concurrent, n_rows)
+                    )
+                    results.append(
+                        {"workers": n_workers, "pool_size": n_pool, **result}
+                    )
+            finally:
+                if service is not None:
+                    service.terminate()
+                    service.wait()
+    finally:
+        if not keep_schema:
+            drop_schema(config)
+
+    print_results(results)
+    report = {
+        "commit": get_commit(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "parameters": {
+            "senders": n_senders,
+            "requests": n_requests,
+            "warmup": warmup,
+            "python": sys.version.split()[0],
+        },
+        "results": results,
+    }
+    if output is None:
+        click.echo(json.dumps(report, indent=2))
+    else:
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+        Path(output).write_text(json.dumps(report, indent=2))
+
+
+@cli.command()
+@click.argument("baseline", type=click.Path(exists=True))
+@click.argument("candidate", type=click.Path(exists=True))
+def compare(baseline, candidate):
+    """Compare the results of two runs (relative change of CANDIDATE to BASELINE)"""
+    reports = [json.loads(Path(path).read_text()) for path in [baseline, candidate]]
+    baseline_results, candidate_results = [
+        {
+            (
+                r.get("workers", 1),
+                r.get("pool_size"),
+                r["concurrency"],
+                r["batch_size"],
+            ): r
+            for r in report["results"]
+        }
+        for report in reports
+    ]
+
+    table = Table(
+        "Workers",
+        "Pool size",
+        "Concurrency",
+        "Batch size",
+        "Rows/s",
+        "p50",
+        "p95",
+        "p99",
+    )
+    for key, base in baseline_results.items():
+        if key not in candidate_results:
+            continue
+        cand = candidate_results[key]
+        changes = [
+            cand["rows_per_second"] / base["rows_per_second"] - 1,
+            *[
+                cand["latency_ms"][name] / base["latency_ms"][name] - 1
+                for name in ["p50", "p95", "p99"]
+            ],
+        ]
+        table.add_row(
+            *[str(k) if k is not None else "-" for k in key],
+            *[f"{c:+.1%}" for c in changes],
+        )
+    console.print(f"{reports[1]['commit']} compared to {reports[0]['commit']}")
+    console.print(table)
+
+
+if __name__ == "__main__":
+    cli()
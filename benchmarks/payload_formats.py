@@ -0,0 +1,99 @@
+"""
+Compare size and decoding time of the request body formats supported by the
+/environment endpoint:
+
+    python benchmarks/payload_formats.py
+"""
+import gzip
+import json
+import timeit
+from datetime import datetime, timedelta, timezone
+
+import click
+import msgpack
+from rich.console import Console
+from rich.table import Table
+
+from iot_data_receiver.decoding import (
+    decode_body,
+    decode_columnar,
+    decompress,
+    encode_columnar,
+)
+from iot_data_receiver.model import EnvironmentInput
+
+console = Console()
+
+FIELDS = ["temperature", "pressure", "humidity", "light"]
+
+
+def get_columns(batch_size: int) -> dict:
+    start = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    return {
+        "timestamp": [start + timedelta(seconds=10 * i) for i in range(batch_size)],
+        **{field: [20.0 + i / 7 for i in range(batch_size)] for field in FIELDS},
+    }
+
+
+def get_formats(columns: dict) -> list:
+    json_body = json.dumps(
+        {
+            **columns,
+            "timestamp": [value.isoformat() for value in columns["timestamp"]],
+        }
+    ).encode()
+    msgpack_body = msgpack.packb(columns, datetime=True)
+    columnar_body = encode_columnar(
+        columns, {"timestamp": "q", **{field: "f" for field in FIELDS}}
+    )
+    return [
+        ("JSON", json_body, lambda body: EnvironmentInput.parse_raw(body)),
+        (
+            "MessagePack",
+            msgpack_body,
+            lambda body: EnvironmentInput.parse_obj(
+                decode_body(body, "application/msgpack")
+            ),
+        ),
+        (
+            "Columnar",
+            columnar_body,
+            lambda body: decode_columnar(body, EnvironmentInput),
+        ),
+    ]
+
+
+@click.command()
+@click.option(
+    "--batch_size",
+    "-b",
+    multiple=True,
+    type=int,
+    default=[10, 1_000, 50_000],
+    help="Number of rows. Can be passed multiple times",
+)
+@click.option("--repeat", default=5, help="Number of repetitions per measurement")
+def main(batch_size, repeat):
+    table = Table("Rows", "Format", "Bytes", "Bytes (gzip)", "Decode (ms)")
+    for n_rows in batch_size:
+        for name, body, decode in get_formats(get_columns(n_rows)):
+            compressed = gzip.compress(body)
+            elapsed = min(
+                timeit.repeat(
+                    lambda: decode(decompress(compressed, "gzip", 1024**3)),
+                    number=1,
+                    repeat=repeat,
+                )
+            )
+            table.add_row(
+                str(n_rows),
+                name,
+                str(len(body)),
+                str(len(compressed)),
+                f"{elapsed * 1000:.2f}",
+            )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
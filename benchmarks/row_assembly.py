@@ -0,0 +1,82 @@
+"""
+Compare the row assembly of the /environment endpoint (per-cell loop over the dict of
+the input model) with zipping the columns of the model directly:
+
+    python benchmarks/row_assembly.py
+"""
+import timeit
+from datetime import datetime, timedelta
+
+import click
+from rich.console import Console
+from rich.table import Table
+
+from iot_data_receiver.model import EnvironmentInput
+
+console = Console()
+
+FIELDS = ["timestamp", "temperature", "pressure", "humidity", "light"]
+
+
+def get_input(batch_size: int) -> EnvironmentInput:
+    start = datetime(2000, 1, 1)
+    return EnvironmentInput.construct(
+        timestamp=[start + timedelta(seconds=i) for i in range(batch_size)],
+        **{field: [float(i) for i in range(batch_size)] for field in FIELDS[1:]},
+    )
+
+
+def assemble_loop(environment_input: EnvironmentInput) -> list:
+    insert_data = []
+    environment_input_dict = environment_input.dict()
+    for i in range(len(environment_input.timestamp)):
+        this_row = []
+        for field in FIELDS:
+            this_row.append(environment_input_dict[field][i])
+        insert_data.append(this_row)
+    return insert_data
+
+
+def assemble_zip(environment_input: EnvironmentInput) -> list:
+    # The list is only created to consume the rows. The endpoint passes the iterator
+    # directly to the insert.
+    return list(zip(*[getattr(environment_input, field) for field in FIELDS]))
+
+
+@click.command()
+@click.option(
+    "--batch_size",
+    "-b",
+    multiple=True,
+    type=int,
+    default=[10, 1_000, 100_000],
+    help="Number of rows. Can be passed multiple times",
+)
+@click.option("--repeat", default=5, help="Number of repetitions per measurement")
+def main(batch_size, repeat):
+    table = Table("Rows", "Loop (ms)", "Zip (ms)", "Speedup")
+    for n_rows in batch_size:
+        environment_input = get_input(n_rows)
+        assert assemble_loop(environment_input) == [
+            list(row) for row in assemble_zip(environment_input)
+        ]
+        times = []
+        for func in [assemble_loop, assemble_zip]:
+            times.append(
+                min(
+                    timeit.repeat(
+                        lambda: func(environment_input), number=1, repeat=repeat
+                    )
+                )
+            )
+        table.add_row(
+            str(n_rows),
+            f"{times[0] * 1000:.3f}",
+            f"{times[1] * 1000:.3f}",
+            f"{times[0] / times[1]:.1f}x",
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Compare the throughput of adding requests to the spool with writing them directly to
+the database:
+
+    python benchmarks/spool.py
+    python benchmarks/spool.py --config_base config/ --table <REGISTERED_TABLE>
+
+Without --table only the spool is measured.
+"""
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import click
+from rich.console import Console
+from rich.table import Table
+
+from iot_data_receiver.spool import Spool
+
+console = Console()
+
+
+def get_columns(batch_size: int, offset: int) -> list:
+    start = datetime(2000, 1, 1) + timedelta(seconds=offset * batch_size)
+    return [
+        [start + timedelta(seconds=i) for i in range(batch_size)],
+        [21.0] * batch_size,
+    ]
+
+
+def measure_spool(n_requests: int, batch_size: int, fsync_interval: float) -> float:
+    with tempfile.TemporaryDirectory() as directory:
+        spool = Spool(
+            directory,
+            segment_size=16 * 1024 * 1024,
+            max_size=1024 * 1024 * 1024,
+            fsync_interval=fsync_interval,
+        )
+        start = time.perf_counter()
+        for i in range(n_requests):
+            spool.append({"columns": get_columns(batch_size, i)})
+        elapsed = time.perf_counter() - start
+        spool.close()
+    return elapsed
+
+
+def measure_insert(
+    n_requests: int, batch_size: int, config_base: str, table: str
+) -> float:
+    from data_organizer.config import OrganizerConfig
+
+    from iot_data_receiver.database import SharedDatabase, insert_columns
+    from iot_data_receiver.endpoints import Registration
+    from iot_data_receiver.model import ConflictPolicy
+
+    config = OrganizerConfig(name="IoTSpoolBenchmark", config_dir_base=config_base)
+    db = SharedDatabase(name="IoTSpoolBenchmark").get(config.settings.db)
+    registration = Registration(
+        table,
+        ["timestamp", "temperature"],
+        primary_fields=["timestamp"],
+        on_conflict=ConflictPolicy.UPDATE,
+    )
+    start = time.perf_counter()
+    for i in range(n_requests):
+        insert_columns(db, registration, get_columns(batch_size, i))
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("--requests", "n_requests", default=1000, help="Number of requests")
+@click.option("--batch_size", default=5, help="Readings per request")
+@click.option(
+    "--config_base",
+    default="config",
+    help="Path to the directory containign the configuration files",
+)
+@click.option(
+    "--table", default=None, help="Table with timestamp and temperature column"
+)
+def main(n_requests, batch_size, config_base, table):
+    results = Table("Method", "Time (s)", "Requests/s")
+    measurements = [
+        (f"Spool (fsync_interval={fsync_interval})", measure_spool, (fsync_interval,))
+        for fsync_interval in [0, 0.1]
+    ]
+    if table is not None:
+        measurements.append(("Insert", measure_insert, (config_base, table)))
+
+    for name, func, args in measurements:
+        elapsed = func(n_requests, batch_size, *args)  # type: ignore
+        results.add_row(name, f"{elapsed:.3f}", f"{n_requests / elapsed:.0f}")
+    console.print(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Compare the validation of the (JSON decoded) /environment input with pydantic and with
+the column-wise validation of model.parse_columns:
+
+    python benchmarks/validation.py
+"""
+import timeit
+from datetime import datetime, timedelta
+
+import click
+from rich.console import Console
+from rich.table import Table
+
+from iot_data_receiver.model import EnvironmentInput, parse_columns
+
+console = Console()
+
+FIELDS = ["temperature", "pressure", "humidity", "light", "gas_ox", "gas_red"]
+
+
+def get_data(batch_size: int) -> dict:
+    start = datetime(2022, 1, 1)
+    return {
+        "timestamp": [
+            (start + timedelta(seconds=10 * i)).isoformat() for i in range(batch_size)
+        ],
+        **{field: [20.0 + i / 7 for i in range(batch_size)] for field in FIELDS},
+    }
+
+
+@click.command()
+@click.option(
+    "--batch_size",
+    "-b",
+    multiple=True,
+    type=int,
+    default=[10, 1_000, 50_000],
+    help="Number of rows. Can be passed multiple times",
+)
+@click.option("--repeat", default=5, help="Number of repetitions per measurement")
+def main(batch_size, repeat):
+    table = Table("Rows", "pydantic (ms)", "parse_columns (ms)", "Speedup")
+    for n_rows in batch_size:
+        data = get_data(n_rows)
+        assert parse_columns(EnvironmentInput, data) == EnvironmentInput.parse_obj(data)
+        times = [
+            min(timeit.repeat(lambda: func(data), number=1, repeat=repeat))
+            for func in [
+                EnvironmentInput.parse_obj,
+                lambda data: parse_columns(EnvironmentInput, data),
+            ]
+        ]
+        table.add_row(
+            str(n_rows),
+            f"{times[0] * 1000:.2f}",
+            f"{times[1] * 1000:.2f}",
+            f"{times[0] / times[1]:.1f}x",
+        )
+    console.print(table)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from enum import Enum
+from itertools import chain
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from iot_data_receiver.endpoints import Registration
+
+logger = logging.getLogger(__name__)
+
+Columns = Sequence[Sequence[Any]]
+Counts = Optional[Dict[str, int]]
+Batch = Tuple[Columns, "Future[Counts]"]
+
+
+class BufferFull(Exception):
+    pass
+
+
+class BufferDurability(str, Enum):
+    """
+    FLUSH: Requests are acknowledged after their data is written to the database
+    ENQUEUE: Requests are acknowledged after their data is added to the buffer
+    """
+
+    FLUSH = "flush"
+    ENQUEUE = "enqueue"
+
+
+class WriteBuffer:
+    """
+    Collects the data of many requests per table and writes them in one batch from a
+    background thread. A flush is triggered if flush_rows are buffered or after
+    flush_interval seconds. Each call to add returns a future that is resolved once
+    the data is written. The write runs in the context (see contextvars) of the first
+    request that added data of the table, so e.g. its metrics keep the endpoint label.
+
+    :param write: Function writing the columns of a registration to the database. The
+                  futures are resolved with its return value.
+    :param max_rows: Maximum number of buffered (or currently written) rows. Adding
+                     data beyond this raises BufferFull.
+    :param flush_rows: Number of buffered rows triggering a flush
+    :param flush_interval: Maximum time in seconds data is buffered
+    """
+
+    def __init__(
+        self,
+        write: Callable[[Registration, Columns], Counts],
+        max_rows: int,
+        flush_rows: int,
+        flush_interval: float,
+    ) -> None:
+        self.write = write
+        self.max_rows = max_rows
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+        self._pending: Dict[
+            str, Tuple[Registration, contextvars.Context, List[Batch]]
+        ] = {}
+        self._queued_rows = 0
+        self._rows = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name="WriteBuffer", daemon=True
+        )
+        self._thread.start()
+
+    def add(self, registration: Registration, columns: Columns) -> "Future[Counts]":
+        n_rows = len(columns[0])
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("WriteBuffer is closed")
+            if self._rows + n_rows > self.max_rows:
+                raise BufferFull
+            future: "Future[Counts]" = Future()
+            _, _, batches = self._pending.setdefault(
+                registration.table_name,
+                (registration, contextvars.copy_context(), []),
+            )
+            batches.append((columns, future))
+            self._queued_rows += n_rows
+            self._rows += n_rows
+            if self._queued_rows >= self.flush_rows:
+                self._condition.notify()
+        return future
+
+    def close(self) -> None:
+        """Write all buffered data and stop the background thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued_rows": self._queued_rows,
+            "rows": self._rows,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_seconds": self.last_flush_seconds,
+            "mean_flush_seconds": (
+                self.total_flush_seconds / self.flushes if self.flushes else 0.0
+            ),
+        }
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._closed and self._queued_rows < self.flush_rows:
+                    self._condition.wait(self.flush_interval)
+                pending, self._pending = self._pending, {}
+                self._queued_rows = 0
+                closed = self._closed
+
+            for registration, context, batches in pending.values():
+                self._flush(registration, context, batches)
+                with self._condition:
+                    self._rows -= sum(len(columns[0]) for columns, _ in batches)
+
+            if closed and not pending:
+                return
+
+    def _flush(
+        self,
+        registration: Registration,
+        context: contextvars.Context,
+        batches: List[Batch],
+    ) -> None:
+        columns = [
+            list(chain.from_iterable(batch[i] for batch, _ in batches))
+            for i in range(len(registration.fields))
+        ]
+        start = time.perf_counter()
+        try:
+            counts = context.run(self.write, registration, columns)
+        except Exception as e:
+            if len(batches) > 1:
+                # Write the batches separately, so only the failing ones are rejected
+                logger.warning(
+                    "Flush to %s failed. Writing %s batches separately",
+                    registration.table_name,
+                    len(batches),
+                )
+                for batch in batches:
+                    self._flush(registration, context, [batch])
+                return
+            self.failed_flushes += 1
+            logger.error("Writing to %s failed: %s", registration.table_name, e)
+            batches[0][1].set_exception(e)
+            return
+
+        elapsed = time.perf_counter() - start
+        self.flushes += 1
+        self.last_flush_seconds = elapsed
+        self.total_flush_seconds += elapsed
+        for _, future in batches:
+            future.set_result(counts)
@@ -0,0 +1,195 @@
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from secrets import token_bytes
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """
+    Bounded, thread-safe LRU cache where every entry expires after a fixed time to
+    live. Setting maxsize to 0 disables the cache.
+
+    Every invalidation (pop, remove_if, clear) increments generation. A value read
+    from the database can be set with the generation read before the database, so
+    it is dropped if an invalidation happened in between and it may be stale.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires <= self.timer():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        ttl: Optional[float] = None,
+        generation: Optional[int] = None,
+    ) -> None:
+        """
+        Cache the value for ttl seconds (at most the ttl of the cache). If generation
+        is passed, the value is only cached if nothing was invalidated since.
+        """
+        if self.maxsize <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (self.timer() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        with self._lock:
+            self.generation += 1
+            self._data.pop(key, None)
+
+    def remove_if(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Remove all entries for which predicate(key, value) is true"""
+        with self._lock:
+            self.generation += 1
+            keys = [
+                key for key, (_, value) in self._data.items() if predicate(key, value)
+            ]
+            for key in keys:
+                del self._data[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+
+class APIKeyCache:
+    """
+    Cache for authenticated api keys. Keys are never stored in plain text but as HMAC
+    digest with a secret generated per process. Successfully verified keys are mapped
+    to (sender_name, sender_id). Rejected keys are cached separately with a short time
+    to live and only a limited number of rejections is cached per minute, so invalid
+    keys can not push valid ones out of the cache.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        ttl: float,
+        negative_size: int,
+        negative_ttl: float,
+        negative_per_minute: int,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.timer = timer
+        self.accepted = TTLCache(size, ttl, timer)
+        self.rejected = TTLCache(negative_size, negative_ttl, timer)
+        self.negative_per_minute = negative_per_minute
+        self._secret = token_bytes(32)
+        self._window_start = timer()
+        self._window_rejections = 0
+        self._window_lock = threading.Lock()
+
+    def digest(self, api_key: str) -> bytes:
+        return hmac.new(self._secret, api_key.encode("utf-8"), sha256).digest()
+
+    def get(self, api_key: str) -> Optional[Tuple[str, int]]:
+        return self.accepted.get(self.digest(api_key))
+
+    @property
+    def generation(self) -> Tuple[int, int]:
+        """Generations of the accepted and rejected keys (see TTLCache)"""
+        return self.accepted.generation, self.rejected.generation
+
+    def add(
+        self,
+        api_key: str,
+        sender_name: str,
+        sender_id: int,
+        ttl: Optional[float] = None,
+        generation: Optional[Tuple[int, int]] = None,
+    ) -> None:
+        """
+        Cache the verified key. Keys only valid for ttl seconds pass the ttl. If
+        generation is passed, the key is not cached if any key was invalidated since.
+        """
+        digest = self.digest(api_key)
+        self.rejected.pop(digest)
+        self.accepted.set(
+            digest,
+            (sender_name, sender_id),
+            ttl,
+            generation[0] if generation is not None else None,
+        )
+
+    def is_rejected(self, api_key: str) -> bool:
+        return self.rejected.get(self.digest(api_key)) is not None
+
+    def reject(
+        self, api_key: str, generation: Optional[Tuple[int, int]] = None
+    ) -> None:
+        # get_api_key runs concurrently in the threadpool
+        with self._window_lock:
+            now = self.timer()
+            if now - self._window_start >= 60:
+                self._window_start = now
+                self._window_rejections = 0
+            if self._window_rejections >= self.negative_per_minute:
+                return
+            self._window_rejections += 1
+        self.rejected.set(
+            self.digest(api_key),
+            True,
+            generation=generation[1] if generation is not None else None,
+        )
+
+    def invalidate_sender(self, sender_id: int) -> int:
+        """
+        Remove all cached keys of a sender (e.g. after the key was revoked). Returns
+        the number of removed keys.
+        """
+        return self.accepted.remove_if(lambda _, value: value[1] == sender_id)
+
+    def clear_rejected(self) -> None:
+        self.rejected.clear()
+
+    def clear(self) -> None:
+        self.accepted.clear()
+        self.rejected.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {"accepted": self.accepted.stats(), "rejected": self.rejected.stats()}
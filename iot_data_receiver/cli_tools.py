@@ -1,14 +1,46 @@
+import csv
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
 from pathlib import Path
+from secrets import token_hex
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
 import click
 from data_organizer.config import OrganizerConfig
 from data_organizer.db.connection import DatabaseConnection
+from data_organizer.db.exceptions import QueryReturnedNoData
+from psycopg2.extras import execute_batch, execute_values
+from pypika import Table
 from rich.console import Console
 
-from iot_data_receiver.utils import generate_token
+from iot_data_receiver.database import get_connection_settings
+from iot_data_receiver.endpoints import EndpointRegistry, Registration, quote_identifier
+from iot_data_receiver.hashing import HMAC_SHA256, hash_token
+from iot_data_receiver.model import PartitionInterval, RegisterInput
+from iot_data_receiver.partitions import (
+    PARTITION_COLUMN,
+    get_migration_sql,
+    get_next_partition_start,
+    get_partition_start,
+    iter_partition_starts,
+)
+from iot_data_receiver.query import TIME_COLUMN
+from iot_data_receiver.registration import register_endpoint
+from iot_data_receiver.rollups import create_rollup_tables, refresh_rollups
+from iot_data_receiver.utils import generate_token, get_key_lookup
 
 console = Console()
 
+# Length of the sender_name column
+MAX_SENDER_NAME_LENGTH = 50
+
+TOKEN_BYTES = 20
+
 
 @click.command()
 @click.argument("name")
@@ -33,7 +65,26 @@ def create_sender(name, config_base, schema):
         f"[underline]{name}[/underline]"
     )
 
-    token, hashed_token = generate_token(20)
+    config = OrganizerConfig(
+        name="IoTKeyCreator",
+        config_dir_base=config_base,
+    )
+
+    if schema is not None:
+        config.settings.db.schema = schema
+
+    with DatabaseConnection(
+        **get_connection_settings(config.settings.db), name="IoTKeyCreator"
+    ) as db:
+        if not db.has_table(config.tables["senders"].name):
+            console.print("Table [i]senders[/i] does not exit")
+            return None
+        token, hashed_token = add_sender(
+            db,
+            config.tables["senders"],
+            name,
+            **config.settings.auth.hashing.to_dict(),
+        )
 
     console.print(
         f"Your key is [red bold]{token}[/red bold]. "
@@ -42,6 +93,255 @@ def create_sender(name, config_base, schema):
 
     console.print(f"  Hashed key: [cyan]{hashed_token}[/cyan]")
 
+
+def add_sender(
+    db: DatabaseConnection, senders_table: Any, name: str, **hashing: Any
+) -> Tuple[str, str]:
+    """
+    Generate a key for a new sender and insert it. Returns the key and its hash. The
+    hashing settings are passed to get_crypt_context.
+    """
+    token, hashed_token = generate_token(TOKEN_BYTES, **hashing)
+    db.insert(senders_table, [[name, hashed_token, get_key_lookup(token)]])
+    return token, hashed_token
+
+
+def read_sender_names(path: Path) -> List[str]:
+    """
+    Sender names from a JSON file (a list of names or of objects with a name) or a CSV
+    file (the name column if the header has one, otherwise the first column)
+    """
+    if path.suffix.lower() == ".json":
+        entries = json.loads(path.read_text())
+        if not isinstance(entries, list):
+            raise ValueError("The JSON file has to contain a list")
+        names = [
+            entry.get("name") if isinstance(entry, dict) else entry for entry in entries
+        ]
+    else:
+        with path.open(newline="") as f:
+            rows = [row for row in csv.reader(f) if row]
+        column = 0
+        if rows and "name" in rows[0]:
+            column = rows[0].index("name")
+            rows = rows[1:]
+        names = [row[column].strip() if len(row) > column else None for row in rows]
+
+    if not names:
+        raise ValueError("No sender names found")
+    invalid = [
+        name
+        for name in names
+        if not isinstance(name, str) or not name or len(name) > MAX_SENDER_NAME_LENGTH
+    ]
+    if invalid:
+        raise ValueError(f"Invalid sender names {invalid[:10]}")
+    duplicates = [name for name, count in Counter(names).items() if count > 1]
+    if duplicates:
+        raise ValueError(f"Duplicate sender names {duplicates[:10]}")
+    return names
+
+
+def generate_tokens(
+    n_tokens: int, processes: Optional[int], **hashing: Any
+) -> List[Tuple[str, str, str]]:
+    """
+    Generate n_tokens keys with their hashes and lookup ids. Bcrypt is deliberately
+    slow, so its hashing is spread over processes worker processes.
+    """
+    tokens = [token_hex(TOKEN_BYTES) for _ in range(n_tokens)]
+    hash_with_settings = partial(hash_token, **hashing)
+    if processes == 1 or hashing.get("scheme") == HMAC_SHA256:
+        hashed_tokens = list(map(hash_with_settings, tokens))
+    else:
+        workers = processes or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            hashed_tokens = list(
+                executor.map(
+                    hash_with_settings,
+                    tokens,
+                    chunksize=max(1, n_tokens // (workers * 4)),
+                )
+            )
+    return [
+        (token, hashed_token, get_key_lookup(token))
+        for token, hashed_token in zip(tokens, hashed_tokens)
+    ]
+
+
+def write_keys(path: Path, names: Sequence[str], tokens: Sequence[str]) -> None:
+    """
+    Write the names and keys as CSV to a new file only readable by the owner. Fails if
+    the file exists, so no keys are overwritten or written to a file readable by others.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "key"])
+        writer.writerows(zip(names, tokens))
+
+
+def get_sender_ids(
+    db: DatabaseConnection, names: Sequence[str]
+) -> List[Tuple[str, int]]:
+    """Names and ids of the existing senders with the names"""
+    senders_table = Table("senders")
+    try:
+        return [
+            (name, sender_id)
+            for name, sender_id in db.query(
+                db.pypika_query.from_(senders_table)
+                .select(senders_table.sender_name, senders_table.id)
+                .where(senders_table.sender_name.isin(list(names)))
+                .get_sql()
+            )
+        ]
+    except QueryReturnedNoData:
+        return []
+
+
+def get_senders_without_lookup(
+    db: DatabaseConnection, names: Sequence[str]
+) -> List[str]:
+    """Names of the senders with the names that have no key lookup (legacy keys)"""
+    senders_table = Table("senders")
+    try:
+        return [
+            name
+            for (name,) in db.query(
+                db.pypika_query.from_(senders_table)
+                .select(senders_table.sender_name)
+                .where(
+                    senders_table.sender_name.isin(list(names))
+                    & senders_table.key_lookup.isnull()
+                )
+                .get_sql()
+            )
+        ]
+    except QueryReturnedNoData:
+        return []
+
+
+def insert_senders(
+    db: DatabaseConnection, names: Sequence[str], keys: Sequence[Tuple[str, str, str]]
+) -> Dict[str, int]:
+    """Insert the senders in a single transaction. Returns the ids of the senders"""
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            rows = execute_values(
+                cursor,
+                f"INSERT INTO {quote_identifier(db.schema)}.senders "
+                '("sender_name", "hashed_key", "key_lookup") VALUES %s '
+                'RETURNING "sender_name", "id"',
+                [
+                    (name, hashed_token, key_lookup)
+                    for name, (_, hashed_token, key_lookup) in zip(names, keys)
+                ],
+                fetch=True,
+            )
+        connection.commit()
+    finally:
+        connection.close()
+    return dict(rows)
+
+
+def get_rotate_key_sql(schema: str, keep_previous: bool) -> str:
+    # All expressions of SET use the values of the row before the update
+    previous_hashed_key, previous_key_lookup = (
+        ('"hashed_key"', '"key_lookup"') if keep_previous else ("NULL", "NULL")
+    )
+    return (
+        f"UPDATE {quote_identifier(schema)}.senders SET "
+        f'"previous_hashed_key" = {previous_hashed_key}, '
+        f'"previous_key_lookup" = {previous_key_lookup}, '
+        '"previous_key_expires" = %(expires)s, '
+        '"hashed_key" = %(hashed_key)s, "key_lookup" = %(key_lookup)s '
+        'WHERE "id" = %(id)s'
+    )
+
+
+def rotate_sender_keys(
+    db: DatabaseConnection,
+    sender_ids: Sequence[int],
+    keys: Sequence[Tuple[str, str, str]],
+    expires: Optional[datetime],
+) -> None:
+    """
+    Replace the keys of the senders in a single transaction. The replaced keys stay
+    valid until expires (naive UTC), or are revoked immediately if it is None.
+    """
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            execute_batch(
+                cursor,
+                get_rotate_key_sql(db.schema, expires is not None),
+                [
+                    {
+                        "id": sender_id,
+                        "hashed_key": hashed_token,
+                        "key_lookup": key_lookup,
+                        "expires": expires,
+                    }
+                    for sender_id, (_, hashed_token, key_lookup) in zip(
+                        sender_ids, keys
+                    )
+                ],
+            )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+@click.command()
+@click.argument(
+    "input_file", type=click.Path(exists=True, dir_okay=False, path_type=Path)
+)
+@click.option(
+    "--output",
+    required=True,
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="New file the names and keys are written to (readable only by the owner)",
+)
+@click.option(
+    "--register",
+    "endpoints",
+    multiple=True,
+    help="Register the senders for this endpoint (with all fields). Can be passed "
+    "multiple times",
+)
+@click.option(
+    "--processes",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of processes hashing the keys. Defaults to the number of CPUs",
+)
+@click.option(
+    "--config_base",
+    default="config",
+    help="Path to the directory containign the configuration files",
+)
+@click.option(
+    "--schema",
+    default=None,
+    help="Overwrite the schema set in the config",
+)
+def create_senders(input_file, output, endpoints, processes, config_base, schema):
+    """
+    Create a sender for each name in INPUT_FILE (CSV or JSON) and write the generated
+    keys to the file passed as --output. All senders are inserted in one transaction,
+    so either all or none of them are created.
+    """
+    try:
+        names = read_sender_names(input_file)
+    except (OSError, ValueError) as e:
+        console.print(f"Could not read the sender names: {e}")
+        return None
+    if output.exists():
+        console.print(f"Output file [i]{output}[/i] already exists")
+        return None
+
     config = OrganizerConfig(
         name="IoTKeyCreator",
         config_dir_base=config_base,
@@ -50,11 +350,464 @@ def create_sender(name, config_base, schema):
     if schema is not None:
         config.settings.db.schema = schema
 
-    with DatabaseConnection(**config.settings.db.to_dict(), name="IoTKeyCreator") as db:
+    registry = EndpointRegistry.load(
+        config.settings.endpoints.definitions.to_dict(),
+        use_entry_points=config.settings.endpoints.entry_points,
+    )
+    unknown = [endpoint for endpoint in endpoints if endpoint not in registry]
+    if unknown:
+        console.print(f"Endpoints [i]{', '.join(unknown)}[/i] do not exist")
+        return None
+
+    with DatabaseConnection(
+        **get_connection_settings(config.settings.db), name="IoTKeyCreator"
+    ) as db:
         if not db.has_table(config.tables["senders"].name):
             console.print("Table [i]senders[/i] does not exit")
             return None
-        db.insert(config.tables["senders"], [[name, hashed_token]])
+
+        existing = get_sender_ids(db, names)
+        if existing:
+            console.print(
+                "Senders [i]"
+                f"{', '.join(sorted({name for name, _ in existing}))}"
+                "[/i] already exist"
+            )
+            return None
+
+        console.print(f"Generating keys for {len(names)} senders")
+        keys = generate_tokens(
+            len(names), processes, **config.settings.auth.hashing.to_dict()
+        )
+        # Written before the insert, so no keys are lost if the command is interrupted
+        write_keys(output, names, [token for token, _, _ in keys])
+        try:
+            sender_ids = insert_senders(db, names, keys)
+        except Exception:
+            output.unlink()
+            raise
+        console.print(f"Created {len(names)} senders")
+
+        failed = 0
+        for endpoint in endpoints:
+            for name in names:
+                try:
+                    register_endpoint(
+                        db,
+                        registry[endpoint],
+                        sender_ids[name],
+                        name,
+                        RegisterInput(endpoint=endpoint, fields=[]),
+                        config.settings.partitions.premake,
+                    )
+                except Exception as e:
+                    # The senders exist now, so register as many as possible
+                    failed += 1
+                    console.print(f"Could not register {name} for {endpoint}: {e}")
+            console.print(f"Registered the senders for endpoint {endpoint}")
+
+    if failed:
+        console.print(
+            f"{failed} registrations failed. They can be added with /register"
+        )
+    console.print(
+        f"The keys are written to [red bold]{output}[/red bold]. "
+        "Save them now, because they can not be reproduced later"
+    )
+
+
+@click.command()
+@click.argument(
+    "input_file", type=click.Path(exists=True, dir_okay=False, path_type=Path)
+)
+@click.option(
+    "--output",
+    required=True,
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="New file the names and keys are written to (readable only by the owner)",
+)
+@click.option(
+    "--overlap_hours",
+    default=24.0,
+    type=click.FloatRange(min=0),
+    help="Hours the replaced keys stay valid. 0 revokes them immediately",
+)
+@click.option(
+    "--processes",
+    default=None,
+    type=click.IntRange(min=1),
+    help="Number of processes hashing the keys. Defaults to the number of CPUs",
+)
+@click.option(
+    "--config_base",
+    default="config",
+    help="Path to the directory containign the configuration files",
+)
+@click.option(
+    "--schema",
+    default=None,
+    help="Overwrite the schema set in the config",
+)
+def rotate_keys(input_file, output, overlap_hours, processes, config_base, schema):
+    """
+    Replace the keys of the senders named in INPUT_FILE (CSV or JSON) and write the new
+    keys to the file passed as --output. The replaced keys stay valid for
+    --overlap_hours, so the devices can be updated while both keys are accepted.
+    """
+    try:
+        names = read_sender_names(input_file)
+    except (OSError, ValueError) as e:
+        console.print(f"Could not read the sender names: {e}")
+        return None
+    if output.exists():
+        console.print(f"Output file [i]{output}[/i] already exists")
+        return None
+
+    config = OrganizerConfig(
+        name="IoTKeyCreator",
+        config_dir_base=config_base,
+    )
+
+    if schema is not None:
+        config.settings.db.schema = schema
+
+    with DatabaseConnection(
+        **get_connection_settings(config.settings.db), name="IoTKeyCreator"
+    ) as db:
+        existing = get_sender_ids(db, names)
+        sender_ids = dict(existing)
+        missing = [name for name in names if name not in sender_ids]
+        if missing:
+            console.print(f"Senders [i]{', '.join(missing)}[/i] do not exist")
+            return None
+        ambiguous = [
+            name
+            for name, count in Counter(name for name, _ in existing).items()
+            if count > 1
+        ]
+        if ambiguous:
+            console.print(f"Sender names [i]{', '.join(ambiguous)}[/i] are not unique")
+            return None
+        # The old key is only known as hash, so its lookup can not be computed and it
+        # would not be found during the overlap
+        legacy = get_senders_without_lookup(db, names) if overlap_hours > 0 else []
+        if legacy:
+            console.print(
+                f"Senders [i]{', '.join(legacy)}[/i] have no key lookup. Their old"
+                " keys can not stay valid, migrate them first or pass --overlap_hours 0"
+            )
+            return None
+
+        console.print(f"Generating keys for {len(names)} senders")
+        keys = generate_tokens(
+            len(names), processes, **config.settings.auth.hashing.to_dict()
+        )
+        write_keys(output, names, [token for token, _, _ in keys])
+        # Naive UTC, the service compares it with utcnow
+        expires = (
+            datetime.utcnow() + timedelta(hours=overlap_hours)
+            if overlap_hours > 0
+            else None
+        )
+        try:
+            rotate_sender_keys(db, [sender_ids[name] for name in names], keys, expires)
+        except Exception:
+            output.unlink()
+            raise
+
+    console.print(
+        f"Rotated the keys of {len(names)} senders. "
+        + (
+            f"The old keys are valid until {expires.isoformat()} UTC. "
+            if expires is not None
+            else "The old keys are revoked. "
+        )
+        + f"The new keys are written to [red bold]{output}[/red bold]"
+    )
+
+
+@click.command()
+@click.argument("gateway")
+@click.argument("senders", nargs=-1, required=True)
+@click.option(
+    "--config_base",
+    default="config",
+    help="Path to the directory containign the configuration files",
+)
+@click.option(
+    "--schema",
+    default=None,
+    help="Overwrite the schema set in the config",
+)
+def add_gateway_senders(gateway, senders, config_base, schema):
+    """Allow the sender GATEWAY to send data for the SENDERS via /gateway"""
+    config = OrganizerConfig(
+        name="IoTKeyCreator",
+        config_dir_base=config_base,
+    )
+
+    if schema is not None:
+        config.settings.db.schema = schema
+
+    with DatabaseConnection(
+        **get_connection_settings(config.settings.db), name="IoTKeyCreator"
+    ) as db:
+        if not db.has_table(config.tables["gateway_senders"].name):
+            console.print("Table [i]gateway_senders[/i] does not exit")
+            return None
+
+        senders_table = Table("senders")
+        try:
+            sender_ids = dict(
+                db.query(
+                    db.pypika_query.from_(senders_table)
+                    .select(senders_table.sender_name, senders_table.id)
+                    .where(senders_table.sender_name.isin([gateway, *senders]))
+                    .get_sql()
+                )
+            )
+        except QueryReturnedNoData:
+            sender_ids = {}
+
+        missing = [name for name in [gateway, *senders] if name not in sender_ids]
+        if missing:
+            console.print(f"Senders [i]{', '.join(missing)}[/i] do not exist")
+            return None
+
+        db.insert(
+            config.tables["gateway_senders"],
+            [[sender_ids[gateway], sender_ids[name]] for name in senders],
+        )
+        console.print(
+            f"Gateway [underline]{gateway}[/underline] can send data for "
+            f"{', '.join(senders)}"
+        )
+
+
+@click.command()
+@click.argument("table")
+@click.option(
+    "--interval",
+    type=click.Choice([interval.value for interval in PartitionInterval]),
+    default=PartitionInterval.MONTH.value,
+    help="Time range of one partition",
+)
+@click.option(
+    "--retention_days",
+    type=int,
+    default=None,
+    help="Drop partitions with data older than this many days",
+)
+@click.option(
+    "--config_base",
+    default="config",
+    help="Path to the directory containign the configuration files",
+)
+@click.option(
+    "--schema",
+    default=None,
+    help="Overwrite the schema set in the config",
+)
+def partition_table(table, interval, retention_days, config_base, schema):
+    """
+    Convert the existing sender table TABLE into a time-partitioned table. The data is
+    copied into the new partitions in a single transaction. Writes to the table are
+    blocked during the migration and fail if they were waiting for it, so the senders
+    should be paused.
+    """
+    interval = PartitionInterval(interval)
+    config = OrganizerConfig(
+        name="IoTPartitioner",
+        config_dir_base=config_base,
+    )
+
+    if schema is not None:
+        config.settings.db.schema = schema
+
+    with DatabaseConnection(
+        **get_connection_settings(config.settings.db), name="IoTPartitioner"
+    ) as db:
+        ers = Table("endpoint_request_subsets")
+        try:
+            data = db.query(
+                db.pypika_query.from_(ers)
+                .select(ers.subset)
+                .where(ers.table == table)
+                .get_sql()
+            )
+        except QueryReturnedNoData:
+            console.print(f"Table [i]{table}[/i] is not registered for any sender")
+            return None
+
+        subset = data[0][0]
+        if subset.get("partitioning") is not None:
+            console.print(f"Table [i]{table}[/i] is already partitioned")
+            return None
+
+        connection = db.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"SET LOCAL search_path TO {quote_identifier(db.schema)}"
+                )
+                cursor.execute(
+                    "SELECT min({0}), max({0}) FROM {1}".format(
+                        quote_identifier(PARTITION_COLUMN), quote_identifier(table)
+                    )
+                )
+                first, last = cursor.fetchone()
+
+                now = datetime.utcnow()
+                upcoming = get_partition_start(now, interval)
+                for _ in range(config.settings.partitions.premake):
+                    upcoming = get_next_partition_start(upcoming, interval)
+                starts = list(
+                    iter_partition_starts(
+                        min(first or now, now), max(last or now, upcoming), interval
+                    )
+                )
+
+                for query in get_migration_sql(table, starts, interval):
+                    cursor.execute(query)
+                cursor.execute(
+                    "UPDATE endpoint_request_subsets SET subset = %s "
+                    'WHERE "table" = %s',
+                    (
+                        json.dumps(
+                            {
+                                **subset,
+                                "partitioning": interval.value,
+                                "retention_days": retention_days,
+                            }
+                        ),
+                        table,
+                    ),
+                )
+            connection.commit()
+        finally:
+            connection.close()
+
+    console.print(
+        f"Converted [i]{table}[/i] into a table partitioned by {interval.value} "
+        f"with {len(starts)} partitions"
+    )
+
+
+@click.command()
+@click.argument("table")
+@click.option(
+    "--resolution",
+    "resolutions",
+    multiple=True,
+    type=click.IntRange(min=1),
+    help="Resolution in seconds of a rollup to add. Can be passed multiple times",
+)
+@click.option(
+    "--chunk_days",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Days of data refreshed per transaction",
+)
+@click.option(
+    "--no_wait",
+    is_flag=True,
+    help="Do not wait for running services to pick up the new rollups",
+)
+@click.option(
+    "--config_base",
+    default="config",
+    help="Base directory of the config files",
+)
+@click.option(
+    "--schema",
+    default=None,
+    help="Overwrite the schema set in the config",
+)
+def backfill_rollups(table, resolutions, chunk_days, no_wait, config_base, schema):
+    """
+    Add rollups to the sender table TABLE and (re)compute all rollups of the table from
+    the existing data. Without --resolution only the existing rollups are recomputed,
+    e.g. after a failed refresh at ingest time.
+    """
+    config = OrganizerConfig(
+        name="IoTRollups",
+        config_dir_base=config_base,
+    )
+
+    if schema is not None:
+        config.settings.db.schema = schema
+
+    with DatabaseConnection(
+        **get_connection_settings(config.settings.db), name="IoTRollups"
+    ) as db:
+        ers = Table("endpoint_request_subsets")
+        try:
+            data = db.query(
+                db.pypika_query.from_(ers)
+                .select(ers.subset)
+                .where(ers.table == table)
+                .get_sql()
+            )
+        except QueryReturnedNoData:
+            console.print(f"Table [i]{table}[/i] is not registered for any sender")
+            return None
+
+        subset = data[0][0]
+        existing = subset.get("rollups") or []
+        added = sorted(set(resolutions) - set(existing))
+        registration = Registration(
+            table, subset["fields"], rollups=[*existing, *added]
+        )
+        if not registration.rollups:
+            console.print(f"Table [i]{table}[/i] has no rollups")
+            return None
+
+        if added:
+            create_rollup_tables(db, registration, added)
+            connection = db.engine.raw_connection()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "UPDATE endpoint_request_subsets SET subset = %s "
+                        'WHERE "table" = %s',
+                        (
+                            json.dumps({**subset, "rollups": registration.rollups}),
+                            table,
+                        ),
+                    )
+                connection.commit()
+            finally:
+                connection.close()
+
+            if not no_wait:
+                # Rows written before the services know the rollups are only covered
+                # by the backfill if it starts after the registrations were reloaded
+                ttl = config.settings.registry.cache.ttl
+                console.print(
+                    f"Waiting {ttl}s until the services refresh the new rollups"
+                )
+                time.sleep(ttl)
+
+        first, last = db.query(
+            "SELECT min({0}), max({0}) FROM {1}".format(
+                quote_identifier(TIME_COLUMN), quote_identifier(table)
+            )
+        )[0]
+        if first is None:
+            console.print(f"Table [i]{table}[/i] contains no data")
+            return None
+
+        chunk = timedelta(days=chunk_days)
+        chunk_start = first
+        while chunk_start <= last:
+            chunk_end = min(chunk_start + chunk, last)
+            refresh_rollups(db, registration, chunk_start, chunk_end)
+            chunk_start += chunk
+
+    console.print(
+        f"Refreshed the rollups {registration.rollups} of [i]{table}[/i] "
+        f"from {first} to {last}"
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+import json
+import logging
+import select
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from psycopg2 import Error as DatabaseError
+from psycopg2 import errors
+
+from iot_data_receiver.endpoints import quote_identifier
+
+logger = logging.getLogger(__name__)
+
+# Channel the notify_cache_change trigger (see scripts/migrations) sends changes on
+CHANNEL = "iot_receiver_cache"
+
+# Maximum time in seconds a wait for notifications blocks close
+WAIT_TIMEOUT = 0.5
+
+
+class CacheListener:
+    """
+    Background thread keeping the caches of the process coherent with the senders,
+    registrations and gateway assignments in the database. Changes of these tables
+    are sent with NOTIFY by triggers, which also bump a version per table. Each
+    notification is passed to on_change, so the affected entries are invalidated
+    within milliseconds in all processes. Notifications sent while the connection
+    is lost are missed, so every poll_interval seconds the versions are compared
+    with the versions of the received notifications and on_reset is called for
+    the tables with missed changes.
+
+    :param connect: Function returning a new DB-API connection in autocommit mode
+    :param schema: Schema of the tables. Changes in other schemas are ignored
+    :param on_change: Called with the table name, the operation (INSERT, UPDATE or
+                      DELETE) and the key columns of a changed row
+    :param on_reset: Called with the names of tables that may have missed changes
+    :param poll_interval: Time in seconds between version checks and reconnects
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        schema: str,
+        on_change: Callable[[str, str, Dict[str, Any]], None],
+        on_reset: Callable[[List[str]], None],
+        poll_interval: float,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.connect = connect
+        self.schema = schema
+        self.on_change = on_change
+        self.on_reset = on_reset
+        self.poll_interval = poll_interval
+        self.timer = timer
+
+        self.notifications = 0
+        self.resets = 0
+        self._versions: Dict[str, int] = {}
+        self._versions_available = True
+        self._connection: Optional[Any] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="CacheListener", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def connected(self) -> bool:
+        return self._connection is not None
+
+    def _run(self) -> None:
+        next_check = 0.0
+        while not self._stop.is_set():
+            try:
+                if self._connection is None:
+                    self._listen()
+                    next_check = 0.0
+                self._receive(WAIT_TIMEOUT)
+                if self.timer() >= next_check:
+                    self.check_versions()
+                    next_check = self.timer() + self.poll_interval
+            except (DatabaseError, OSError) as e:
+                logger.warning("Cache listener lost the connection: %s", e)
+                self._disconnect()
+                self._stop.wait(self.poll_interval)
+            except Exception as e:
+                logger.error("Cache listener failed: %s", e)
+                self._stop.wait(self.poll_interval)
+
+    def _listen(self) -> None:
+        connection = self.connect()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+        except Exception:
+            connection.close()
+            raise
+        self._connection = connection
+        logger.info("Listening for cache invalidations on %s", CHANNEL)
+
+    def _receive(self, timeout: float) -> None:
+        assert self._connection is not None
+        readable, _, _ = select.select([self._connection], [], [], timeout)
+        if not readable:
+            return
+        self._connection.poll()
+        notifies = list(self._connection.notifies)
+        self._connection.notifies.clear()
+        for notify in notifies:
+            self.handle_notification(notify.payload)
+
+    def handle_notification(self, payload: str) -> None:
+        try:
+            change = json.loads(payload)
+            if change["schema"] != self.schema:
+                return
+            table, operation, keys = (
+                change["table"],
+                change["operation"],
+                change["keys"],
+            )
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Invalid cache notification %s", payload)
+            return
+
+        self.notifications += 1
+        if change.get("version") is not None:
+            self._versions[table] = max(self._versions.get(table, 0), change["version"])
+        self.on_change(table, operation, keys)
+
+    def check_versions(self) -> None:
+        if not self._versions_available or self._connection is None:
+            return
+        try:
+            with self._connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT "name", "version" FROM {}.cache_versions'.format(
+                        quote_identifier(self.schema)
+                    )
+                )
+                versions = dict(cursor.fetchall())
+        except errors.UndefinedTable:
+            logger.warning(
+                "Table cache_versions does not exist. Changes missed while the "
+                "listener is disconnected are only picked up after the cache ttl"
+            )
+            self._versions_available = False
+            return
+        self.apply_versions(versions)
+
+    def apply_versions(self, versions: Dict[str, int]) -> List[str]:
+        """
+        Reset the caches of the tables with versions newer than the last received
+        notification. The first versions are only stored. Returns the reset tables.
+        """
+        missed = [
+            table
+            for table, version in versions.items()
+            if table in self._versions and version > self._versions[table]
+        ]
+        for table, version in versions.items():
+            self._versions.setdefault(table, version)
+        if missed:
+            logger.info("Missed changes of %s. Resetting their caches", missed)
+            self.resets += 1
+            for table in missed:
+                self._versions[table] = versions[table]
+            self.on_reset(missed)
+        return missed
+
+    def _disconnect(self) -> None:
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except DatabaseError:
+                pass
+            self._connection = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "connected": self.connected,
+            "notifications": self.notifications,
+            "resets": self.resets,
+        }
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._disconnect()
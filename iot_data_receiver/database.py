@@ -0,0 +1,262 @@
+import io
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+from data_organizer.db.connection import DatabaseConnection
+from psycopg2.extras import execute_values
+from sqlalchemy import create_engine
+
+from iot_data_receiver.endpoints import Registration
+
+logger = logging.getLogger(__name__)
+
+POOL_SETTINGS = ["pool_size", "max_overflow", "pool_pre_ping", "pool_recycle"]
+
+INSERT_PAGE_SIZE = 1000
+
+
+def get_connection_settings(db_settings: Any) -> Dict[str, Any]:
+    """Settings of the [db] section that are passed to the DatabaseConnection"""
+    return {
+        key: value
+        for key, value in db_settings.to_dict().items()
+        if key not in POOL_SETTINGS
+    }
+
+
+def get_pool_settings(db_settings: Any) -> Dict[str, Any]:
+    """Settings of the [db] section that configure the connection pool"""
+    return {
+        key: value
+        for key, value in db_settings.to_dict().items()
+        if key in POOL_SETTINGS
+    }
+
+
+class SharedDatabase:
+    """
+    Process-lifetime DatabaseConnection shared by all requests. The connection is
+    created on first use and its engine is replaced by one with a configured
+    connection pool. If the db settings change or the connection is not valid, a new
+    connection is created on the next call to get.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._db: Optional[DatabaseConnection] = None
+        self._settings_key: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def get(self, db_settings: Any) -> DatabaseConnection:
+        settings_key = repr(sorted(db_settings.to_dict().items()))
+        with self._lock:
+            if (
+                self._db is None
+                or not self._db.is_valid
+                or settings_key != self._settings_key
+            ):
+                self._close()
+                self._db = self._connect(db_settings)
+                self._settings_key = settings_key
+            return self._db
+
+    def _connect(self, db_settings: Any) -> DatabaseConnection:
+        connection_settings = get_connection_settings(db_settings)
+        db = DatabaseConnection(**connection_settings, name=self.name)
+        if not db.is_valid:
+            return db
+
+        pool_settings = get_pool_settings(db_settings)
+        url = db.engine.url
+        db.engine.dispose()
+        db.engine = create_engine(
+            url,
+            future=True,
+            connect_args={"options": f"-csearch_path={connection_settings['schema']}"},
+            **pool_settings,
+        )
+        logger.info("Created database engine with pool settings %s", pool_settings)
+        return db
+
+    def _close(self) -> None:
+        if self._db is not None:
+            logger.info("Closing DB")
+            self._db.close()
+            self._db = None
+            self._settings_key = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+    def pool_stats(self) -> Optional[Dict[str, int]]:
+        """Usage of the connection pool or None if no pool is created yet"""
+        db = self._db
+        if db is None or not hasattr(db.engine.pool, "checkedout"):
+            return None
+        pool = db.engine.pool
+        return {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+        }
+
+
+def insert_columns(
+    db: DatabaseConnection,
+    registration: Registration,
+    columns: Sequence[Sequence[Any]],
+) -> Dict[str, int]:
+    """
+    Insert column-oriented data with a single multi-row insert per page. The columns
+    are zipped into rows lazily, so no intermediate copy of the data is created.
+
+    :param db: DatabaseConnection used for the insert
+    :param registration: Registration of the table the data is inserted into
+    :param columns: Data of the columns in the order of the registered fields
+    :return: Number of inserted, updated and skipped rows
+    """
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            returned_rows = execute_values(
+                cursor,
+                registration.insert_sql,
+                zip(*columns),
+                page_size=INSERT_PAGE_SIZE,
+                fetch=True,
+            )
+        connection.commit()
+    finally:
+        connection.close()
+
+    return get_write_counts(len(columns[0]), returned_rows)
+
+
+def copy_columns(
+    db: DatabaseConnection,
+    registration: Registration,
+    columns: Sequence[Sequence[Any]],
+) -> Dict[str, int]:
+    """
+    Write column-oriented data with COPY FROM STDIN. The data is streamed into a
+    temporary staging table and inserted into the table of the registration from
+    there, so primary key and unique constraints are checked like for a insert.
+
+    :param db: DatabaseConnection used for the insert
+    :param registration: Registration of the table the data is inserted into
+    :param columns: Data of the columns in the order of the registered fields
+    :return: Number of inserted, updated and skipped rows
+    """
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(registration.create_staging_sql)
+            cursor.copy_expert(registration.copy_sql, CopyReader(zip(*columns)))
+            cursor.execute(registration.insert_from_staging_sql)
+            returned_rows = cursor.fetchall()
+        connection.commit()
+    finally:
+        connection.close()
+
+    return get_write_counts(len(columns[0]), returned_rows)
+
+
+def get_write_counts(
+    n_rows: int, returned_rows: Sequence[Tuple[bool]]
+) -> Dict[str, int]:
+    """
+    Count inserted, updated and skipped rows from the rows returned by a insert
+    with RETURNING (xmax = 0).
+    """
+    inserted = sum(1 for (is_inserted,) in returned_rows if is_inserted)
+    updated = len(returned_rows) - inserted
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "skipped": n_rows - inserted - updated,
+    }
+
+
+def deduplicate_columns(
+    registration: Registration, columns: Sequence[Sequence[Any]]
+) -> Sequence[Sequence[Any]]:
+    """
+    Keep only the last row of each primary key. Postgres rejects an upsert that
+    affects the same row twice (CardinalityViolation).
+    """
+    key_columns = [
+        columns[registration.fields.index(field)]
+        for field in registration.primary_fields
+    ]
+    last_rows = {key: i for i, key in enumerate(zip(*key_columns))}
+    if len(last_rows) == len(columns[0]):
+        return columns
+    rows = sorted(last_rows.values())
+    return [[column[i] for i in rows] for column in columns]
+
+
+def write_columns(
+    db: DatabaseConnection,
+    registration: Registration,
+    columns: Sequence[Sequence[Any]],
+    copy_threshold: int,
+) -> Dict[str, int]:
+    """
+    Write the columns with COPY if there are at least copy_threshold rows. For
+    upserts, rows replaced by a later row of the same batch are counted as skipped.
+    """
+    n_rows = len(columns[0])
+    if registration.upserts:
+        columns = deduplicate_columns(registration, columns)
+    if len(columns[0]) >= copy_threshold:
+        counts = copy_columns(db, registration, columns)
+    else:
+        counts = insert_columns(db, registration, columns)
+    counts["skipped"] += n_rows - len(columns[0])
+    return counts
+
+
+def format_copy_value(value: Any) -> str:
+    """Format a value for the text format of COPY"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class CopyReader(io.TextIOBase):
+    """File-like object streaming rows in the text format of COPY"""
+
+    def __init__(self, rows: Iterator[Sequence[Any]]) -> None:
+        self._rows = rows
+        self._buffer = ""
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: Optional[int] = -1) -> str:
+        lines = [self._buffer]
+        length = len(self._buffer)
+        while size is None or size < 0 or length < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            line = "\t".join(format_copy_value(value) for value in row) + "\n"
+            lines.append(line)
+            length += len(line)
+
+        data = "".join(lines)
+        if size is None or size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
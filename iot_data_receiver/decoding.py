@@ -0,0 +1,245 @@
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, Optional, Sequence, Type
+
+from pydantic import BaseModel
+
+from iot_data_receiver.model import INTEGER_RANGES
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPES = ["application/msgpack", "application/x-msgpack"]
+COLUMNAR_CONTENT_TYPE = "application/x-iot-columnar"
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+COLUMNAR_MAGIC = b"IOTC"
+COLUMNAR_VERSION = 1
+# magic, version, number of columns, number of rows
+COLUMNAR_HEADER = struct.Struct("<4sBBI")
+# Typecodes of the array module allowed for the columns of the pg types
+COLUMNAR_TYPECODES = {
+    "TIMESTAMP": ["q"],
+    "FLOAT": ["f", "d"],
+    "DOUBLE PRECISION": ["f", "d"],
+    "REAL": ["f", "d"],
+    "INT": ["i", "q"],
+    "INTEGER": ["i", "q"],
+    "BIGINT": ["i", "q"],
+    "SMALLINT": ["i", "q"],
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class UnsupportedEncoding(Exception):
+    pass
+
+
+class DecodeError(ValueError):
+    pass
+
+
+def get_content_type(content_type_header: Optional[str]) -> str:
+    if not content_type_header:
+        return JSON_CONTENT_TYPE
+    return content_type_header.split(";")[0].strip().lower()
+
+
+def decompress(body: bytes, content_encoding: Optional[str], max_size: int) -> bytes:
+    """
+    Decompress the body according to the Content-Encoding header (case-insensitive).
+    Raises a DecodeError if the decompressed body is larger than max_size bytes.
+    """
+    if content_encoding is not None:
+        content_encoding = content_encoding.strip().lower()
+    if not content_encoding or content_encoding == "identity":
+        data = body
+    elif content_encoding == "gzip":
+        decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+        try:
+            data = decompressor.decompress(body, max_size + 1)
+        except zlib.error as e:
+            raise DecodeError(f"Invalid gzip data: {e}")
+    elif content_encoding == "zstd":
+        if zstandard is None:
+            raise UnsupportedEncoding("zstd support requires the zstandard package")
+        try:
+            reader = zstandard.ZstdDecompressor().stream_reader(body)
+            chunks = []
+            size = 0
+            while size <= max_size:
+                chunk = reader.read(max_size + 1 - size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+            data = b"".join(chunks)
+        except zstandard.ZstdError as e:
+            raise DecodeError(f"Invalid zstd data: {e}")
+    else:
+        raise UnsupportedEncoding(f"Content-Encoding {content_encoding} not supported")
+
+    if len(data) > max_size:
+        raise DecodeError(f"Decompressed body exceeds {max_size} bytes")
+    return data
+
+
+def decode_body(body: bytes, content_type: str) -> Any:
+    """
+    Decode a JSON or MessagePack body. Columnar bodies are decoded with
+    decode_columnar.
+    """
+    if content_type in MSGPACK_CONTENT_TYPES:
+        if msgpack is None:
+            raise UnsupportedEncoding(
+                "MessagePack support requires the msgpack package"
+            )
+        try:
+            return msgpack.unpackb(body, timestamp=3)
+        except (ValueError, msgpack.UnpackException) as e:
+            raise DecodeError(f"Invalid MessagePack data: {e}")
+    raise UnsupportedEncoding(f"Content-Type {content_type} not supported")
+
+
+def decode_columnar(body: bytes, model: Type[BaseModel]) -> BaseModel:
+    """
+    Decode a body in the packed columnar format into the passed model. The column
+    data is read into arrays directly, so no per-element validation is necessary.
+    Only timestamps are still converted per element, to one datetime each. Integer
+    columns are checked against the range of their type.
+
+    Format (little endian): Header with magic b"IOTC", version (uint8), number of
+    columns (uint8) and number of rows (uint32). For each column: length of the name
+    (uint8), the name (utf-8), the typecode (one byte, q: int64 microseconds since
+    the epoch (UTC) or int64, i: int32, f: float32, d: float64) and the values.
+    """
+    if len(body) < COLUMNAR_HEADER.size:
+        raise DecodeError("Body too short")
+    magic, version, n_columns, n_rows = COLUMNAR_HEADER.unpack_from(body)
+    if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+        raise DecodeError("Invalid header")
+
+    properties = model.schema()["properties"]
+    offset = COLUMNAR_HEADER.size
+    columns: Dict[str, Any] = {}
+    for _ in range(n_columns):
+        try:
+            name_length = body[offset]
+            name = body[offset + 1 : offset + 1 + name_length].decode("utf-8")
+            typecode = chr(body[offset + 1 + name_length])
+        except (IndexError, UnicodeDecodeError):
+            raise DecodeError("Invalid column header")
+        offset += 2 + name_length
+
+        if name not in properties:
+            raise DecodeError(f"Unknown column {name}")
+        if name in columns:
+            raise DecodeError(f"Duplicate column {name}")
+        pg_type = properties[name]["pg_type"]
+        if typecode not in COLUMNAR_TYPECODES.get(pg_type, []):
+            raise DecodeError(f"Invalid type {typecode} for column {name}")
+
+        values = array(typecode)
+        end = offset + n_rows * values.itemsize
+        if end > len(body):
+            raise DecodeError(f"Not enough data for column {name}")
+        values.frombytes(body[offset:end])
+        if sys.byteorder == "big":  # pragma: no cover
+            values.byteswap()
+        offset = end
+
+        if pg_type == "TIMESTAMP":
+            try:
+                columns[name] = [EPOCH + timedelta(microseconds=v) for v in values]
+            except OverflowError:
+                raise DecodeError(f"Timestamp out of range in column {name}")
+        else:
+            if pg_type in INTEGER_RANGES and values:
+                low, high = INTEGER_RANGES[pg_type]
+                if min(values) < low or max(values) > high:
+                    raise DecodeError(f"Value out of range in column {name}")
+            columns[name] = values.tolist()
+
+    if offset != len(body):
+        raise DecodeError("Unexpected data after the last column")
+
+    missing = [
+        name for name in model.schema().get("required", []) if name not in columns
+    ]
+    if missing:
+        raise DecodeError(f"Missing required columns {missing}")
+
+    return model.construct(**columns)
+
+
+def to_epoch_microseconds(value: Any) -> int:
+    if isinstance(value, int):
+        return value
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def encode_columnar(
+    columns: Dict[str, Sequence[Any]], typecodes: Dict[str, str]
+) -> bytes:
+    """
+    Encode the columns in the packed columnar format. Timestamps can be passed as
+    datetime (naive datetimes are interpreted as UTC) or as int microseconds since the
+    epoch.
+    """
+    n_rows = len(next(iter(columns.values())))
+    parts = [
+        COLUMNAR_HEADER.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, len(columns), n_rows)
+    ]
+    for name, values in columns.items():
+        typecode = typecodes[name]
+        if typecode == "q":
+            values = [to_epoch_microseconds(value) for value in values]
+        data = array(typecode, values)
+        if sys.byteorder == "big":  # pragma: no cover
+            data.byteswap()
+        encoded_name = name.encode("utf-8")
+        parts.append(bytes([len(encoded_name)]) + encoded_name + typecode.encode())
+        parts.append(data.tobytes())
+    return b"".join(parts)
+
+
+async def iter_lines(
+    stream: AsyncIterator[bytes], max_line_size: int
+) -> AsyncIterator[bytes]:
+    """
+    Split a stream of bytes into lines. Empty lines are skipped. Raises a DecodeError
+    if a line is longer than max_line_size bytes.
+    """
+    pending: list[bytes] = []
+    pending_size = 0
+    async for chunk in stream:
+        *lines, rest = chunk.split(b"\n")
+        if lines:
+            lines[0] = b"".join(pending) + lines[0]
+            pending, pending_size = [], 0
+        for line in lines:
+            if len(line) > max_line_size:
+                raise DecodeError(f"Line exceeds {max_line_size} bytes")
+            if line.strip():
+                yield line
+        pending.append(rest)
+        pending_size += len(rest)
+        if pending_size > max_line_size:
+            raise DecodeError(f"Line exceeds {max_line_size} bytes")
+    line = b"".join(pending)
+    if line.strip():
+        yield line
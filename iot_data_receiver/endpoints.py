@@ -1,32 +1,174 @@
+import logging
 from abc import ABC, abstractmethod
-from enum import Enum
-from typing import Any, Dict, Type
+from datetime import datetime
+from importlib.metadata import entry_points
+from typing import Any, Dict, Iterable, List, Optional, Type
 
 from data_organizer.db.model import TableSetting, get_table_setting_from_dict
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, conint, create_model
 
-from iot_data_receiver.model import EnvironmentInput
+from iot_data_receiver.model import (
+    INTEGER_RANGES,
+    ColumnsInput,
+    ConflictPolicy,
+    EnvironmentInput,
+    PartitionInterval,
+    get_column_parser,
+    parse_columns,
+)
 
+logger = logging.getLogger(__name__)
 
-class Endpoint(str, Enum):
-    ENVIRONMENT = "environment"
+# Entry points of this group are loaded as EndpointDescription classes
+ENTRY_POINT_GROUP = "iot_data_receiver.endpoints"
 
-    def get_description_class(self):
-        if self == Endpoint.ENVIRONMENT:
-            return EnvironmentEndpointDescription
-        else:
-            raise NotImplementedError
+# Python types of the column types supported in endpoint definitions. Integers are
+# limited to the range of the column type
+COLUMN_TYPES: Dict[str, Any] = {
+    "TIMESTAMP": datetime,
+    "FLOAT": float,
+    "DOUBLE PRECISION": float,
+    "REAL": float,
+    **{ctype: conint(ge=low, le=high) for ctype, (low, high) in INTEGER_RANGES.items()},
+}
+
+
+def quote_identifier(name: str) -> str:
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+class Registration:
+    """
+    Resolved registration of a sender for an endpoint. Holds everything required to
+    write the data send to the endpoint, so it can be cached between requests.
+    """
+
+    def __init__(
+        self,
+        table_name: str,
+        fields: list[str],
+        primary_fields: Optional[list[str]] = None,
+        on_conflict: ConflictPolicy = ConflictPolicy.ERROR,
+        partitioning: Optional[PartitionInterval] = None,
+        retention_days: Optional[int] = None,
+        rollups: Optional[list[int]] = None,
+    ) -> None:
+        self.table_name = table_name
+        self.fields = fields
+        self.primary_fields = [
+            field for field in primary_fields or [] if field in fields
+        ]
+        self.on_conflict = on_conflict
+        self.partitioning = partitioning
+        self.retention_days = retention_days
+        # Resolutions in seconds of the rollup tables
+        self.rollups = sorted(rollups or [])
+        self.update_fields = [
+            field for field in fields if field not in self.primary_fields
+        ]
+        # Existing rows are overwritten, so a batch must not contain a primary key
+        # twice (see database.deduplicate_columns)
+        self.upserts = on_conflict == ConflictPolicy.UPDATE and bool(
+            self.update_fields and self.primary_fields
+        )
+
+        table = quote_identifier(table_name)
+        staging_table = quote_identifier(f"staging_{table_name}")
+        columns = ", ".join(quote_identifier(field) for field in fields)
+        # (xmax = 0) is true for inserted and false for updated rows
+        conflict_clause = self._get_conflict_clause() + " RETURNING (xmax = 0)"
+
+        self.insert_sql = f"INSERT INTO {table} ({columns}) VALUES %s{conflict_clause}"
+        # Bulk writes are copied into a temporary table first and inserted from there
+        self.create_staging_sql = (
+            f"CREATE TEMP TABLE {staging_table} ON COMMIT DROP AS "
+            f"SELECT {columns} FROM {table} WITH NO DATA"
+        )
+        self.copy_sql = f"COPY {staging_table} ({columns}) FROM STDIN"
+        self.insert_from_staging_sql = (
+            f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging_table}"
+            f"{conflict_clause}"
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "table_name": self.table_name,
+            "fields": self.fields,
+            "primary_fields": self.primary_fields,
+            "on_conflict": self.on_conflict.value,
+            "partitioning": (
+                self.partitioning.value if self.partitioning is not None else None
+            ),
+            "retention_days": self.retention_days,
+            "rollups": self.rollups,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Registration":
+        return cls(
+            data["table_name"],
+            data["fields"],
+            primary_fields=data["primary_fields"],
+            on_conflict=ConflictPolicy(data["on_conflict"]),
+            partitioning=(
+                PartitionInterval(data["partitioning"])
+                if data.get("partitioning") is not None
+                else None
+            ),
+            retention_days=data.get("retention_days"),
+            rollups=data.get("rollups"),
+        )
+
+    def _get_conflict_clause(self) -> str:
+        if self.upserts:
+            return " ON CONFLICT ({}) DO UPDATE SET {}".format(
+                ", ".join(quote_identifier(field) for field in self.primary_fields),
+                ", ".join(
+                    f"{quote_identifier(field)} = EXCLUDED.{quote_identifier(field)}"
+                    for field in self.update_fields
+                ),
+            )
+        if self.on_conflict != ConflictPolicy.ERROR:
+            return " ON CONFLICT DO NOTHING"
+        return ""
 
 
 class EndpointDescription(ABC):
+    """
+    Description of the data sent to an endpoint. The properties of the input model
+    (columns with pg_type, pg_is_primary and pg_is_unique) define the table created
+    for the senders registered for the endpoint.
+    """
+
+    name: str
+
+    _properties: Optional[Dict[str, Any]] = None
+    _fast_validation: Optional[bool] = None
+
     @abstractmethod
     def get_input_model(self) -> Type[BaseModel]:
         ...
 
     def get_input_model_properties(self) -> Dict[str, Any]:
+        # The schema is generated once instead of on every request
+        if self._properties is None:
+            self._properties = self.get_input_model().schema()["properties"]
+        return self._properties
+
+    def parse(self, data: Any, fast_validation: bool) -> BaseModel:
+        """
+        Validate the input data. With fast_validation, model.parse_columns is used if
+        all fields of the input model are supported by it.
+        """
         model = self.get_input_model()
-        schema = model.schema()
-        return schema["properties"]
+        if self._fast_validation is None:
+            self._fast_validation = all(
+                get_column_parser(field.type_) is not None
+                for field in model.__fields__.values()
+            )
+        if fast_validation and self._fast_validation:
+            return parse_columns(model, data)
+        return model.parse_obj(data)
 
     def generate_table_structure(
         self, table_name: str, fields: list[str]
@@ -43,6 +185,21 @@ class EndpointDescription(ABC):
             }
         return get_table_setting_from_dict(table_settings_dict)
 
+    def get_column_types(self, fields: list[str]) -> Dict[str, str]:
+        """Postgres types of the columns of the fields (all fields if empty)"""
+        return {
+            property: items["pg_type"]
+            for property, items in self.get_input_model_properties().items()
+            if not fields or property in fields
+        }
+
+    def get_primary_fields(self) -> list[str]:
+        return [
+            property
+            for property, items in self.get_input_model_properties().items()
+            if items["pg_is_primary"]
+        ]
+
     def get_final_fields(self, fields: list[str]) -> list[str]:
         properties = self.get_input_model_properties()
         final_fields = []
@@ -55,5 +212,116 @@ class EndpointDescription(ABC):
 
 
 class EnvironmentEndpointDescription(EndpointDescription):
+    name = "environment"
+
     def get_input_model(self) -> Type[BaseModel]:
         return EnvironmentInput
+
+
+class DefinedEndpointDescription(EndpointDescription):
+    """
+    Endpoint defined by its columns in the settings instead of code. Each column is
+    defined like the columns of the table definitions (ctype, is_primary, is_unique)
+    and is_nullable makes the field optional. A column timestamp of type TIMESTAMP is
+    required. The input model is created once from the definition.
+
+    :param name: Name of the endpoint
+    :param columns: Definitions of the columns by name
+    """
+
+    def __init__(self, name: str, columns: Dict[str, Dict[str, Any]]) -> None:
+        self.name = name
+        # Writes, partitions, rollups and queries are based on the timestamp column
+        timestamp = columns.get("timestamp")
+        if (
+            timestamp is None
+            or timestamp["ctype"].upper() != "TIMESTAMP"
+            or timestamp.get("is_nullable", False)
+        ):
+            raise ValueError(
+                f"Endpoint {name} requires a column timestamp of type TIMESTAMP "
+                "that is not nullable"
+            )
+        fields: Dict[str, Any] = {}
+        for column, definition in columns.items():
+            ctype = definition["ctype"].upper()
+            if ctype not in COLUMN_TYPES:
+                raise ValueError(
+                    f"Column {column} of endpoint {name} has the unsupported type "
+                    f"{ctype}. Supported are {list(COLUMN_TYPES)}"
+                )
+            is_nullable = definition.get("is_nullable", False)
+            column_type = list[COLUMN_TYPES[ctype]]  # type: ignore
+            fields[column] = (
+                Optional[column_type] if is_nullable else column_type,
+                Field(
+                    default=None if is_nullable else ...,
+                    alias=column,
+                    pg_type=ctype,
+                    pg_is_primary=definition.get("is_primary", False),
+                    pg_is_unique=definition.get("is_unique", False),
+                ),
+            )
+        self.input_model = create_model(
+            f"{name.title().replace('_', '')}Input", __base__=ColumnsInput, **fields
+        )
+
+    def get_input_model(self) -> Type[BaseModel]:
+        return self.input_model
+
+
+def _get_entry_points(group: str) -> Iterable[Any]:
+    all_entry_points = entry_points()
+    if hasattr(all_entry_points, "select"):
+        return all_entry_points.select(group=group)
+    return all_entry_points.get(group, [])  # pragma: no cover
+
+
+class EndpointRegistry:
+    """
+    Descriptions of all endpoints by name. Created once on startup, so the
+    description of an endpoint is a dict lookup on every request.
+    """
+
+    def __init__(self, descriptions: Iterable[EndpointDescription]) -> None:
+        self._descriptions: Dict[str, EndpointDescription] = {}
+        for description in descriptions:
+            if description.name in self._descriptions:
+                raise ValueError(f"Endpoint {description.name} is defined twice")
+            self._descriptions[description.name] = description
+
+    @classmethod
+    def load(
+        cls,
+        definitions: Dict[str, Dict[str, Dict[str, Any]]],
+        use_entry_points: bool = True,
+    ) -> "EndpointRegistry":
+        """
+        Registry with the environment endpoint, the EndpointDescription classes of
+        the ENTRY_POINT_GROUP entry points of installed packages and the endpoints
+        defined in the settings.
+
+        :param definitions: Column definitions (see DefinedEndpointDescription) by
+                            endpoint name
+        :param use_entry_points: If False, entry points are not loaded
+        """
+        descriptions: List[EndpointDescription] = [EnvironmentEndpointDescription()]
+        if use_entry_points:
+            for entry_point in _get_entry_points(ENTRY_POINT_GROUP):
+                descriptions.append(entry_point.load()())
+                logger.info("Loaded endpoint %s from entry point", entry_point.name)
+        for name, columns in definitions.items():
+            descriptions.append(DefinedEndpointDescription(name, columns))
+        return cls(descriptions)
+
+    def get(self, name: str) -> Optional[EndpointDescription]:
+        return self._descriptions.get(name)
+
+    def __getitem__(self, name: str) -> EndpointDescription:
+        return self._descriptions[name]
+
+    def names(self) -> List[str]:
+        return list(self._descriptions)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._descriptions
@@ -0,0 +1,77 @@
+import hmac
+from functools import lru_cache
+from hashlib import sha256
+from typing import Any, Dict, Optional, Type
+
+import passlib.utils.handlers as uh
+from passlib.context import CryptContext
+
+BCRYPT = "bcrypt"
+HMAC_SHA256 = "hmac_sha256"
+
+SCHEMES = [HMAC_SHA256, BCRYPT]
+
+
+class HMACSHA256(uh.StaticHandler):
+    """
+    Passlib handler hashing with HMAC-SHA256 keyed with a server-side pepper. Without
+    salt and work factor it is only suited for high-entropy secrets like the generated
+    api keys, where it takes microseconds instead of the milliseconds of bcrypt. Use
+    with_pepper to get a handler with the pepper set.
+    """
+
+    name = HMAC_SHA256
+    checksum_chars = uh.LOWER_HEX_CHARS
+    checksum_size = 64
+    _hash_prefix = "$hmac-sha256$"
+
+    pepper: Optional[bytes] = None
+
+    @classmethod
+    def with_pepper(cls, pepper: str) -> Type["HMACSHA256"]:
+        return type(
+            cls.__name__,
+            (cls,),
+            {"pepper": pepper.encode("utf-8"), "__module__": cls.__module__},
+        )
+
+    def _calc_checksum(self, secret: str | bytes) -> str:
+        if self.pepper is None:
+            raise TypeError("HMACSHA256 requires a pepper, see with_pepper")
+        if isinstance(secret, str):
+            secret = secret.encode("utf-8")
+        return hmac.new(self.pepper, secret, sha256).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def get_crypt_context(
+    scheme: str = BCRYPT, bcrypt_rounds: int = 12, pepper: Optional[str] = None
+) -> CryptContext:
+    """
+    Context hashing keys with scheme. Hashes of the other schemes (hmac_sha256 only if
+    a pepper is set) are still verified, but are deprecated, so they are replaced by
+    a hash with scheme on the next successful verification (see verify_and_update).
+
+    :param scheme: One of SCHEMES
+    :param bcrypt_rounds: Work factor of new bcrypt hashes
+    :param pepper: Secret key of hmac_sha256. Required if it is the scheme
+    """
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown hashing scheme {scheme}. Valid schemes: {SCHEMES}")
+    if scheme == HMAC_SHA256 and not pepper:
+        raise ValueError(f"The hashing scheme {HMAC_SHA256} requires a pepper")
+
+    handlers: Dict[str, Any] = {BCRYPT: BCRYPT}
+    if pepper:
+        handlers[HMAC_SHA256] = HMACSHA256.with_pepper(pepper)
+    return CryptContext(
+        schemes=list(handlers.values()),
+        default=scheme,
+        deprecated=[name for name in handlers if name != scheme],
+        bcrypt__default_rounds=bcrypt_rounds,
+    )
+
+
+def hash_token(token: str, **hashing: Any) -> str:
+    """Hash the token with the context of the hashing settings"""
+    return get_crypt_context(**hashing).hash(token)
@@ -0,0 +1,71 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Checks = Dict[str, Dict[str, Any]]
+
+
+class HealthChecker:
+    """
+    Background thread running the (expensive) readiness checks every interval
+    seconds. Probes only read the cached result, so they do not add load to the
+    database. Each check returns a dict with at least the key "ok"; the service is
+    ready if all checks are ok and the last result is not older than max_age seconds
+    (e.g. because a check hangs).
+
+    :param check: Function running all checks
+    :param interval: Time in seconds between two runs of the checks
+    :param max_age: Maximum age in seconds of a result counted as ready
+    """
+
+    def __init__(
+        self,
+        check: Callable[[], Checks],
+        interval: float,
+        max_age: float,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.check = check
+        self.interval = interval
+        self.max_age = max_age
+        self.timer = timer
+
+        self._checks: Optional[Checks] = None
+        self._checked_at = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="HealthChecker", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self.run_checks()
+            if self._stop.wait(self.interval):
+                return
+
+    def run_checks(self) -> Checks:
+        try:
+            checks = self.check()
+        except Exception as e:
+            logger.warning("Readiness checks failed: %s", e)
+            checks = {"checks": {"ok": False, "error": str(e)}}
+        self._checks, self._checked_at = checks, self.timer()
+        return checks
+
+    def result(self) -> Tuple[bool, Dict[str, Any]]:
+        """Whether the service is ready and the cached result of the checks"""
+        checks, checked_at = self._checks, self._checked_at
+        if checks is None:
+            return False, {"checks": None, "age": None}
+
+        age = self.timer() - checked_at
+        ready = age <= self.max_age and all(check["ok"] for check in checks.values())
+        return ready, {"checks": checks, "age": round(age, 3)}
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class TokenBucket:
+    """
+    Token bucket refilled with rate tokens per second up to burst tokens. Not
+    thread-safe, the RateLimiter holds a lock while using it.
+    """
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """
+        Take a token. Returns 0 if a token was available, otherwise the time in
+        seconds until the next token is available.
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Token bucket rate limits per sender and endpoint. The limit of a sender for an
+    endpoint is the limit set for the sender, else the limit set for the endpoint,
+    else the default limit. A rate of 0 disables the limit. Only the buckets of the
+    maxsize most recently limited senders and endpoints are kept (a new bucket is
+    full, so dropping a bucket only ever lets a sender send more).
+
+    :param rate: Default number of requests per second
+    :param burst: Default number of requests allowed at once
+    :param endpoints: Limits (dicts with rate and burst) per endpoint
+    :param senders: Limits (dicts with rate and burst) per sender name
+    :param maxsize: Maximum number of buckets
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        endpoints: Dict[str, Dict[str, float]],
+        senders: Dict[str, Dict[str, float]],
+        maxsize: int,
+        timer: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.default = {"rate": rate, "burst": burst}
+        self.endpoints = endpoints
+        self.senders = senders
+        self.maxsize = maxsize
+        self.timer = timer
+        self.throttled = 0
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_limit(self, sender_name: str, endpoint: str) -> Tuple[float, float]:
+        limit = {
+            **self.default,
+            **self.endpoints.get(endpoint, {}),
+            **self.senders.get(sender_name, {}),
+        }
+        return limit["rate"], max(limit["burst"], 1)
+
+    def check(self, sender_name: str, endpoint: str) -> float:
+        """
+        Count a request of the sender to the endpoint. Returns 0 if the request is
+        allowed, otherwise the time in seconds until the next request is allowed.
+        """
+        rate, burst = self.get_limit(sender_name, endpoint)
+        if rate <= 0:
+            return 0.0
+
+        key = (sender_name, endpoint)
+        with self._lock:
+            now = self.timer()
+            bucket = self._buckets.get(key)
+            if bucket is None or bucket.rate != rate or bucket.burst != burst:
+                bucket = TokenBucket(rate, burst, now)
+                self._buckets[key] = bucket
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+
+            retry_after = bucket.take(now)
+            if retry_after:
+                self.throttled += 1
+        return retry_after
+
+    def stats(self) -> Dict[str, Any]:
+        # Throttled requests per sender are counted by the metrics
+        return {"buckets": len(self._buckets), "throttled": self.throttled}
+
+
+class AdmissionControl:
+    """
+    Caps the number of requests processed at once in total (protecting the connection
+    pool) and per sender (so a single sender can not occupy all of them). Requests
+    over a cap are rejected instead of queued. A cap of 0 disables it.
+
+    :param max_concurrent: Maximum number of requests processed at once
+    :param max_per_sender: Maximum number of requests of one sender processed at once
+    """
+
+    TOTAL = "total"
+    SENDER = "sender"
+
+    def __init__(self, max_concurrent: int, max_per_sender: int) -> None:
+        self.max_concurrent = max_concurrent
+        self.max_per_sender = max_per_sender
+        self.active = 0
+        self.rejected: Counter = Counter()
+        self._active_per_sender: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def acquire(self, sender_name: str) -> Optional[str]:
+        """
+        Admit a request of the sender. Returns None if it was admitted (release has
+        to be called when it is done), otherwise the exceeded cap (TOTAL or SENDER).
+        """
+        with self._lock:
+            if self.max_per_sender and (
+                self._active_per_sender[sender_name] >= self.max_per_sender
+            ):
+                self.rejected[self.SENDER] += 1
+                return self.SENDER
+            if self.max_concurrent and self.active >= self.max_concurrent:
+                self.rejected[self.TOTAL] += 1
+                return self.TOTAL
+            self.active += 1
+            self._active_per_sender[sender_name] += 1
+        return None
+
+    def release(self, sender_name: str) -> None:
+        with self._lock:
+            self.active -= 1
+            self._active_per_sender[sender_name] -= 1
+            if not self._active_per_sender[sender_name]:
+                del self._active_per_sender[sender_name]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": self.active, "rejected": dict(self.rejected)}
@@ -1,33 +1,114 @@
 import json
 import logging
-from typing import Tuple
+import math
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
+from anyio import to_thread
 from data_organizer.config import OrganizerConfig
 from data_organizer.db.connection import DatabaseConnection
 from data_organizer.db.exceptions import QueryReturnedNoData
-from fastapi import Depends, FastAPI, HTTPException, Security
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Security
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import APIKeyHeader
-from passlib.context import CryptContext
+from psycopg2 import (
+    DatabaseError,
+    DataError,
+    IntegrityError,
+    NotSupportedError,
+    OperationalError,
+    ProgrammingError,
+)
+from psycopg2.errors import NotNullViolation, UniqueViolation
+from pydantic import BaseModel, ValidationError
+from pydantic.error_wrappers import ErrorWrapper
 from pypika import Table
-from sqlalchemy import text
+from sqlalchemy import bindparam, exc, text
+from starlette.concurrency import run_in_threadpool
 from starlette.status import (
+    HTTP_200_OK,
+    HTTP_202_ACCEPTED,
+    HTTP_207_MULTI_STATUS,
     HTTP_400_BAD_REQUEST,
     HTTP_403_FORBIDDEN,
+    HTTP_404_NOT_FOUND,
+    HTTP_409_CONFLICT,
+    HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+    HTTP_422_UNPROCESSABLE_ENTITY,
+    HTTP_429_TOO_MANY_REQUESTS,
     HTTP_500_INTERNAL_SERVER_ERROR,
     HTTP_503_SERVICE_UNAVAILABLE,
 )
 
-from iot_data_receiver.endpoints import Endpoint
-from iot_data_receiver.model import EnvironmentInput, RegisterInput
-from iot_data_receiver.utils import get_table_name
+from iot_data_receiver.buffer import BufferDurability, BufferFull, WriteBuffer
+from iot_data_receiver.cache import APIKeyCache, TTLCache
+from iot_data_receiver.coherence import CacheListener
+from iot_data_receiver.database import SharedDatabase, write_columns
+from iot_data_receiver.decoding import (
+    COLUMNAR_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    MSGPACK_CONTENT_TYPES,
+    NDJSON_CONTENT_TYPE,
+    DecodeError,
+    UnsupportedEncoding,
+    decode_body,
+    decode_columnar,
+    decompress,
+    get_content_type,
+    iter_lines,
+)
+from iot_data_receiver.endpoints import (
+    EndpointDescription,
+    EndpointRegistry,
+    EnvironmentEndpointDescription,
+    Registration,
+)
+from iot_data_receiver.hashing import get_crypt_context
+from iot_data_receiver.health import Checks, HealthChecker
+from iot_data_receiver.limits import AdmissionControl, RateLimiter
+from iot_data_receiver.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from iot_data_receiver.metrics import Metrics, MetricsMiddleware
+from iot_data_receiver.model import (
+    Aggregation,
+    ConflictPolicy,
+    EnvironmentInput,
+    GatewayInput,
+    PartitionInterval,
+    RegisterInput,
+)
+from iot_data_receiver.partitions import (
+    PARTITION_COLUMN,
+    PartitionMaintainer,
+    PartitionManager,
+    is_missing_partition_error,
+    maintain_partitions,
+)
+from iot_data_receiver.query import (
+    TIME_COLUMN,
+    InvalidCursor,
+    build_query,
+    decode_cursor,
+    execute_query,
+    get_query_parameters,
+    stream_json,
+)
+from iot_data_receiver.registration import InvalidRegistration, register_endpoint
+from iot_data_receiver.rollups import (
+    build_rollup_query,
+    choose_rollup,
+    refresh_rollups_for_columns,
+)
+from iot_data_receiver.spool import InvalidRecord, Spool, SpoolFull, SpoolReplayer
+from iot_data_receiver.utils import get_key_lookup, normalize_timestamps
 
 FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 logging.basicConfig(format=FORMAT, level=logging.DEBUG)
 logger = logging.getLogger("__name__")
 
-app = FastAPI()
+REQUIRED_TABLES = ["senders", "endpoint_request_subsets"]
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+app = FastAPI()
 
 api_key_header = APIKeyHeader(name="access_token", auto_error=False)
 
@@ -36,105 +117,1150 @@ config = OrganizerConfig(
     config_dir_base="config/",
 )
 
+pwd_context = get_crypt_context(**config.settings.auth.hashing.to_dict())
+
+api_key_cache = APIKeyCache(**config.settings.auth.cache.to_dict())
+
+registration_cache = TTLCache(
+    maxsize=config.settings.registry.cache.size,
+    ttl=config.settings.registry.cache.ttl,
+)
+
+gateway_cache = TTLCache(
+    maxsize=config.settings.registry.cache.size,
+    ttl=config.settings.registry.cache.ttl,
+)
+
+shared_db = SharedDatabase(name="IoTReceiver")
+
+endpoint_registry = EndpointRegistry.load(
+    config.settings.endpoints.definitions.to_dict(),
+    use_entry_points=config.settings.endpoints.entry_points,
+)
+environment_description = endpoint_registry[EnvironmentEndpointDescription.name]
+
+rate_limiter = RateLimiter(
+    rate=config.settings.limits.rate,
+    burst=config.settings.limits.burst,
+    endpoints=config.settings.limits.endpoints.to_dict(),
+    senders=config.settings.limits.senders.to_dict(),
+    maxsize=config.settings.limits.max_buckets,
+)
+admission_control = AdmissionControl(
+    max_concurrent=config.settings.limits.max_concurrent,
+    max_per_sender=config.settings.limits.max_concurrent_per_sender,
+)
+
+metrics = Metrics(
+    enabled=config.settings.metrics.enabled, pool_stats=shared_db.pool_stats
+)
+metrics.register_stats("auth_cache", api_key_cache.stats)
+metrics.register_stats("registration_cache", registration_cache.stats)
+metrics.register_stats("gateway_cache", gateway_cache.stats)
+metrics.register_stats("rate_limiter", rate_limiter.stats)
+metrics.register_stats("admission_control", admission_control.stats)
+
+write_buffer: Optional[WriteBuffer] = None
+spool: Optional[Spool] = None
+spool_replayer: Optional[SpoolReplayer] = None
+health_checker: Optional[HealthChecker] = None
+partition_maintainer: Optional[PartitionMaintainer] = None
+cache_listener: Optional[CacheListener] = None
+
+partition_manager = PartitionManager()
+
+# The components are created on startup
+metrics.register_stats(
+    "cache_listener",
+    lambda: cache_listener.stats() if cache_listener is not None else None,
+)
+metrics.register_stats(
+    "write_buffer", lambda: write_buffer.stats() if write_buffer is not None else None
+)
+metrics.register_stats(
+    "spool",
+    lambda: (
+        {**spool.stats(), **spool_replayer.stats()}
+        if spool is not None and spool_replayer is not None
+        else None
+    ),
+)
+
+
+@app.on_event("startup")
+def startup() -> None:
+    global write_buffer, spool, spool_replayer, health_checker, partition_maintainer
+    global cache_listener
+    # Routes and dependencies are sync functions (blocking database access and key
+    # verification) and run in the threadpool. Its size limits the number of requests
+    # processed concurrently.
+    to_thread.current_default_thread_limiter().total_tokens = (
+        config.settings.server.thread_pool_size
+    )
+    shared_db.get(config.settings.db)
+
+    spool_settings = config.settings.ingest.spool
+    if spool_settings.enabled:
+        spool = Spool(
+            directory=spool_settings.directory,
+            segment_size=spool_settings.segment_size,
+            max_size=spool_settings.max_size,
+            fsync_interval=spool_settings.fsync_interval,
+        )
+        spool_replayer = SpoolReplayer(
+            spool,
+            write=replay_record,
+            replay_interval=spool_settings.replay_interval,
+            replay_rate=spool_settings.replay_rate,
+        )
+
+    buffer_settings = config.settings.ingest.buffer
+    if buffer_settings.enabled:
+        write_buffer = WriteBuffer(
+            write=lambda registration, columns: save_columns(
+                get_db(), registration, columns
+            ),
+            max_rows=buffer_settings.max_rows,
+            flush_rows=buffer_settings.flush_rows,
+            flush_interval=buffer_settings.flush_interval,
+        )
+
+    health_checker = HealthChecker(
+        run_readiness_checks,
+        interval=config.settings.health.interval,
+        max_age=config.settings.health.max_age,
+    )
+    partition_maintainer = PartitionMaintainer(
+        run_partition_maintenance,
+        interval=config.settings.partitions.maintenance_interval,
+    )
+    if config.settings.coherence.enabled:
+        cache_listener = CacheListener(
+            connect_cache_listener,
+            schema=config.settings.db.schema,
+            on_change=invalidate_cached_row,
+            on_reset=reset_caches,
+            poll_interval=config.settings.coherence.poll_interval,
+        )
+
+
+@app.on_event("shutdown")
+def shutdown() -> None:
+    global write_buffer, spool, spool_replayer, health_checker, partition_maintainer
+    global cache_listener
+    if cache_listener is not None:
+        cache_listener.close()
+        cache_listener = None
+    if health_checker is not None:
+        health_checker.close()
+        health_checker = None
+    if partition_maintainer is not None:
+        partition_maintainer.close()
+        partition_maintainer = None
+    if write_buffer is not None:
+        logger.info("Writing buffered data")
+        write_buffer.close()
+        write_buffer = None
+    if spool_replayer is not None:
+        spool_replayer.close()
+        spool_replayer = None
+    if spool is not None:
+        spool.close()
+        spool = None
+    shared_db.close()
+
 
 def get_db() -> DatabaseConnection:
-    db = DatabaseConnection(**config.settings.db.to_dict(), name="IoTReceiver")
-    try:
-        yield db
-    finally:
-        logger.info("Closing DB")
-        db.close()
+    return shared_db.get(config.settings.db)
+
 
+def invalidate_sender(sender_id: int) -> None:
+    """
+    Remove all cached api keys of the sender. Has to be called if a key is revoked or
+    changed, otherwise the old key stays valid until the cache entry expires. Called
+    by the cache listener for changes in any process.
+    """
+    removed = api_key_cache.invalidate_sender(sender_id)
+    logger.info("Invalidated %s cached key(s) of sender %s", removed, sender_id)
+
+
+def connect_cache_listener() -> Any:
+    """Connection of the cache listener, detached from the pool of the shared db"""
+    connection = get_db().engine.raw_connection()
+    connection.detach()
+    connection.connection.autocommit = True
+    return connection
+
+
+def invalidate_cached_row(table: str, operation: str, keys: Dict[str, Any]) -> None:
+    """Remove the cache entries depending on a changed row (see CacheListener)"""
+    if table == "senders":
+        sender_id = keys["id"]
+        invalidate_sender(sender_id)
+        if operation == "INSERT":
+            # The key of a new sender may have been rejected before it was created
+            api_key_cache.clear_rejected()
+        gateway_cache.remove_if(
+            lambda gateway_id, senders: gateway_id == sender_id
+            or sender_id in senders.values()
+        )
+    elif table == "endpoint_request_subsets":
+        registration_cache.pop((keys["id"], keys["endpoint"]))
+    elif table == "gateway_senders":
+        gateway_cache.pop(keys["gateway_id"])
+
+
+def reset_caches(tables: List[str]) -> None:
+    """Clear the caches depending on the tables (see CacheListener)"""
+    if "senders" in tables:
+        api_key_cache.clear()
+    if "senders" in tables or "gateway_senders" in tables:
+        gateway_cache.clear()
+    if "endpoint_request_subsets" in tables:
+        registration_cache.clear()
 
-def verify_api_key(plain_api_key, hashed_api_key):
-    return pwd_context.verify(plain_api_key, hashed_api_key)
 
+def get_remaining_seconds(expires: Optional[datetime]) -> float:
+    """Seconds until expires (a naive UTC time, like previous_key_expires)"""
+    if expires is None:
+        return 0.0
+    return (expires - datetime.utcnow()).total_seconds()
 
-async def get_api_key(
+
+def verify_api_key(
+    plain_api_key: str,
+    hashed_api_key: str,
+    db: DatabaseConnection,
+    sender_id: int,
+    column: str = "hashed_key",
+) -> bool:
+    """
+    Verify the key against its hash. Hashes of a deprecated scheme (every scheme but
+    auth.hashing.scheme) are replaced by a hash with the configured scheme in the
+    column of the sender, so existing keys are upgraded on their next use. Hashes of
+    a scheme that is not enabled are treated as invalid.
+    """
+    with metrics.stage("verify_key"):
+        try:
+            valid, new_hash = pwd_context.verify_and_update(
+                plain_api_key, hashed_api_key
+            )
+        except ValueError as e:
+            # E.g. a hmac_sha256 hash after the pepper was removed from the settings
+            logger.error("Can not verify the key of sender %s: %s", sender_id, e)
+            return False
+    if valid and new_hash is not None:
+        rehash_api_key(db, sender_id, column, hashed_api_key, new_hash)
+    return valid
+
+
+def rehash_api_key(
+    db: DatabaseConnection,
+    sender_id: int,
+    column: str,
+    hashed_api_key: str,
+    new_hash: str,
+) -> None:
+    senders = Table("senders")
+    query = (
+        db.pypika_query.update(senders)
+        .set(senders.field(column), new_hash)
+        .where(senders.id == sender_id)
+        # Skipped if the key was changed (e.g. rotated) in the meantime
+        .where(senders.field(column) == hashed_api_key)
+        .get_sql()
+    )
+    try:
+        with db.engine.connect() as connection:
+            connection.execute(text(query))
+            connection.commit()
+    except (exc.SQLAlchemyError, DatabaseError) as e:
+        # The old hash stays valid, so the upgrade is retried on the next request
+        logger.warning("Could not rehash the key of sender %s: %s", sender_id, e)
+        return
+    logger.info("Rehashed %s of sender %s", column, sender_id)
+
+
+def get_api_key(
     api_key_header: str = Security(api_key_header), db=Depends(get_db)
 ) -> Tuple[str, str, int]:
     if api_key_header is None:
+        metrics.count_auth_failure("missing")
         raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="No API Key sent")
 
+    if api_key_cache.is_rejected(api_key_header):
+        metrics.count_auth_failure("rejected")
+        raise HTTPException(
+            status_code=HTTP_403_FORBIDDEN, detail="Could not validate API KEY"
+        )
+
+    cached_sender = api_key_cache.get(api_key_header)
+    if cached_sender is not None:
+        sender_name, sender_id = cached_sender
+        return api_key_header, sender_name, sender_id
+
+    # Read before the database, so results are not cached if the sender changes while
+    # the key is verified
+    generation = api_key_cache.generation
+    senders = Table("senders")
+    key_lookup = get_key_lookup(api_key_header)
+    try:
+        with metrics.stage("sender_lookup"):
+            sender_and_keys = db.query(
+                db.pypika_query.from_(senders)
+                .select(
+                    senders.hashed_key,
+                    senders.key_lookup,
+                    senders.previous_hashed_key,
+                    senders.previous_key_expires,
+                    senders.sender_name,
+                    senders.id,
+                )
+                .where(
+                    (senders.key_lookup == key_lookup)
+                    | (senders.previous_key_lookup == key_lookup)
+                )
+                .get_sql()
+            )
+    except QueryReturnedNoData:
+        sender_and_keys = []
+
+    for (
+        hashed_key,
+        current_key_lookup,
+        previous_hashed_key,
+        previous_key_expires,
+        sender_name,
+        sender_id,
+    ) in sender_and_keys:
+        if current_key_lookup == key_lookup:
+            if verify_api_key(api_key_header, hashed_key, db, sender_id):
+                api_key_cache.add(
+                    api_key_header, sender_name, sender_id, generation=generation
+                )
+                return api_key_header, sender_name, sender_id
+        else:
+            # Key replaced by rotate_keys, valid until the overlap window ends
+            remaining = get_remaining_seconds(previous_key_expires)
+            if remaining > 0 and verify_api_key(
+                api_key_header,
+                previous_hashed_key,
+                db,
+                sender_id,
+                "previous_hashed_key",
+            ):
+                api_key_cache.add(
+                    api_key_header, sender_name, sender_id, remaining, generation
+                )
+                return api_key_header, sender_name, sender_id
+
+    if config.settings.auth.legacy_key_fallback:
+        legacy_sender = get_legacy_sender(api_key_header, key_lookup, db)
+        if legacy_sender is not None:
+            _, sender_name, sender_id = legacy_sender
+            api_key_cache.add(
+                api_key_header, sender_name, sender_id, generation=generation
+            )
+            return legacy_sender
+
+    api_key_cache.reject(api_key_header, generation)
+    metrics.count_auth_failure("invalid")
+    raise HTTPException(
+        status_code=HTTP_403_FORBIDDEN, detail="Could not validate API KEY"
+    )
+
+
+def get_sender_admission(
+    endpoint: Optional[str] = None,
+) -> Callable[..., Iterator[Tuple[str, str, int]]]:
+    """
+    Dependency returning the sender like get_api_key, but only after the rate limit of
+    the sender for the endpoint (the endpoint path parameter if not passed) and the
+    concurrency caps admitted the request. Rejected requests are answered before the
+    body is processed and without any database access (for cached keys).
+    """
+
+    def admit(
+        request: Request, sender: Tuple[str, str, int] = Depends(get_api_key)
+    ) -> Iterator[Tuple[str, str, int]]:
+        endpoint_name = endpoint
+        if endpoint_name is None:
+            endpoint_name = request.path_params["endpoint"]
+            # Unknown endpoints are rejected by the route
+            if endpoint_name not in endpoint_registry:
+                endpoint_name = "other"
+        _, sender_name, _ = sender
+
+        retry_after = rate_limiter.check(sender_name, endpoint_name)
+        if retry_after:
+            metrics.count_throttled(sender_name, endpoint_name, "rate")
+            raise HTTPException(
+                status_code=HTTP_429_TOO_MANY_REQUESTS,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+
+        exceeded = admission_control.acquire(sender_name)
+        if exceeded is not None:
+            metrics.count_throttled(
+                sender_name, endpoint_name, f"{exceeded}_concurrency"
+            )
+            if exceeded == AdmissionControl.SENDER:
+                raise HTTPException(
+                    status_code=HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many concurrent requests of the sender",
+                    headers={"Retry-After": "1"},
+                )
+            raise HTTPException(
+                status_code=HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent requests",
+                headers={"Retry-After": "1"},
+            )
+        try:
+            yield sender
+        finally:
+            admission_control.release(sender_name)
+
+    return admit
+
+
+admit_environment = get_sender_admission(EnvironmentEndpointDescription.name)
+admit_ingest = get_sender_admission()
+admit_gateway = get_sender_admission("gateway")
+admit_query = get_sender_admission("query")
+
+
+def get_legacy_sender(
+    api_key: str, key_lookup: str, db: DatabaseConnection
+) -> Optional[Tuple[str, str, int]]:
+    """
+    Verify the passed key against all senders without a key lookup id (keys created
+    before the lookup id was introduced). On a match, the lookup id is stored for the
+    sender so all following requests use the indexed lookup.
+    """
     senders = Table("senders")
     try:
         sender_and_keys = db.query(
             db.pypika_query.from_(senders)
             .select(senders.hashed_key, senders.sender_name, senders.id)
+            .where(senders.key_lookup.isnull())
             .get_sql()
         )
     except QueryReturnedNoData:
+        return None
+
+    for hashed_key, sender_name, sender_id in sender_and_keys:
+        if verify_api_key(api_key, hashed_key, db, sender_id):
+            with db.engine.connect() as connection:
+                query = (
+                    db.pypika_query.update(senders)
+                    .set(senders.key_lookup, key_lookup)
+                    .where(senders.id == sender_id)
+                    .get_sql()
+                )
+                logger.debug(query)
+                connection.execute(text(query))
+                connection.commit()
+            logger.info("Migrated key of sender %s to key lookup", sender_name)
+            return api_key, sender_name, sender_id
+
+    return None
+
+
+def get_endpoint_description(
+    endpoint: str, status_code: int = HTTP_404_NOT_FOUND
+) -> EndpointDescription:
+    description = endpoint_registry.get(endpoint)
+    if description is None:
         raise HTTPException(
-            status_code=HTTP_503_SERVICE_UNAVAILABLE,
-            detail="Internal database could not be reached",
+            status_code=status_code, detail=f"Invalid endpoint {endpoint} was passed"
         )
+    return description
 
-    for hashed_key, sender_name, sender_id in sender_and_keys:
-        if verify_api_key(api_key_header, hashed_key):
-            return api_key_header, sender_name, sender_id
 
-    raise HTTPException(
-        status_code=HTTP_403_FORBIDDEN, detail="Could not validate API KEY"
+def get_registration(
+    sender_id: int, description: EndpointDescription, db: DatabaseConnection
+) -> Registration:
+    """
+    Get the registration of the sender for the endpoint. Registrations are cached for
+    the ttl set in registry.cache, because they only change on calls to /register.
+    """
+    endpoint = description.name
+    registration = registration_cache.get((sender_id, endpoint))
+    if registration is not None:
+        return registration
+
+    generation = registration_cache.generation
+    ers = Table("endpoint_request_subsets")
+    try:
+        with metrics.stage("registration_lookup"):
+            data = db.query(
+                db.pypika_query.from_(ers)
+                .select(ers.table, ers.subset)
+                .where(ers.id == sender_id)
+                .where(ers.endpoint == endpoint)
+                .get_sql()
+            )
+    except QueryReturnedNoData:
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST, detail="Endpoint not registered"
+        )
+
+    table, subset = data[0]
+    registration = build_registration(description, table, subset)
+    registration_cache.set((sender_id, endpoint), registration, generation=generation)
+
+    return registration
+
+
+def build_registration(
+    description: EndpointDescription, table: str, subset: Dict[str, Any]
+) -> Registration:
+    """Registration from a row of the endpoint_request_subsets table"""
+    partitioning = subset.get("partitioning")
+    return Registration(
+        table,
+        subset["fields"],
+        primary_fields=description.get_primary_fields(),
+        on_conflict=ConflictPolicy(subset.get("on_conflict", ConflictPolicy.ERROR)),
+        partitioning=(
+            PartitionInterval(partitioning) if partitioning is not None else None
+        ),
+        retention_days=subset.get("retention_days"),
+        rollups=subset.get("rollups"),
     )
 
 
-@app.post("/environment")
-async def environment(
-    environment_input: EnvironmentInput,
-    sender: Tuple[str, str, int] = Depends(get_api_key),
+def parse_input(description: EndpointDescription, data: Any) -> BaseModel:
+    return description.parse(data, config.settings.ingest.fast_validation)
+
+
+async def read_input(request: Request, description: EndpointDescription) -> BaseModel:
+    """
+    Read the body of a request with data for the endpoint. Supported are JSON,
+    MessagePack and the packed columnar format (see decoding.decode_columnar) selected
+    by the Content-Type header. The body can be compressed with gzip or zstd
+    (Content-Encoding header). With ingest.fast_validation, JSON and MessagePack
+    bodies are validated with model.parse_columns.
+    """
+    content_type = get_content_type(request.headers.get("content-type"))
+    raw_body = await request.body()
+    try:
+        with metrics.stage("decode"):
+            body = decompress(
+                raw_body,
+                request.headers.get("content-encoding"),
+                config.settings.ingest.max_body_size,
+            )
+            if content_type == COLUMNAR_CONTENT_TYPE:
+                return decode_columnar(body, description.get_input_model())
+            if content_type == JSON_CONTENT_TYPE:
+                return parse_input(description, json.loads(body))
+            return parse_input(description, decode_body(body, content_type))
+    except UnsupportedEncoding as e:
+        raise HTTPException(status_code=HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(e))
+    except DecodeError as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e))
+    except json.JSONDecodeError as e:
+        raise RequestValidationError([ErrorWrapper(e, ("body", e.pos))])
+    except ValidationError as e:
+        raise RequestValidationError([ErrorWrapper(e, ("body",))])
+
+
+async def get_environment_input(request: Request) -> EnvironmentInput:
+    return await read_input(request, environment_description)
+
+
+async def get_ingest_input(
+    endpoint: str, request: Request
+) -> Tuple[EndpointDescription, BaseModel]:
+    description = get_endpoint_description(endpoint)
+    return description, await read_input(request, description)
+
+
+@app.post(
+    "/environment",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                JSON_CONTENT_TYPE: {"schema": EnvironmentInput.schema()},
+                MSGPACK_CONTENT_TYPES[0]: {"schema": EnvironmentInput.schema()},
+                COLUMNAR_CONTENT_TYPE: {
+                    "schema": {"type": "string", "format": "binary"}
+                },
+            },
+        }
+    },
+)
+def environment(
+    sender: Tuple[str, str, int] = Depends(admit_environment),
+    environment_input: EnvironmentInput = Depends(get_environment_input),
+    db: DatabaseConnection = Depends(get_db),
+):
+    return ingest_input(environment_description, environment_input, sender, db)
+
+
+@app.post(
+    "/ingest/{endpoint}",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                JSON_CONTENT_TYPE: {"schema": {"type": "object"}},
+                MSGPACK_CONTENT_TYPES[0]: {"schema": {"type": "object"}},
+                COLUMNAR_CONTENT_TYPE: {
+                    "schema": {"type": "string", "format": "binary"}
+                },
+            },
+        }
+    },
+)
+def ingest(
+    sender: Tuple[str, str, int] = Depends(admit_ingest),
+    ingest_input_: Tuple[EndpointDescription, BaseModel] = Depends(get_ingest_input),
     db: DatabaseConnection = Depends(get_db),
 ):
-    endpoint = Endpoint.ENVIRONMENT
+    """
+    Generic version of the data endpoints (like /environment) for all endpoints of
+    the registry, including the endpoints defined in the settings and by plugins.
+    """
+    description, data = ingest_input_
+    return ingest_input(description, data, sender, db)
+
+
+def get_integrity_error(e: IntegrityError) -> HTTPException:
+    """HTTPException for a constraint violation while writing the data of a request"""
+    if isinstance(e, UniqueViolation):
+        return HTTPException(
+            status_code=HTTP_409_CONFLICT,
+            detail="Data for at least one of the passed timestamps already exists",
+        )
+    message = e.diag.message_primary or str(e)
+    if isinstance(e, NotNullViolation):
+        return HTTPException(
+            status_code=HTTP_400_BAD_REQUEST,
+            detail=f"Data contains null values for a required column: {message}",
+        )
+    if is_missing_partition_error(e):
+        # Partitions are created before the write, so this is not the sender's fault
+        return HTTPException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="No partition exists for at least one of the passed timestamps",
+        )
+    return HTTPException(
+        status_code=HTTP_400_BAD_REQUEST,
+        detail=f"Data violates a constraint of the table: {message}",
+    )
+
+
+def get_data_error(e: DataError) -> HTTPException:
+    """HTTPException for values the table can not store (e.g. out of range)"""
+    message = e.diag.message_primary or str(e)
+    return HTTPException(
+        status_code=HTTP_400_BAD_REQUEST,
+        detail=f"Data can not be stored in the table: {message}",
+    )
+
+
+def ingest_input(
+    description: EndpointDescription,
+    data: BaseModel,
+    sender: Tuple[str, str, int],
+    db: DatabaseConnection,
+):
+    """Write the validated input of a sender to the table of its registration"""
+    endpoint = description.name
     key, sender_name, sender_id = sender
 
-    ers = Table("endpoint_request_subsets")
+    registration = get_registration(sender_id, description, db)
+    columns = get_registered_columns(data, registration)
+
+    try:
+        if write_buffer is not None:
+            response = buffer_columns(registration, columns, endpoint)
+            metrics.count_rows(sender_name, endpoint, len(columns[0]))
+            return response
+        counts = save_columns(db, registration, columns)
+    except IntegrityError as e:
+        raise get_integrity_error(e)
+    except DataError as e:
+        raise get_data_error(e)
+    metrics.count_rows(sender_name, endpoint, len(columns[0]))
+
+    if counts is None:
+        return get_spooled_response(endpoint)
+
+    return {"message": f"Received {endpoint} data", **counts}
+
+
+def get_spooled_response(endpoint: str) -> JSONResponse:
+    return JSONResponse(
+        status_code=HTTP_202_ACCEPTED,
+        content={
+            "message": f"Received {endpoint} data. Database is not reachable, "
+            "the data will be saved later"
+        },
+    )
+
+
+@app.post(
+    "/environment/stream",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {NDJSON_CONTENT_TYPE: {"schema": EnvironmentInput.schema()}},
+        }
+    },
+)
+async def environment_stream(
+    request: Request,
+    sender: Tuple[str, str, int] = Depends(admit_environment),
+    db: DatabaseConnection = Depends(get_db),
+):
+    """
+    Streaming version of /environment for large uploads. The body is newline delimited
+    JSON where each line (chunk) is an object like the /environment input. Every chunk
+    is validated and written on its own while the body is read, so the memory usage
+    does not depend on the size of the upload. If a chunk fails, processing stops
+    and the response contains the number of committed chunks, which is the index of
+    the failed chunk. All chunks before it are saved.
+    """
+    key, sender_name, sender_id = sender
+
+    if get_content_type(request.headers.get("content-type")) != NDJSON_CONTENT_TYPE:
+        raise HTTPException(
+            status_code=HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail=f"Content-Type has to be {NDJSON_CONTENT_TYPE}",
+        )
+    content_encoding = request.headers.get("content-encoding", "identity")
+    if content_encoding.strip().lower() != "identity":
+        raise HTTPException(
+            status_code=HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Content-Encoding is not supported for streamed data",
+        )
+
+    registration = await run_in_threadpool(
+        get_registration, sender_id, environment_description, db
+    )
+
+    totals = {"inserted": 0, "updated": 0, "skipped": 0}
+    committed_chunks = 0
+    spooled_chunks = 0
+    try:
+        async for line in iter_lines(
+            request.stream(), config.settings.ingest.max_body_size
+        ):
+            counts = await run_in_threadpool(
+                save_chunk, db, environment_description, registration, line, sender_name
+            )
+            if counts is None:
+                spooled_chunks += 1
+            else:
+                for name in totals:
+                    totals[name] += counts[name]
+            committed_chunks += 1
+    except HTTPException as e:
+        error = e
+    except DecodeError as e:
+        error = HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e))
+    except (json.JSONDecodeError, UnicodeDecodeError, ValidationError) as e:
+        error = HTTPException(status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    except IntegrityError as e:
+        error = get_integrity_error(e)
+    except DataError as e:
+        error = get_data_error(e)
+    else:
+        return {
+            "message": "Received environment data",
+            "committed_chunks": committed_chunks,
+            "spooled_chunks": spooled_chunks,
+            **totals,
+        }
+
+    # committed_chunks is also the index of the failed chunk
+    logger.warning(
+        "Chunk %s of streamed data failed: %s", committed_chunks, error.detail
+    )
+    return JSONResponse(
+        status_code=error.status_code,
+        content={
+            "detail": error.detail,
+            "committed_chunks": committed_chunks,
+            "spooled_chunks": spooled_chunks,
+            **totals,
+        },
+    )
+
+
+@app.post("/gateway")
+def gateway(
+    gateway_input: GatewayInput,
+    sender: Tuple[str, str, int] = Depends(admit_gateway),
+    db: DatabaseConnection = Depends(get_db),
+):
+    """
+    Batch endpoint for gateways sending data of multiple senders. The gateway
+    authenticates with its own key and can send data for all senders assigned to it
+    in the gateway_senders table. The data of all items with the same sender and
+    endpoint is written together. The response contains a result for each
+    sender/endpoint and has status 207 if not all of them succeeded.
+
+    :param gateway_input: Items with sender name, endpoint and data
+    :param sender: Sender of the gateway
+    :param db: DatabaseConnection for database interaction
+    """
+    key, gateway_name, gateway_id = sender
+    gateway_senders = get_gateway_senders(gateway_id, db)
+
+    targets: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    for item in gateway_input.items:
+        targets.setdefault((item.sender, item.endpoint), []).append(item.data)
+
+    results = []
+    for (sender_name, endpoint_name), items in targets.items():
+        result: Dict[str, Any] = {"sender": sender_name, "endpoint": endpoint_name}
+        try:
+            counts = save_gateway_items(
+                gateway_senders, sender_name, endpoint_name, items, db
+            )
+        except HTTPException as e:
+            result.update(status_code=e.status_code, detail=e.detail)
+        except ValidationError as e:
+            result.update(status_code=HTTP_422_UNPROCESSABLE_ENTITY, detail=e.errors())
+        except IntegrityError as e:
+            http_exception = get_integrity_error(e)
+            result.update(
+                status_code=http_exception.status_code, detail=http_exception.detail
+            )
+        except DataError as e:
+            http_exception = get_data_error(e)
+            result.update(
+                status_code=http_exception.status_code, detail=http_exception.detail
+            )
+        else:
+            if counts is None:
+                result.update(status_code=HTTP_202_ACCEPTED)
+            else:
+                result.update(status_code=HTTP_200_OK, **counts)
+        results.append(result)
+
+    all_saved = all(result["status_code"] < 300 for result in results)
+    return JSONResponse(
+        status_code=HTTP_200_OK if all_saved else HTTP_207_MULTI_STATUS,
+        content={"message": "Received gateway data", "results": results},
+    )
+
+
+def get_gateway_senders(gateway_id: int, db: DatabaseConnection) -> Dict[str, int]:
+    """Get names and ids of all senders the gateway can send data for"""
+    gateway_senders = gateway_cache.get(gateway_id)
+    if gateway_senders is not None:
+        return gateway_senders
+
+    generation = gateway_cache.generation
+    gs = Table("gateway_senders")
+    senders = Table("senders")
     try:
         data = db.query(
-            db.pypika_query.from_(ers)
-            .select(ers.table, ers.subset)
-            .where(ers.id == sender_id)
-            .where(ers.endpoint == endpoint.value)
+            db.pypika_query.from_(gs)
+            .join(senders)
+            .on(gs.sender_id == senders.id)
+            .select(senders.sender_name, senders.id)
+            .where(gs.gateway_id == gateway_id)
             .get_sql()
         )
     except QueryReturnedNoData:
+        data = []
+
+    gateway_senders = {sender_name: sender_id for sender_name, sender_id in data}
+    gateway_cache.set(gateway_id, gateway_senders, generation=generation)
+
+    return gateway_senders
+
+
+def save_gateway_items(
+    gateway_senders: Dict[str, int],
+    sender_name: str,
+    endpoint_name: str,
+    items: List[Dict[str, Any]],
+    db: DatabaseConnection,
+) -> Optional[Dict[str, int]]:
+    """Save the data of all gateway items of one sender and endpoint together"""
+    if sender_name not in gateway_senders:
         raise HTTPException(
-            status_code=HTTP_400_BAD_REQUEST, detail="Endpoint not registered"
+            status_code=HTTP_403_FORBIDDEN,
+            detail=f"Gateway can not send data for sender {sender_name}",
         )
+    description = get_endpoint_description(endpoint_name, HTTP_400_BAD_REQUEST)
 
-    table, subset = data[0]
-    fields = subset["fields"]
+    registration = get_registration(gateway_senders[sender_name], description, db)
+    columns: List[List[Any]] = [[] for _ in registration.fields]
+    for data in items:
+        item_columns = get_registered_columns(
+            parse_input(description, data), registration
+        )
+        for column, item_column in zip(columns, item_columns):
+            column.extend(item_column)
 
-    endpoint_description_cls = endpoint.get_description_class()
-    endpoint_description = endpoint_description_cls()
+    counts = save_columns(db, registration, columns)
+    metrics.count_rows(sender_name, description.name, len(columns[0]))
+    return counts
 
-    table_settings = endpoint_description.generate_table_structure(
-        get_table_name(sender_name, endpoint.value), fields
-    )
 
-    insert_data = []
-    environment_input_dict = environment_input.dict()
-    for i in range(len(environment_input.timestamp)):
-        this_row = []
-        for field in fields:
-            this_row.append(environment_input_dict[field][i])
-        insert_data.append(this_row)
+def save_chunk(
+    db: DatabaseConnection,
+    description: EndpointDescription,
+    registration: Registration,
+    chunk: bytes,
+    sender_name: str,
+) -> Optional[Dict[str, int]]:
+    with metrics.stage("decode"):
+        data = parse_input(description, json.loads(chunk))
+    columns = get_registered_columns(data, registration)
+    counts = save_columns(db, registration, columns)
+    metrics.count_rows(sender_name, description.name, len(columns[0]))
+    return counts
+
+
+def get_registered_columns(
+    data: BaseModel, registration: Registration
+) -> List[List[Any]]:
+    """
+    Get the columns of the registered fields from the input. Timestamps are
+    normalized to naive UTC times (see utils.normalize_timestamps).
+    """
+    with metrics.stage("assemble"):
+        columns = [getattr(data, field) for field in registration.fields]
+        columns = [
+            normalize_timestamps(values)
+            if values is not None and data.__fields__[field].type_ is datetime
+            else values
+            for field, values in zip(registration.fields, columns)
+        ]
+    missing_fields = [
+        field for field, values in zip(registration.fields, columns) if values is None
+    ]
+    if missing_fields:
+        raise HTTPException(
+            status_code=HTTP_400_BAD_REQUEST,
+            detail=f"Registered fields {missing_fields} are missing",
+        )
+    return columns
+
+
+def save_columns(
+    db: DatabaseConnection, registration: Registration, columns: List[List[Any]]
+) -> Optional[Dict[str, int]]:
+    """
+    Write the columns to the table of the registration. If the database is not
+    reachable and the spool is enabled, the data is added to the spool and None is
+    returned.
+    """
+    try:
+        return write_registered_columns(db, registration, columns)
+    except IntegrityError:
+        metrics.count_db_error("integrity")
+        raise
+    except DataError:
+        metrics.count_db_error("data")
+        raise
+    except (OperationalError, exc.OperationalError):
+        metrics.count_db_error("operational")
+        logger.warning("Database not reachable")
+
+    if spool is None:
+        raise HTTPException(
+            status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Internal database could not be reached",
+        )
+
+    try:
+        with metrics.stage("spool"):
+            spool.append({"registration": registration.to_dict(), "columns": columns})
+    except SpoolFull:
+        raise HTTPException(
+            status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Internal database could not be reached and spool is full",
+        )
+    logger.info("Spooled data for %s", registration.table_name)
+    return None
+
+
+def ensure_partitions(
+    db: DatabaseConnection, registration: Registration, columns: List[List[Any]]
+) -> None:
+    if registration.partitioning is not None:
+        with metrics.stage("partitions"):
+            partition_manager.ensure(
+                db,
+                registration,
+                columns[registration.fields.index(PARTITION_COLUMN)],
+            )
+
+
+def write_registered_columns(
+    db: DatabaseConnection, registration: Registration, columns: List[List[Any]]
+) -> Dict[str, int]:
+    """Write the columns, creating missing partitions of partitioned tables first"""
+    ensure_partitions(db, registration, columns)
+    try:
+        with metrics.stage("write"):
+            counts = write_columns(
+                db, registration, columns, config.settings.ingest.copy_threshold
+            )
+    except IntegrityError as e:
+        if registration.partitioning is None or not is_missing_partition_error(e):
+            raise
+        # Another process dropped a partition this process still knows
+        logger.warning(
+            "Partition of %s is missing. Reloading the partitions",
+            registration.table_name,
+        )
+        partition_manager.refresh(db, registration.table_name)
+        ensure_partitions(db, registration, columns)
+        with metrics.stage("write"):
+            counts = write_columns(
+                db, registration, columns, config.settings.ingest.copy_threshold
+            )
+    if registration.rollups:
+        with metrics.stage("rollups"):
+            try:
+                refresh_rollups_for_columns(
+                    db, registration, columns[registration.fields.index(TIME_COLUMN)]
+                )
+            except DatabaseError as e:
+                # The data is saved, the rollups can be fixed with backfill_rollups
+                logger.error(
+                    "Refreshing rollups of %s failed: %s", registration.table_name, e
+                )
+    return counts
+
+
+def replay_record(record: Dict[str, Any]) -> None:
+    registration = Registration.from_dict(record["registration"])
+    try:
+        write_registered_columns(get_db(), registration, record["columns"])
+    except (IntegrityError, DataError, ProgrammingError, NotSupportedError) as e:
+        # Retrying does not help for these, unlike for connection problems
+        raise InvalidRecord(f"{type(e).__name__}: {e}".strip())
+
+
+def buffer_columns(registration: Registration, columns: List[List[Any]], endpoint: str):
+    """
+    Add the data to the write buffer. Depending on the durability setting, wait until
+    the data is written to the database.
+    """
+    assert write_buffer is not None
+    try:
+        future = write_buffer.add(registration, columns)
+    except BufferFull:
+        raise HTTPException(
+            status_code=HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too much data is waiting to be written. Retry later",
+        )
+
+    if config.settings.ingest.buffer.durability == BufferDurability.FLUSH:
+        with metrics.stage("buffer_wait"):
+            counts = future.result()
+        if counts is None:
+            return get_spooled_response(endpoint)
+        return {"message": f"Received and saved {endpoint} data"}
+
+    return {"message": f"Received {endpoint} data"}
+
+
+@app.get("/query/{endpoint}")
+def query(
+    endpoint: str,
+    start: datetime,
+    end: datetime,
+    fields: Optional[List[str]] = Query(default=None),
+    bucket: Optional[int] = Query(default=None, gt=0),
+    aggregation: Aggregation = Aggregation.MEAN,
+    limit: Optional[int] = Query(default=None, gt=0),
+    cursor: Optional[str] = None,
+    use_rollups: bool = True,
+    sender: Tuple[str, str, int] = Depends(admit_query),
+    db: DatabaseConnection = Depends(get_db),
+):
+    """
+    Get the data of the sender sent to the endpoint between start (inclusive) and end
+    (exclusive). The response is streamed.
+
+    :param endpoint: Endpoint the data was sent to
+    :param start: Start of the time range
+    :param end: End of the time range
+    :param fields: Registered fields to return (all if not passed)
+    :param bucket: If passed, the data is aggregated in buckets of this many seconds
+    :param aggregation: Aggregation of the values in a bucket
+    :param limit: Maximum number of returned rows (buckets). Defaults to and can not
+                  be larger than query.max_limit
+    :param cursor: next_cursor of the previous page
+    :param use_rollups: Aggregate from the coarsest adequate rollup table (if the
+                        registration has rollups) instead of the raw data
+    """
+    key, sender_name, sender_id = sender
+    registration = get_registration(sender_id, get_endpoint_description(endpoint), db)
+
+    value_fields = [field for field in registration.fields if field != TIME_COLUMN]
+    if fields:
+        unknown_fields = [field for field in fields if field not in value_fields]
+        if unknown_fields:
+            raise HTTPException(
+                status_code=HTTP_400_BAD_REQUEST,
+                detail=f"Fields {unknown_fields} are not registered",
+            )
+        value_fields = [field for field in value_fields if field in fields]
 
-    db.insert(table_settings, insert_data)
+    max_limit = config.settings.query.max_limit
+    limit = min(limit or max_limit, max_limit)
+    try:
+        after = decode_cursor(cursor) if cursor is not None else None
+    except InvalidCursor as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e))
 
-    # Load subset defined for the key/endpoint combination
-    # Check if the table is present. If not. Create the table
-    return {"message": "Received environment data"}
+    resolution = None
+    if bucket is not None and use_rollups:
+        resolution = choose_rollup(
+            registration.rollups, bucket, start, end, aggregation
+        )
+    if resolution is not None:
+        sql = build_rollup_query(
+            registration.table_name,
+            resolution,
+            value_fields,
+            aggregation,
+            after_cursor=after is not None,
+        )
+    else:
+        sql = build_query(
+            registration.table_name,
+            value_fields,
+            aggregation,
+            bucket,
+            after_cursor=after is not None,
+        )
+    chunks = execute_query(
+        db,
+        sql,
+        get_query_parameters(start, end, limit, bucket, after),
+        config.settings.query.fetch_size,
+    )
+    return StreamingResponse(
+        stream_json(value_fields, chunks, limit), media_type=JSON_CONTENT_TYPE
+    )
 
 
 @app.post("/register")
-async def register(
+def register(
     register_input: RegisterInput,
     sender: Tuple[str, str, int] = Depends(get_api_key),
     db: DatabaseConnection = Depends(get_db),
 ):
     """
     Register a certain endpoint (passed inside the request body) with the passed fileds.
-    Valid endpoints are children of the EndpointDescription class.
+    Valid endpoints are the endpoints of the endpoint registry.
     A valid call to this function will register the api key as valid key sending data
     to the passed endpoint. Additionally, the corresponding table in the database will
     be created
@@ -144,67 +1270,33 @@ async def register(
     :param sender: API Key for which the endpoint will be registered
     :param db: DatabaseConnection for database interaction
     """
-    try:
-        endpoint = Endpoint(register_input.endpoint)
-    except ValueError:
-        raise HTTPException(
-            status_code=HTTP_400_BAD_REQUEST,
-            detail=f"Invalid endpoint {register_input.endpoint} was passed",
-        )
+    endpoint_description = get_endpoint_description(
+        register_input.endpoint, HTTP_400_BAD_REQUEST
+    )
 
     key, sender_name, sender_id = sender
 
-    ers = Table("endpoint_request_subsets")
-    try:
-        db.query(
-            db.pypika_query.from_(ers)
-            .select("*")
-            .where(ers.id == sender_id)
-            .where(ers.endpoint == register_input.endpoint)
-            .get_sql()
-        )
-    except QueryReturnedNoData:
-        pass
-    else:
-        return {"message": f"Endpoint already registered for user {sender_name}"}
-
     logger.debug(
         "Found sender name / id  - %s / %s -  for the passed key",
         sender_name,
         sender_id,
     )
 
-    endpoint_description_cls = endpoint.get_description_class()
-    endpoint_description = endpoint_description_cls()
-
-    table_settings = endpoint_description.generate_table_structure(
-        get_table_name(sender_name, register_input.endpoint), register_input.fields
-    )
-
-    db.create_table_from_table_info([table_settings])
-
-    with db.engine.connect() as connection:
-        query = (
-            db.pypika_query.into(Table("endpoint_request_subsets"))
-            .insert(
-                sender_id,
-                register_input.endpoint,
-                get_table_name(sender_name, register_input.endpoint),
-                json.dumps(
-                    {
-                        "fields": endpoint_description.get_final_fields(
-                            register_input.fields
-                        )
-                    }
-                ),
-            )
-            .get_sql()
+    try:
+        registered = register_endpoint(
+            db,
+            endpoint_description,
+            sender_id,
+            sender_name,
+            register_input,
+            config.settings.partitions.premake,
         )
-        logger.debug(query)
-        connection.execute(text(query))
-        connection.commit()
+    except InvalidRegistration as e:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(e))
+    if not registered:
+        return {"message": f"Endpoint already registered for user {sender_name}"}
 
-    logger.info("Added id / endpoint to **endpoint_request_subsets** table")
+    registration_cache.pop((sender_id, register_input.endpoint))
 
     response_msg = (
         f"Successfully registered key of user {sender_name} "
@@ -214,13 +1306,109 @@ async def register(
     return {"message": response_msg}
 
 
+def run_partition_maintenance() -> None:
+    """
+    Create upcoming and drop expired partitions of all partitioned tables. Run by the
+    PartitionMaintainer every partitions.maintenance_interval seconds.
+    """
+    db = get_db()
+    ers = Table("endpoint_request_subsets")
+    try:
+        data = db.query(
+            db.pypika_query.from_(ers)
+            .select(ers.endpoint, ers.table, ers.subset)
+            .get_sql()
+        )
+    except QueryReturnedNoData:
+        return
+
+    # Aware timestamps are stored as UTC (see utils.to_naive_utc)
+    now = datetime.utcnow()
+    for endpoint_name, table, subset in data:
+        description = endpoint_registry.get(endpoint_name)
+        if subset.get("partitioning") is None or description is None:
+            continue
+        registration = build_registration(description, table, subset)
+        dropped = maintain_partitions(
+            db, registration, config.settings.partitions.premake, now
+        )
+        if dropped:
+            # Late data for dropped partitions recreates them on the next write
+            partition_manager.forget(table)
+
+
+def get_missing_tables(db: DatabaseConnection) -> List[str]:
+    """Required tables not present in the schema of the database"""
+    with db.engine.connect() as connection:
+        present = connection.execute(
+            text(
+                """
+                SELECT table_name FROM information_schema.tables
+                WHERE table_schema = :schema AND table_name IN :tables
+                """
+            ).bindparams(bindparam("tables", expanding=True)),
+            {"schema": db.schema, "tables": REQUIRED_TABLES},
+        ).scalars()
+        return sorted(set(REQUIRED_TABLES) - set(present))
+
+
+def run_readiness_checks() -> Checks:
+    """Checks run in the background by the HealthChecker for /ready"""
+    db = get_db()
+    checks: Checks = {"database": {"ok": db.is_valid}}
+    if not db.is_valid:
+        return checks
+
+    missing_tables = get_missing_tables(db)
+    checks["tables"] = {"ok": not missing_tables, "missing": missing_tables}
+
+    pool_stats = shared_db.pool_stats()
+    if pool_stats is not None:
+        capacity = pool_stats["size"] + config.settings.db.max_overflow
+        checks["pool"] = {"ok": pool_stats["checked_out"] < capacity, **pool_stats}
+
+    if spool is not None:
+        checks["spool"] = {"ok": spool.size < spool.max_size, **spool.stats()}
+
+    return checks
+
+
+@app.get("/live")
+def live():
+    """Liveness probe. Does not check any components"""
+    return {"message": "Alive"}
+
+
+@app.get("/ready")
+def ready():
+    """
+    Readiness probe. Returns the cached result of the checks run in the background
+    (see [health] section) and status 503 if any of them failed.
+    """
+    if health_checker is None:
+        raise HTTPException(
+            status_code=HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Readiness checks are not running",
+        )
+
+    is_ready, result = health_checker.result()
+    return JSONResponse(
+        status_code=HTTP_200_OK if is_ready else HTTP_503_SERVICE_UNAVAILABLE,
+        content={"ready": is_ready, **result},
+    )
+
+
 @app.get("/health")
-async def health(db: DatabaseConnection = Depends(get_db)):
+def health(db: DatabaseConnection = Depends(get_db)):
     """
     API health check endpoint. Will check if all components are running:
     Checks implemented:
     - Check if the database is reachable
     - Check if the requited tables are present
+
+    The checks are run on every call. Use /live and /ready for frequent probes. The
+    endpoint is not authenticated, so it only returns the status. Statistics of the
+    components are exported on /metrics.
     """
     # Check if DB is reachable
     if not db.is_valid:
@@ -230,30 +1418,28 @@ async def health(db: DatabaseConnection = Depends(get_db)):
         )
 
     # Check if all required tables are present
-    try:
-        tables = db.query_to_df(
-            text(
-                f"""
-                SELECT table_name FROM information_schema.tables
-                WHERE table_schema = '{db.schema}';
-                """
-            )
-        )
-    except QueryReturnedNoData:
-        raise HTTPException(
-            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Not all required tables are present in the database",
-        )
-
-    if not all(
-        [
-            rt in tables.table_name.to_list()
-            for rt in ["senders", "endpoint_request_subsets"]
-        ]
-    ):
+    if get_missing_tables(db):
         raise HTTPException(
             status_code=HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Not all required tables are present in the database",
         )
 
     return {"message": "All components up and running"}
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Metrics of the service in the Prometheus text format (if enabled)"""
+    if not metrics.enabled:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail="Metrics disabled")
+    return Response(content=metrics.generate(), media_type=METRICS_CONTENT_TYPE)
+
+
+# Defined endpoints are labelled by name, the other requests by their route
+if metrics.enabled:
+    app.add_middleware(
+        MetricsMiddleware,
+        metrics=metrics,
+        routes=app.routes,
+        paths=[f"/ingest/{name}" for name in endpoint_registry.names()],
+    )
@@ -0,0 +1,279 @@
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+)
+
+from starlette.routing import BaseRoute, Match
+
+try:
+    import prometheus_client
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Stage latencies range from the µs of a cache hit to seconds for bcrypt on a busy
+# host or large COPYs
+STAGE_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+BODY_SIZE_BUCKETS = tuple(2**exponent for exponent in range(8, 28, 2))
+
+# Endpoint of the request currently processed. Set by the MetricsMiddleware and
+# propagated to the threadpool running the sync routes and dependencies.
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="none")
+
+_disabled_stage = nullcontext()
+
+
+Stats = Callable[[], Optional[Dict[str, Any]]]
+
+
+def flatten_stats(stats: Dict[str, Any], prefix: str = "") -> Iterator[Any]:
+    """Names and values of the numbers in stats. Nested names are joined with _"""
+    for name, value in stats.items():
+        if isinstance(value, dict):
+            yield from flatten_stats(value, f"{prefix}{name}_")
+        elif isinstance(value, (int, float)):
+            yield f"{prefix}{name}", float(value)
+
+
+class StatsCollector:
+    """
+    Exports the numbers in the dict returned by stats (e.g. the stats of a cache) on
+    scrape as gauges iot_receiver_COMPONENT_NAME. Nothing is exported if stats
+    returns None (e.g. the component is disabled).
+    """
+
+    def __init__(self, component: str, stats: Stats) -> None:
+        self.component = component
+        self.stats = stats
+
+    def collect(self) -> Iterable[Any]:
+        stats = self.stats()
+        if stats is None:
+            return
+        for name, value in flatten_stats(stats):
+            yield GaugeMetricFamily(
+                f"iot_receiver_{self.component}_{name}",
+                f"{name} of the {self.component}",
+                value=value,
+            )
+
+
+class Metrics:
+    """
+    Prometheus metrics of the service, registered in an own registry. If disabled,
+    all methods are no-ops, so the instrumentation can stay in place without
+    overhead.
+
+    :param enabled: Collect metrics. Requires the prometheus_client package.
+    :param pool_stats: Function returning the usage of the database connection pool
+    """
+
+    def __init__(self, enabled: bool, pool_stats: Optional[Stats] = None) -> None:
+        if enabled and prometheus_client is None:
+            raise RuntimeError("Metrics require the prometheus_client package")
+        self.enabled = enabled
+        if not enabled:
+            return
+
+        self.registry = prometheus_client.CollectorRegistry()
+        self.requests = prometheus_client.Histogram(
+            "iot_receiver_request_seconds",
+            "Duration of requests",
+            ["endpoint", "method", "status"],
+            buckets=STAGE_BUCKETS,
+            registry=self.registry,
+        )
+        self.stages = prometheus_client.Histogram(
+            "iot_receiver_stage_seconds",
+            "Duration of the stages of the request pipeline",
+            ["stage", "endpoint"],
+            buckets=STAGE_BUCKETS,
+            registry=self.registry,
+        )
+        self.body_sizes = prometheus_client.Histogram(
+            "iot_receiver_request_body_bytes",
+            "Size of the (compressed) request bodies",
+            ["endpoint"],
+            buckets=BODY_SIZE_BUCKETS,
+            registry=self.registry,
+        )
+        self.rows = prometheus_client.Counter(
+            "iot_receiver_rows",
+            "Rows accepted (written, buffered or spooled)",
+            ["sender", "endpoint"],
+            registry=self.registry,
+        )
+        self.auth_failures = prometheus_client.Counter(
+            "iot_receiver_auth_failures",
+            "Rejected api keys",
+            ["reason"],
+            registry=self.registry,
+        )
+        self.db_errors = prometheus_client.Counter(
+            "iot_receiver_db_errors",
+            "Errors while writing to the database",
+            ["error"],
+            registry=self.registry,
+        )
+        self.throttled = prometheus_client.Counter(
+            "iot_receiver_throttled",
+            "Requests rejected by the rate limits and concurrency caps",
+            ["sender", "endpoint", "reason"],
+            registry=self.registry,
+        )
+        if pool_stats is not None:
+            self.register_stats("db_pool", pool_stats)
+
+    def register_stats(self, component: str, stats: Stats) -> None:
+        """Export the stats of a component (see StatsCollector)"""
+        if self.enabled:
+            self.registry.register(StatsCollector(component, stats))
+
+    def stage(self, stage: str) -> ContextManager:
+        """Context manager measuring the duration of a stage of the current request"""
+        if not self.enabled:
+            return _disabled_stage
+        return self._time_stage(stage)
+
+    @contextmanager
+    def _time_stage(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.labels(stage, current_endpoint.get()).observe(
+                time.perf_counter() - start
+            )
+
+    def count_rows(self, sender: str, endpoint: str, n_rows: int) -> None:
+        if self.enabled:
+            self.rows.labels(sender, endpoint).inc(n_rows)
+
+    def count_auth_failure(self, reason: str) -> None:
+        if self.enabled:
+            self.auth_failures.labels(reason).inc()
+
+    def count_db_error(self, error: str) -> None:
+        if self.enabled:
+            self.db_errors.labels(error).inc()
+
+    def count_throttled(self, sender: str, endpoint: str, reason: str) -> None:
+        if self.enabled:
+            self.throttled.labels(sender, endpoint, reason).inc()
+
+    def generate(self) -> bytes:
+        return prometheus_client.generate_latest(self.registry)
+
+
+def get_content_length(scope: Dict[str, Any]) -> Optional[int]:
+    for name, value in scope["headers"]:
+        if name == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware measuring the duration and body size of all requests. Requests
+    are labelled with the path template of their route (e.g. /query/{endpoint}), or
+    with the path itself if it is in paths. Requests matching no route are reported
+    as "other" to limit the number of label values.
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        metrics: Metrics,
+        routes: Sequence[BaseRoute],
+        paths: Iterable[str] = (),
+    ) -> None:
+        self.app = app
+        self.metrics = metrics
+        self.routes = routes
+        self.paths = frozenset(paths)
+
+    def get_endpoint(self, scope: Dict[str, Any]) -> str:
+        if scope["path"] in self.paths:
+            return scope["path"]
+        # Resolved here, as the router sets scope["route"] only after the stages of
+        # the request ran
+        endpoint = "other"
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", endpoint)
+            if match == Match.PARTIAL and endpoint == "other":
+                endpoint = getattr(route, "path", endpoint)
+        return endpoint
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self.get_endpoint(scope)
+        token = current_endpoint.set(endpoint)
+        status = 500
+        body_size = 0
+
+        # Streamed bodies have no content-length, their size is counted while read
+        async def receive_counting() -> Dict[str, Any]:
+            nonlocal body_size
+            message = await receive()
+            if message["type"] == "http.request":
+                body_size += len(message.get("body", b""))
+            return message
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        content_length = get_content_length(scope)
+        start = time.perf_counter()
+        try:
+            await self.app(
+                scope,
+                receive if content_length is not None else receive_counting,
+                send_with_status,
+            )
+        finally:
+            self.metrics.requests.labels(endpoint, scope["method"], status).observe(
+                time.perf_counter() - start
+            )
+            if content_length is None:
+                content_length = body_size
+            if content_length:
+                self.metrics.body_sizes.labels(endpoint).observe(content_length)
+            current_endpoint.reset(token)
@@ -1,6 +1,30 @@
+from array import array
 from datetime import datetime
+from enum import Enum
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar
 
-from pydantic import BaseModel, Field, ValidationError, root_validator
+from pydantic import (
+    BaseModel,
+    ConstrainedInt,
+    Field,
+    PositiveInt,
+    ValidationError,
+    errors,
+    root_validator,
+)
+from pydantic.datetime_parse import parse_datetime
+from pydantic.error_wrappers import ErrorWrapper
+
+Model = TypeVar("Model", bound=BaseModel)
+
+# Values of the Postgres integer types
+INTEGER_RANGES = {
+    "SMALLINT": (-(2**15), 2**15 - 1),
+    "INT": (-(2**31), 2**31 - 1),
+    "INTEGER": (-(2**31), 2**31 - 1),
+    "BIGINT": (-(2**63), 2**63 - 1),
+}
 
 
 class EnvironmentInput(BaseModel):
@@ -64,6 +88,201 @@ class EnvironmentInput(BaseModel):
         return values
 
 
+class ColumnsInput(BaseModel):
+    """Base of input models with one list per column (all with the same length)"""
+
+    @root_validator
+    def check_list_len(cls, values):
+        lengths = {len(value) for value in values.values() if value is not None}
+        if len(lengths) > 1:
+            raise ValueError("All columns must have the same length")
+        return values
+
+
+class GatewayItem(BaseModel):
+    sender: str
+    endpoint: str = "environment"
+    data: Dict[str, Any]
+
+
+class GatewayInput(BaseModel):
+    items: list[GatewayItem]
+
+
+class ConflictPolicy(str, Enum):
+    """Handling of rows with a primary key already present in the table"""
+
+    ERROR = "error"
+    NOTHING = "nothing"
+    UPDATE = "update"
+
+
+class PartitionInterval(str, Enum):
+    """Range covered by one partition of a time-partitioned table"""
+
+    DAY = "day"
+    WEEK = "week"
+    MONTH = "month"
+
+
+class Aggregation(str, Enum):
+    """Aggregation of the values in a time bucket of a query"""
+
+    MEAN = "mean"
+    MIN = "min"
+    MAX = "max"
+    LAST = "last"
+
+
 class RegisterInput(BaseModel):
     endpoint: str
     fields: list[str]
+    on_conflict: ConflictPolicy = ConflictPolicy.ERROR
+    partitioning: PartitionInterval | None = None
+    retention_days: int | None = Field(default=None, gt=0)
+    rollups: list[PositiveInt] = []
+
+    @root_validator
+    def check_retention(cls, values):
+        if values.get("retention_days") and values.get("partitioning") is None:
+            raise ValueError("retention_days requires partitioning")
+        return values
+
+
+def _is_iso_datetime(value: Any) -> bool:
+    # Strings fromisoformat parses like pydantic (date and time part present)
+    return isinstance(value, str) and len(value) >= 16 and value[10] in "T "
+
+
+def parse_timestamps(values: List[Any]) -> List[datetime]:
+    if all(_is_iso_datetime(value) for value in values):
+        try:
+            return list(map(datetime.fromisoformat, values))
+        except ValueError:
+            pass
+    return _parse_elements(values, parse_datetime, errors.DateTimeError)
+
+
+def parse_floats(values: List[Any]) -> List[float]:
+    try:
+        return array("d", values).tolist()
+    except TypeError:
+        return _parse_elements(values, float, errors.FloatError)
+
+
+def parse_ints(values: List[Any]) -> List[int]:
+    if all(type(value) is int for value in values):
+        return values
+    return _parse_elements(values, int, errors.IntegerError)
+
+
+def parse_bounded_ints(
+    values: List[Any], ge: Optional[int] = None, le: Optional[int] = None
+) -> List[int]:
+    parsed = parse_ints(values)
+    if not parsed:
+        return parsed
+    if ge is not None and min(parsed) < ge:
+        index = next(i for i, value in enumerate(parsed) if value < ge)
+        raise _IndexedError(index, errors.NumberNotGeError(limit_value=ge))
+    if le is not None and max(parsed) > le:
+        index = next(i for i, value in enumerate(parsed) if value > le)
+        raise _IndexedError(index, errors.NumberNotLeError(limit_value=le))
+    return parsed
+
+
+def _parse_elements(
+    values: List[Any], parse: Callable[[Any], Any], error: Type[Exception]
+) -> List[Any]:
+    parsed = []
+    for index, value in enumerate(values):
+        try:
+            parsed.append(parse(value))
+        except (TypeError, ValueError, errors.PydanticValueError):
+            raise _IndexedError(index, error())
+    return parsed
+
+
+class ColumnLengthError(errors.PydanticValueError):
+    code = "list.column_length"
+    msg_template = "column has {length} items, expected {expected_length}"
+
+
+class _IndexedError(Exception):
+    def __init__(self, index: int, error: Exception) -> None:
+        self.index = index
+        self.error = error
+
+
+COLUMN_PARSERS: Dict[Any, Callable[[List[Any]], List[Any]]] = {
+    datetime: parse_timestamps,
+    float: parse_floats,
+    int: parse_ints,
+}
+
+
+def get_column_parser(type_: Any) -> Optional[Callable[[List[Any]], List[Any]]]:
+    """
+    Parser of parse_columns for the type of a field (ints constrained by conint with
+    ge and le are supported). None if the type is not supported.
+    """
+    if type_ in COLUMN_PARSERS:
+        return COLUMN_PARSERS[type_]
+    if (
+        isinstance(type_, type)
+        and issubclass(type_, ConstrainedInt)
+        and type_.gt is None
+        and type_.lt is None
+        and type_.multiple_of is None
+        and not type_.strict
+    ):
+        return partial(parse_bounded_ints, ge=type_.ge, le=type_.le)
+    return None
+
+
+def parse_columns(model: Type[Model], data: Dict[str, Any]) -> Model:
+    """
+    Fast validation of column-oriented input models (all fields lists of datetime,
+    float or int, see get_column_parser) like EnvironmentInput. In contrast to
+    model.parse_obj, the length of all columns is checked first and each column is
+    parsed in bulk. Errors contain the index of the first invalid element of a column.
+    """
+    if not isinstance(data, dict):
+        raise ValidationError([ErrorWrapper(errors.DictError(), loc="__root__")], model)
+
+    columns: Dict[str, Any] = {}
+    length = None
+    for name, field in model.__fields__.items():
+        values = data.get(field.alias)
+        if values is None:
+            if field.required:
+                raise ValidationError(
+                    [ErrorWrapper(errors.MissingError(), loc=(name,))], model
+                )
+            continue
+        if not isinstance(values, list):
+            raise ValidationError(
+                [ErrorWrapper(errors.ListError(), loc=(name,))], model
+            )
+        if length is not None and len(values) != length:
+            raise ValidationError(
+                [
+                    ErrorWrapper(
+                        ColumnLengthError(length=len(values), expected_length=length),
+                        loc=(name,),
+                    )
+                ],
+                model,
+            )
+        length = len(values)
+        columns[name] = values
+
+    for name, values in columns.items():
+        try:
+            parse = get_column_parser(model.__fields__[name].type_)
+            assert parse is not None
+            columns[name] = parse(values)
+        except _IndexedError as e:
+            raise ValidationError([ErrorWrapper(e.error, loc=(name, e.index))], model)
+
+    return model.construct(**columns)
@@ -0,0 +1,329 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Sequence, Set
+
+from data_organizer.db.connection import DatabaseConnection
+from psycopg2 import errors
+
+from iot_data_receiver.endpoints import Registration, quote_identifier
+from iot_data_receiver.model import PartitionInterval
+from iot_data_receiver.utils import (
+    get_suffixed_name,
+    normalize_timestamps,
+    to_naive_utc,
+)
+
+logger = logging.getLogger(__name__)
+
+PARTITION_COLUMN = "timestamp"
+
+PARTITION_SUFFIX_FORMAT = "%Y%m%d"
+
+
+def get_partition_start(timestamp: datetime, interval: PartitionInterval) -> datetime:
+    """
+    Start of the partition containing the timestamp. Aware timestamps are routed by
+    their UTC time, like they are written (see utils.to_naive_utc).
+    """
+    timestamp = to_naive_utc(timestamp)
+    day = datetime(timestamp.year, timestamp.month, timestamp.day)
+    if interval == PartitionInterval.DAY:
+        return day
+    if interval == PartitionInterval.WEEK:
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def get_next_partition_start(start: datetime, interval: PartitionInterval) -> datetime:
+    if interval == PartitionInterval.DAY:
+        return start + timedelta(days=1)
+    if interval == PartitionInterval.WEEK:
+        return start + timedelta(days=7)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def iter_partition_starts(
+    first: datetime, last: datetime, interval: PartitionInterval
+) -> Iterator[datetime]:
+    """Starts of all partitions required for timestamps between first and last"""
+    start = get_partition_start(first, interval)
+    while start <= to_naive_utc(last):
+        yield start
+        start = get_next_partition_start(start, interval)
+
+
+def get_partition_name(table_name: str, start: datetime) -> str:
+    return get_suffixed_name(table_name, f"_p{start.strftime(PARTITION_SUFFIX_FORMAT)}")
+
+
+def is_missing_partition_error(error: Exception) -> bool:
+    """True if the error was raised because no partition exists for a written row"""
+    return isinstance(error, errors.CheckViolation) and str(error).startswith(
+        "no partition of relation"
+    )
+
+
+def get_partition_start_from_name(name: str) -> datetime:
+    return datetime.strptime(name.rsplit("_p", 1)[1], PARTITION_SUFFIX_FORMAT)
+
+
+def get_create_partitioned_table_sql(
+    table_name: str, columns: Dict[str, str], primary_fields: Sequence[str]
+) -> str:
+    """
+    Statement creating a table range-partitioned on PARTITION_COLUMN
+
+    :param table_name: Name of the table
+    :param columns: Names and types of the columns
+    :param primary_fields: Columns of the primary key. Must contain PARTITION_COLUMN
+    """
+    definitions = [
+        f"{quote_identifier(name)} {ctype} NOT NULL" for name, ctype in columns.items()
+    ]
+    definitions.append(
+        "PRIMARY KEY ({})".format(
+            ", ".join(quote_identifier(field) for field in primary_fields)
+        )
+    )
+    return "CREATE TABLE {} ({}) PARTITION BY RANGE ({})".format(
+        quote_identifier(table_name),
+        ", ".join(definitions),
+        quote_identifier(PARTITION_COLUMN),
+    )
+
+
+def get_create_partition_sql(
+    table_name: str, start: datetime, interval: PartitionInterval
+) -> str:
+    end = get_next_partition_start(start, interval)
+    return (
+        "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES FROM ('{}') TO ('{}')"
+    ).format(
+        quote_identifier(get_partition_name(table_name, start)),
+        quote_identifier(table_name),
+        start.isoformat(),
+        end.isoformat(),
+    )
+
+
+def get_partitions(db: DatabaseConnection, table_name: str) -> Dict[datetime, str]:
+    """Starts and names of the partitions of the table"""
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+                JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+                JOIN pg_namespace ON parent.relnamespace = pg_namespace.oid
+                WHERE parent.relname = %s AND pg_namespace.nspname = %s
+                """,
+                (table_name, db.schema),
+            )
+            names = [name for (name,) in cursor.fetchall()]
+    finally:
+        connection.close()
+
+    partitions = {}
+    for name in names:
+        try:
+            partitions[get_partition_start_from_name(name)] = name
+        except (IndexError, ValueError):
+            logger.warning("Partition %s of %s has an unknown name", name, table_name)
+    return partitions
+
+
+def create_partitions(
+    db: DatabaseConnection,
+    table_name: str,
+    starts: Sequence[datetime],
+    interval: PartitionInterval,
+) -> None:
+    """Create the partitions starting at starts (if they do not exist yet)"""
+    connection = db.engine.raw_connection()
+    try:
+        for start in starts:
+            with connection.cursor() as cursor:
+                try:
+                    cursor.execute(
+                        get_create_partition_sql(table_name, start, interval)
+                    )
+                    connection.commit()
+                except (errors.DuplicateTable, errors.UniqueViolation):
+                    # Created concurrently by another process
+                    connection.rollback()
+    finally:
+        connection.close()
+
+
+def drop_expired_partitions(
+    db: DatabaseConnection,
+    table_name: str,
+    interval: PartitionInterval,
+    retention_days: int,
+    now: datetime,
+) -> List[str]:
+    """Drop all partitions only containing data older than retention_days"""
+    cutoff = to_naive_utc(now) - timedelta(days=retention_days)
+    expired = [
+        name
+        for start, name in get_partitions(db, table_name).items()
+        if get_next_partition_start(start, interval) <= cutoff
+    ]
+    if not expired:
+        return []
+
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            for name in expired:
+                cursor.execute(f"DROP TABLE IF EXISTS {quote_identifier(name)}")
+        connection.commit()
+    finally:
+        connection.close()
+
+    logger.info("Dropped expired partitions %s", expired)
+    return expired
+
+
+class PartitionManager:
+    """
+    Creates the partitions of time-partitioned tables on demand before data is written.
+    Partitions known to exist are remembered, so usually no statement is executed.
+    Partitions dropped by another process are still remembered here, so writes that
+    fail because of a missing partition should call refresh and retry.
+    """
+
+    def __init__(self) -> None:
+        self._known: Dict[str, Set[datetime]] = {}
+        self._lock = threading.Lock()
+
+    def ensure(
+        self,
+        db: DatabaseConnection,
+        registration: Registration,
+        timestamps: Sequence[Any],
+    ) -> int:
+        """
+        Create the partitions required for the timestamps. Timestamps can be passed
+        as datetime or ISO format strings (spooled data). Returns the number of
+        created partitions.
+        """
+        if registration.partitioning is None or not timestamps:
+            return 0
+
+        if isinstance(timestamps[0], str):
+            timestamps = [datetime.fromisoformat(value) for value in timestamps]
+        # Route the values that are written (see utils.normalize_timestamps)
+        timestamps = normalize_timestamps(list(timestamps))
+        starts = set(
+            iter_partition_starts(
+                min(timestamps), max(timestamps), registration.partitioning
+            )
+        )
+
+        table_name = registration.table_name
+        with self._lock:
+            missing = sorted(starts - self._known.get(table_name, set()))
+        if not missing:
+            return 0
+
+        create_partitions(db, table_name, missing, registration.partitioning)
+        with self._lock:
+            self._known.setdefault(table_name, set()).update(missing)
+        return len(missing)
+
+    def refresh(self, db: DatabaseConnection, table_name: str) -> None:
+        """Replace the known partitions of the table by the ones in the database"""
+        starts = set(get_partitions(db, table_name))
+        with self._lock:
+            self._known[table_name] = starts
+
+    def forget(self, table_name: str) -> None:
+        with self._lock:
+            self._known.pop(table_name, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._known.clear()
+
+
+def maintain_partitions(
+    db: DatabaseConnection,
+    registration: Registration,
+    premake: int,
+    now: datetime,
+) -> List[str]:
+    """
+    Create the partitions for the current and the next premake intervals and drop
+    expired partitions. Returns the names of the dropped partitions.
+    """
+    assert registration.partitioning is not None
+    start = get_partition_start(now, registration.partitioning)
+    starts = [start]
+    for _ in range(premake):
+        starts.append(get_next_partition_start(starts[-1], registration.partitioning))
+    create_partitions(db, registration.table_name, starts, registration.partitioning)
+
+    if registration.retention_days is None:
+        return []
+    return drop_expired_partitions(
+        db,
+        registration.table_name,
+        registration.partitioning,
+        registration.retention_days,
+        now,
+    )
+
+
+class PartitionMaintainer:
+    """
+    Background thread calling maintain every interval seconds (creation of upcoming
+    and removal of expired partitions)
+    """
+
+    def __init__(self, maintain: Callable[[], None], interval: float) -> None:
+        self.maintain = maintain
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="PartitionMaintainer", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.warning("Partition maintenance failed: %s", e)
+            if self._stop.wait(self.interval):
+                return
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def get_migration_sql(
+    table_name: str,
+    starts: Sequence[datetime],
+    interval: PartitionInterval,
+) -> List[str]:
+    """
+    Statements converting the existing table into a partitioned table with the same
+    columns. The data is moved to the partitions starting at starts, which have to
+    cover all timestamps in the table.
+    """
+    table = quote_identifier(table_name)
+    legacy_table = quote_identifier(get_suffixed_name(table_name, "_unpartitioned"))
+    return [
+        f"ALTER TABLE {table} RENAME TO {legacy_table}",
+        f"CREATE TABLE {table} (LIKE {legacy_table} INCLUDING ALL) "
+        f"PARTITION BY RANGE ({quote_identifier(PARTITION_COLUMN)})",
+        *[get_create_partition_sql(table_name, start, interval) for start in starts],
+        f"INSERT INTO {table} SELECT * FROM {legacy_table}",
+        f"DROP TABLE {legacy_table}",
+    ]
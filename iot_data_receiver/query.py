@@ -0,0 +1,169 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from itertools import chain
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from data_organizer.db.connection import DatabaseConnection
+
+from iot_data_receiver.endpoints import quote_identifier
+from iot_data_receiver.model import Aggregation
+from iot_data_receiver.utils import to_naive_utc
+
+TIME_COLUMN = "timestamp"
+
+# Origin of the time buckets, so buckets are aligned across queries
+BUCKET_ORIGIN = "2000-01-01"
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def get_aggregate_expression(field: str, aggregation: Aggregation) -> str:
+    column = quote_identifier(field)
+    if aggregation == Aggregation.MEAN:
+        # avg of integer columns is numeric, which is returned as Decimal
+        return f"avg({column})::double precision"
+    if aggregation == Aggregation.LAST:
+        return f"(array_agg({column} ORDER BY {quote_identifier(TIME_COLUMN)} DESC))[1]"
+    return f"{aggregation.value}({column})"
+
+
+def build_query(
+    table_name: str,
+    fields: Sequence[str],
+    aggregation: Aggregation,
+    bucket: Optional[int],
+    after_cursor: bool,
+) -> str:
+    """
+    Query for the fields of the table in a time range. Without bucket the rows are
+    returned as they are, otherwise they are aggregated into buckets of bucket
+    seconds. The parameters start, end, limit (and for after_cursor, after) are
+    passed when the query is executed.
+    """
+    time_column = quote_identifier(TIME_COLUMN)
+    conditions = [f"{time_column} >= %(start)s", f"{time_column} < %(end)s"]
+    if bucket is None:
+        columns = [time_column, *[quote_identifier(field) for field in fields]]
+        if after_cursor:
+            conditions.append(f"{time_column} > %(after)s")
+        group_by = ""
+    else:
+        bucket_expression = (
+            f"date_bin(make_interval(secs => %(bucket)s), {time_column}, "
+            f"TIMESTAMP '{BUCKET_ORIGIN}')"
+        )
+        columns = [
+            f"{bucket_expression} AS {time_column}",
+            *[get_aggregate_expression(field, aggregation) for field in fields],
+        ]
+        if after_cursor:
+            # Rows of the buckets after the bucket of the cursor
+            conditions.append(
+                f"{time_column} >= %(after)s + make_interval(secs => %(bucket)s)"
+            )
+        group_by = " GROUP BY 1"
+
+    return (
+        f"SELECT {', '.join(columns)} FROM {quote_identifier(table_name)} "
+        f"WHERE {' AND '.join(conditions)}{group_by} ORDER BY 1 LIMIT %(limit)s"
+    )
+
+
+def encode_cursor(timestamp: datetime) -> str:
+    return base64.urlsafe_b64encode(timestamp.isoformat().encode()).decode()
+
+
+def decode_cursor(cursor: str) -> datetime:
+    try:
+        return datetime.fromisoformat(base64.urlsafe_b64decode(cursor).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+
+
+def iter_rows(
+    db: DatabaseConnection, query: str, parameters: Dict[str, Any], fetch_size: int
+) -> Iterator[List[Tuple[Any, ...]]]:
+    """
+    Execute the query with a server-side cursor and yield the rows in chunks of
+    fetch_size, so the result is never loaded at once
+    """
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor(name="query") as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(query, parameters)
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows:
+                    break
+                yield rows
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def execute_query(
+    db: DatabaseConnection, query: str, parameters: Dict[str, Any], fetch_size: int
+) -> Iterator[List[Tuple[Any, ...]]]:
+    """
+    Execute the query and fetch the first chunk of rows before returning an iterator
+    over all chunks (see iter_rows). Errors of the query are raised here and not only
+    once the response is streamed and its status is already sent.
+    """
+    chunks = iter_rows(db, query, parameters, fetch_size)
+    first_chunk = next(chunks, None)
+    if first_chunk is None:
+        return iter([])
+    return chain([first_chunk], chunks)
+
+
+def encode_row(row: Tuple[Any, ...]) -> str:
+    timestamp, *values = row
+    return json.dumps([timestamp.isoformat(), *values])
+
+
+def stream_json(
+    fields: Sequence[str], chunks: Iterator[List[Tuple[Any, ...]]], limit: int
+) -> Iterator[bytes]:
+    """
+    Stream the rows as a JSON object with the fields, the rows (timestamp first) and
+    the cursor for the next page (null if there are no more rows).
+    """
+    yield ('{"fields": %s, "rows": [' % json.dumps([TIME_COLUMN, *fields])).encode()
+
+    n_rows = 0
+    last_row = None
+    for rows in chunks:
+        prefix = "," if n_rows else ""
+        yield (prefix + ",".join(map(encode_row, rows))).encode()
+        n_rows += len(rows)
+        last_row = rows[-1]
+
+    next_cursor = (
+        encode_cursor(last_row[0]) if n_rows == limit and last_row is not None else None
+    )
+    yield ('], "next_cursor": %s}' % json.dumps(next_cursor)).encode()
+
+
+def get_query_parameters(
+    start: datetime,
+    end: datetime,
+    limit: int,
+    bucket: Optional[int],
+    after: Optional[datetime],
+) -> Dict[str, Any]:
+    # Aware bounds are converted like written timestamps (see utils.to_naive_utc)
+    parameters: Dict[str, Any] = {
+        "start": to_naive_utc(start),
+        "end": to_naive_utc(end),
+        "limit": limit,
+    }
+    if bucket is not None:
+        parameters["bucket"] = bucket
+    if after is not None:
+        parameters["after"] = to_naive_utc(after)
+    return parameters
@@ -0,0 +1,135 @@
+import json
+import logging
+from datetime import datetime
+from typing import Dict
+
+from data_organizer.db.connection import DatabaseConnection
+from data_organizer.db.exceptions import QueryReturnedNoData
+from pypika import Table
+from sqlalchemy import text
+
+from iot_data_receiver.endpoints import EndpointDescription, Registration
+from iot_data_receiver.model import RegisterInput
+from iot_data_receiver.partitions import (
+    PARTITION_COLUMN,
+    get_create_partitioned_table_sql,
+    maintain_partitions,
+)
+from iot_data_receiver.rollups import create_rollup_tables
+from iot_data_receiver.utils import get_table_name
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidRegistration(Exception):
+    pass
+
+
+def is_registered(db: DatabaseConnection, sender_id: int, endpoint: str) -> bool:
+    ers = Table("endpoint_request_subsets")
+    try:
+        db.query(
+            db.pypika_query.from_(ers)
+            .select("*")
+            .where(ers.id == sender_id)
+            .where(ers.endpoint == endpoint)
+            .get_sql()
+        )
+    except QueryReturnedNoData:
+        return False
+    return True
+
+
+def create_partitioned_table(
+    db: DatabaseConnection,
+    registration: Registration,
+    column_types: Dict[str, str],
+    premake: int,
+) -> None:
+    """Create the partitioned table of the registration and its first partitions"""
+    with db.engine.connect() as connection:
+        query = get_create_partitioned_table_sql(
+            registration.table_name, column_types, registration.primary_fields
+        )
+        logger.debug(query)
+        connection.execute(text(query))
+        connection.commit()
+
+    maintain_partitions(db, registration, premake, datetime.utcnow())
+
+
+def register_endpoint(
+    db: DatabaseConnection,
+    description: EndpointDescription,
+    sender_id: int,
+    sender_name: str,
+    register_input: RegisterInput,
+    premake: int,
+) -> bool:
+    """
+    Create the table of the sender for the endpoint (with its partitions and rollups)
+    and add the registration to the endpoint_request_subsets table. Used by /register
+    and the create_senders command.
+
+    :param premake: Number of upcoming partitions created for partitioned tables
+    :return: False if the sender was already registered for the endpoint
+    :raises InvalidRegistration: If the registration input is not valid for the
+                                 endpoint
+    """
+    if is_registered(db, sender_id, register_input.endpoint):
+        return False
+
+    table_name = get_table_name(sender_name, register_input.endpoint)
+    final_fields = description.get_final_fields(register_input.fields)
+    if register_input.partitioning is None:
+        table_settings = description.generate_table_structure(
+            table_name, register_input.fields
+        )
+        db.create_table_from_table_info([table_settings])
+    else:
+        if PARTITION_COLUMN not in final_fields:
+            raise InvalidRegistration(
+                f"Partitioned tables require the field {PARTITION_COLUMN}"
+            )
+        create_partitioned_table(
+            db,
+            Registration(
+                table_name,
+                final_fields,
+                primary_fields=description.get_primary_fields(),
+                partitioning=register_input.partitioning,
+                retention_days=register_input.retention_days,
+            ),
+            description.get_column_types(final_fields),
+            premake,
+        )
+    if register_input.rollups:
+        create_rollup_tables(
+            db, Registration(table_name, final_fields), register_input.rollups
+        )
+
+    with db.engine.connect() as connection:
+        query = (
+            db.pypika_query.into(Table("endpoint_request_subsets"))
+            .insert(
+                sender_id,
+                register_input.endpoint,
+                table_name,
+                json.dumps(
+                    {
+                        "fields": final_fields,
+                        "on_conflict": register_input.on_conflict.value,
+                        "partitioning": register_input.partitioning,
+                        "retention_days": register_input.retention_days,
+                        "rollups": sorted(register_input.rollups),
+                    }
+                ),
+            )
+            .get_sql()
+        )
+        logger.debug(query)
+        connection.execute(text(query))
+        connection.commit()
+
+    logger.info("Added id / endpoint to **endpoint_request_subsets** table")
+    return True
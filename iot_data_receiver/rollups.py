@@ -0,0 +1,270 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+from data_organizer.db.connection import DatabaseConnection
+
+from iot_data_receiver.endpoints import Registration, quote_identifier
+from iot_data_receiver.model import Aggregation
+from iot_data_receiver.query import BUCKET_ORIGIN, TIME_COLUMN
+from iot_data_receiver.utils import (
+    get_suffixed_name,
+    normalize_timestamps,
+    to_naive_utc,
+)
+
+logger = logging.getLogger(__name__)
+
+BUCKET_COLUMN = "bucket"
+COUNT_COLUMN = "count"
+
+# Statistics stored per field. The mean is sum / count, so rollups can be merged
+ROLLUP_STATISTICS = ["min", "max", "sum"]
+
+ROLLUP_AGGREGATIONS = {
+    Aggregation.MEAN: "sum({sum}) / sum({count})",
+    Aggregation.MIN: "min({min})",
+    Aggregation.MAX: "max({max})",
+}
+
+_origin = datetime.fromisoformat(BUCKET_ORIGIN)
+
+
+def get_rollup_table_name(table_name: str, resolution: int) -> str:
+    return get_suffixed_name(table_name, f"_rollup_{resolution}")
+
+
+def get_statistic_column(field: str, statistic: str) -> str:
+    return quote_identifier(f"{field}_{statistic}")
+
+
+def get_bucket_start(timestamp: datetime, resolution: int) -> datetime:
+    """
+    Start of the bucket containing the timestamp (aligned like date_bin). Aware
+    timestamps are converted like written ones (see utils.to_naive_utc).
+    """
+    offset = (to_naive_utc(timestamp) - _origin) // timedelta(seconds=resolution)
+    return _origin + offset * timedelta(seconds=resolution)
+
+
+def is_aligned(timestamp: datetime, resolution: int) -> bool:
+    return get_bucket_start(timestamp, resolution) == to_naive_utc(timestamp)
+
+
+def get_rollup_sources(resolutions: Sequence[int]) -> Dict[int, Optional[int]]:
+    """
+    Source of each rollup: the coarsest finer rollup the resolution is a multiple of
+    (e.g. 1 hour from 1 minute), or None for the raw table.
+    """
+    sources: Dict[int, Optional[int]] = {}
+    for resolution in sorted(resolutions):
+        finer = [
+            source
+            for source in sources
+            if source < resolution and resolution % source == 0
+        ]
+        sources[resolution] = max(finer) if finer else None
+    return sources
+
+
+def get_create_rollup_table_sql(
+    table_name: str, resolution: int, fields: Sequence[str]
+) -> str:
+    columns = [
+        f"{quote_identifier(BUCKET_COLUMN)} TIMESTAMP PRIMARY KEY",
+        f"{quote_identifier(COUNT_COLUMN)} BIGINT NOT NULL",
+        *[
+            f"{get_statistic_column(field, statistic)} DOUBLE PRECISION"
+            for field in fields
+            for statistic in ROLLUP_STATISTICS
+        ],
+    ]
+    return "CREATE TABLE IF NOT EXISTS {} ({})".format(
+        quote_identifier(get_rollup_table_name(table_name, resolution)),
+        ", ".join(columns),
+    )
+
+
+def get_refresh_rollup_sql(
+    table_name: str,
+    resolution: int,
+    fields: Sequence[str],
+    source: Optional[int],
+) -> str:
+    """
+    Statement recomputing the buckets of the rollup between the parameters start and
+    end (aligned to the resolution) from the raw table or the finer source rollup.
+    Recomputing instead of adding the new rows keeps the rollups correct if rows are
+    updated or skipped on conflicts.
+    """
+    if source is None:
+        source_table = table_name
+        time_column = quote_identifier(TIME_COLUMN)
+        count = "count(*)"
+        statistics = [
+            f"{statistic}({quote_identifier(field)})"
+            for field in fields
+            for statistic in ROLLUP_STATISTICS
+        ]
+    else:
+        source_table = get_rollup_table_name(table_name, source)
+        time_column = quote_identifier(BUCKET_COLUMN)
+        count = f"sum({quote_identifier(COUNT_COLUMN)})"
+        # Minimum of the minima, maximum of the maxima and sum of the sums
+        statistics = [
+            f"{statistic}({get_statistic_column(field, statistic)})"
+            for field in fields
+            for statistic in ROLLUP_STATISTICS
+        ]
+
+    columns = [
+        quote_identifier(BUCKET_COLUMN),
+        quote_identifier(COUNT_COLUMN),
+        *[
+            get_statistic_column(field, statistic)
+            for field in fields
+            for statistic in ROLLUP_STATISTICS
+        ],
+    ]
+    updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in columns[1:])
+    return (
+        f"INSERT INTO {quote_identifier(get_rollup_table_name(table_name, resolution))}"
+        f" ({', '.join(columns)}) "
+        f"SELECT date_bin(make_interval(secs => {int(resolution)}), {time_column}, "
+        f"TIMESTAMP '{BUCKET_ORIGIN}'), {count}, {', '.join(statistics)} "
+        f"FROM {quote_identifier(source_table)} "
+        f"WHERE {time_column} >= %(start)s AND {time_column} < %(end)s GROUP BY 1 "
+        f"ON CONFLICT ({quote_identifier(BUCKET_COLUMN)}) DO UPDATE SET {updates}"
+    )
+
+
+def get_value_fields(registration: Registration) -> List[str]:
+    return [field for field in registration.fields if field != TIME_COLUMN]
+
+
+def create_rollup_tables(
+    db: DatabaseConnection, registration: Registration, resolutions: Sequence[int]
+) -> None:
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            for resolution in resolutions:
+                cursor.execute(
+                    get_create_rollup_table_sql(
+                        registration.table_name,
+                        resolution,
+                        get_value_fields(registration),
+                    )
+                )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def refresh_rollups(
+    db: DatabaseConnection,
+    registration: Registration,
+    first: datetime,
+    last: datetime,
+) -> None:
+    """
+    Recompute the buckets of all rollups of the registration containing timestamps
+    between first and last. Finer rollups are refreshed first, so coarser ones can be
+    computed from them.
+    """
+    if not registration.rollups:
+        return
+
+    fields = get_value_fields(registration)
+    connection = db.engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            # Serializes refreshes of the table, so a refresh started before a
+            # concurrent write committed can not overwrite the newer result
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(hashtext(%s))",
+                (registration.table_name,),
+            )
+            for resolution, source in get_rollup_sources(registration.rollups).items():
+                cursor.execute(
+                    get_refresh_rollup_sql(
+                        registration.table_name, resolution, fields, source
+                    ),
+                    {
+                        "start": get_bucket_start(first, resolution),
+                        "end": get_bucket_start(last, resolution)
+                        + timedelta(seconds=resolution),
+                    },
+                )
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def refresh_rollups_for_columns(
+    db: DatabaseConnection, registration: Registration, timestamps: Sequence[Any]
+) -> None:
+    """Refresh the rollups for the timestamps of a written batch"""
+    if not registration.rollups or not timestamps:
+        return
+    if isinstance(timestamps[0], str):
+        timestamps = [datetime.fromisoformat(value) for value in timestamps]
+    timestamps = normalize_timestamps(list(timestamps))
+    refresh_rollups(db, registration, min(timestamps), max(timestamps))
+
+
+def choose_rollup(
+    resolutions: Sequence[int],
+    bucket: int,
+    start: datetime,
+    end: datetime,
+    aggregation: Aggregation,
+) -> Optional[int]:
+    """
+    Coarsest rollup a query with the bucket size can be answered from: the bucket has
+    to be a multiple of its resolution and the time range aligned to it. None if the
+    query has to use the raw table.
+    """
+    if aggregation not in ROLLUP_AGGREGATIONS:
+        return None
+    adequate = [
+        resolution
+        for resolution in resolutions
+        if bucket % resolution == 0
+        and is_aligned(start, resolution)
+        and is_aligned(end, resolution)
+    ]
+    return max(adequate) if adequate else None
+
+
+def build_rollup_query(
+    table_name: str,
+    resolution: int,
+    fields: Sequence[str],
+    aggregation: Aggregation,
+    after_cursor: bool,
+) -> str:
+    """Like query.build_query with a bucket, but reading the rollup table"""
+    bucket_column = quote_identifier(BUCKET_COLUMN)
+    conditions = [f"{bucket_column} >= %(start)s", f"{bucket_column} < %(end)s"]
+    if after_cursor:
+        conditions.append(
+            f"{bucket_column} >= %(after)s + make_interval(secs => %(bucket)s)"
+        )
+    expressions = [
+        ROLLUP_AGGREGATIONS[aggregation].format(
+            count=quote_identifier(COUNT_COLUMN),
+            **{
+                statistic: get_statistic_column(field, statistic)
+                for statistic in ROLLUP_STATISTICS
+            },
+        )
+        for field in fields
+    ]
+    return (
+        f"SELECT date_bin(make_interval(secs => %(bucket)s), {bucket_column}, "
+        f"TIMESTAMP '{BUCKET_ORIGIN}') AS {quote_identifier(TIME_COLUMN)}, "
+        f"{', '.join(expressions)} "
+        f"FROM {quote_identifier(get_rollup_table_name(table_name, resolution))} "
+        f"WHERE {' AND '.join(conditions)} GROUP BY 1 ORDER BY 1 LIMIT %(limit)s"
+    )
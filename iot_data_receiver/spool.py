@@ -0,0 +1,336 @@
+import fcntl
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Every record is prefixed with its length and its crc32 checksum
+RECORD_HEADER = struct.Struct(">II")
+SEGMENT_SUFFIX = ".spool"
+DEAD_LETTER_FILE = "dead_letter.jsonl"
+
+
+class SpoolFull(Exception):
+    pass
+
+
+class InvalidRecord(Exception):
+    """
+    Raised by the write function of the SpoolReplayer for records that can never be
+    written
+    """
+
+
+def encode_value(value: Any) -> Any:
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class Spool:
+    """
+    Append-only on-disk log of records, split into segment files. Records are written
+    with a length prefix and a checksum, so a record truncated by a crash is detected
+    when reading the segment.
+
+    Several processes (e.g. the workers of the server) can share the directory. Each
+    writes to its own segment and holds an exclusive lock (flock) on it until it is
+    closed, so the segment is skipped by the replayers of the other processes (see
+    lock_segment).
+
+    :param directory: Directory of the segment files
+    :param segment_size: Size in bytes after which a new segment is started
+    :param max_size: Maximum size in bytes of all segments. Appending beyond this
+                     raises SpoolFull.
+    :param fsync_interval: Minimum time in seconds between two fsync calls. Records
+                           appended in between are only written to the os buffers.
+                           0 syncs every record.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_size: int,
+        max_size: int,
+        fsync_interval: float,
+    ) -> None:
+        self.directory = Path(directory)
+        self.segment_size = segment_size
+        self.max_size = max_size
+        self.fsync_interval = fsync_interval
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dead_letter_path = self.directory / DEAD_LETTER_FILE
+        self.appended_records = 0
+        self.dead_letter_records = 0
+        self._lock = threading.Lock()
+        self._last_fsync = 0.0
+        self._size = self._get_disk_size()
+        self._current_path, self._current = self._open_segment()
+
+    def _segments(self) -> List[Path]:
+        return sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+
+    def _get_disk_size(self) -> int:
+        size = 0
+        for path in self._segments():
+            try:
+                size += path.stat().st_size
+            except FileNotFoundError:
+                # Removed by the replayer of another process
+                pass
+        return size
+
+    def _get_next_path(self) -> Path:
+        segments = self._segments()
+        next_index = int(segments[-1].stem) + 1 if segments else 0
+        return self.directory / f"{next_index:012d}{SEGMENT_SUFFIX}"
+
+    def _open_segment(self) -> Tuple[Path, BinaryIO]:
+        # The segment is locked before it gets its name, so no other process can
+        # replay it in between. Linking fails if another process took the name.
+        temp_path = self.directory / f".{os.getpid()}.tmp"
+        segment = open(temp_path, "wb")
+        fcntl.flock(segment.fileno(), fcntl.LOCK_EX)
+        try:
+            while True:
+                path = self._get_next_path()
+                try:
+                    os.link(temp_path, path)
+                    break
+                except FileExistsError:
+                    continue
+        finally:
+            temp_path.unlink()
+        return path, segment
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def append(self, record: Dict[str, Any]) -> None:
+        payload = json.dumps(record, default=encode_value).encode("utf-8")
+        data = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._size + len(data) > self.max_size:
+                raise SpoolFull
+            if self._current.tell() + len(data) > self.segment_size:
+                self._rotate()
+            self._current.write(data)
+            self._current.flush()
+            now = time.monotonic()
+            if now - self._last_fsync >= self.fsync_interval:
+                os.fsync(self._current.fileno())
+                self._last_fsync = now
+            self._size += len(data)
+            self.appended_records += 1
+
+    def _rotate(self) -> None:
+        self._current.flush()
+        os.fsync(self._current.fileno())
+        self._current.close()
+        self._current_path, self._current = self._open_segment()
+        # Includes the segments appended and removed by other processes
+        self._size = self._get_disk_size()
+
+    def rotate(self) -> None:
+        """Start a new segment if the current one contains records"""
+        with self._lock:
+            if self._current.tell() > 0:
+                self._rotate()
+
+    def closed_segments(self) -> List[Path]:
+        """
+        All segments that are not written to by this spool, oldest first. Segments
+        written by other processes are skipped by lock_segment.
+        """
+        with self._lock:
+            return [path for path in self._segments() if path != self._current_path]
+
+    def has_records(self) -> bool:
+        return self._size > 0
+
+    def remove_segment(self, path: Path) -> None:
+        with self._lock:
+            path.unlink()
+            self._size = self._get_disk_size()
+
+    def add_dead_letter(self, record: Dict[str, Any], reason: str) -> None:
+        """
+        Append a record that can not be written to the dead letter file, one JSON
+        object with the record and the reason per line
+        """
+        line = json.dumps({"reason": reason, "record": record}, default=encode_value)
+        with self._lock:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as dead_letter:
+                dead_letter.write(line + "\n")
+                dead_letter.flush()
+                os.fsync(dead_letter.fileno())
+            self.dead_letter_records += 1
+
+    def close(self) -> None:
+        with self._lock:
+            self._current.flush()
+            os.fsync(self._current.fileno())
+            if self._current.tell() == 0:
+                self._current_path.unlink()
+            self._current.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self._size,
+            "segments": len(self._segments()),
+            "appended_records": self.appended_records,
+            "dead_letter_records": self.dead_letter_records,
+        }
+
+
+def read_segment(path: Path) -> Iterator[Dict[str, Any]]:
+    """Read the records of a segment. Stops at the first truncated or corrupt record"""
+    with open(path, "rb") as segment:
+        yield from read_records(segment, path)
+
+
+def read_records(segment: BinaryIO, path: Path) -> Iterator[Dict[str, Any]]:
+    while True:
+        header = segment.read(RECORD_HEADER.size)
+        if len(header) < RECORD_HEADER.size:
+            return
+        length, checksum = RECORD_HEADER.unpack(header)
+        payload = segment.read(length)
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            logger.error("Found corrupt record in %s. Skipping the rest", path)
+            return
+        yield json.loads(payload)
+
+
+def lock_segment(path: Path) -> Optional[BinaryIO]:
+    """
+    Open a segment and take an exclusive lock for replaying it. Returns None if the
+    segment is locked by another process (written or replayed) or was removed.
+    """
+    try:
+        segment = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(segment.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # Replayed and removed by another process between opening and locking
+        if os.stat(path).st_ino != os.fstat(segment.fileno()).st_ino:
+            raise FileNotFoundError
+    except (BlockingIOError, FileNotFoundError):
+        segment.close()
+        return None
+    return segment
+
+
+class SpoolReplayer:
+    """
+    Background thread writing the records of the spool with the passed function. If
+    writing a record fails, the replay is retried after replay_interval seconds.
+    Records for which write raises InvalidRecord are moved to the dead letter file of
+    the spool instead. Segments are removed once all their records are written.
+    Segments locked by other processes are skipped, the lock of a partially replayed
+    segment is held until it is replayed or the replayer is closed.
+
+    :param spool: Spool to replay
+    :param write: Function writing a single record
+    :param replay_interval: Time in seconds between two replay attempts
+    :param replay_rate: Maximum number of records written per second
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        write: Callable[[Dict[str, Any]], None],
+        replay_interval: float,
+        replay_rate: float,
+    ) -> None:
+        self.spool = spool
+        self.write = write
+        self.replay_interval = replay_interval
+        self.replay_rate = replay_rate
+        self.replayed_records = 0
+
+        # Locked segment and number of already written records of the segment
+        # partially replayed
+        self._progress: Dict[Path, Tuple[BinaryIO, int]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="SpoolReplayer", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.replay_interval):
+            if self.spool.has_records():
+                self.replay()
+
+    def replay(self) -> bool:
+        """Replay all records in the spool. Returns True if all records were written"""
+        with self._lock:
+            self.spool.rotate()
+            for path in self.spool.closed_segments():
+                if not self._replay_segment(path):
+                    return False
+            return True
+
+    def _replay_segment(self, path: Path) -> bool:
+        if path in self._progress:
+            segment, start_at = self._progress.pop(path)
+            segment.seek(0)
+        else:
+            locked = lock_segment(path)
+            if locked is None:
+                return True
+            segment, start_at = locked, 0
+        for i, record in enumerate(read_records(segment, path)):
+            if i < start_at:
+                continue
+            if self._stop.is_set():
+                self._progress[path] = (segment, i)
+                return False
+            try:
+                self.write(record)
+            except InvalidRecord as e:
+                logger.error(
+                    "Record %s of %s can not be written: %s. Moving it to %s",
+                    i,
+                    path,
+                    e,
+                    self.spool.dead_letter_path,
+                )
+                self.spool.add_dead_letter(record, str(e))
+                continue
+            except Exception as e:
+                logger.warning("Replay of %s failed: %s", path, e)
+                self._progress[path] = (segment, i)
+                return False
+            self.replayed_records += 1
+            if self.replay_rate > 0:
+                time.sleep(1 / self.replay_rate)
+
+        # Removed while locked, so no other process replays it again
+        self.spool.remove_segment(path)
+        segment.close()
+        logger.info("Replayed spool segment %s", path)
+        return True
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            for segment, _ in self._progress.values():
+                segment.close()
+            self._progress.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"replayed_records": self.replayed_records}
@@ -1,15 +1,68 @@
+from datetime import datetime, timezone
+from hashlib import sha256
 from secrets import token_hex
-from typing import Tuple
+from typing import Any, List, Tuple
 
-from passlib.context import CryptContext
+from iot_data_receiver.hashing import hash_token
 
+KEY_LOOKUP_LENGTH = 16
 
-def generate_token(nbytes: int) -> Tuple[str, str]:
+MAX_IDENTIFIER_LENGTH = 63
+
+
+def generate_token(nbytes: int, **hashing: Any) -> Tuple[str, str]:
+    """
+    Generate a key and its hash. The hashing settings are passed to get_crypt_context
+    (bcrypt by default).
+    """
     token = token_hex(nbytes)
-    hashed_token = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(token)
+    hashed_token = hash_token(token, **hashing)
 
     return token, hashed_token
 
 
+def get_key_lookup(token: str) -> str:
+    """
+    Non-secret lookup id for a api key. It is stored (and indexed) next to the hashed
+    key so a presented key can be resolved to a single sender row before the expensive
+    verification.
+    """
+    return sha256(token.encode("utf-8")).hexdigest()[:KEY_LOOKUP_LENGTH]
+
+
 def get_table_name(name: str, endpoint: str) -> str:
     return f"{name.lower().replace('-','_')}_{endpoint}"
+
+
+def get_suffixed_name(name: str, suffix: str) -> str:
+    """
+    Name of a table derived from the table name (e.g. partitions). Postgres truncates
+    identifiers longer than MAX_IDENTIFIER_LENGTH, which could map two tables to the
+    same name, so long names are shortened and made unique with a digest instead.
+    """
+    if len(name) + len(suffix) <= MAX_IDENTIFIER_LENGTH:
+        return f"{name}{suffix}"
+    digest = sha256(name.encode("utf-8")).hexdigest()[:8]
+    keep = MAX_IDENTIFIER_LENGTH - len(suffix) - len(digest) - 1
+    return f"{name[:keep]}_{digest}{suffix}"
+
+
+def to_naive_utc(timestamp: datetime) -> datetime:
+    """
+    Naive time of the timestamp as stored in TIMESTAMP columns. Aware timestamps are
+    converted to UTC first, naive timestamps are returned as they are.
+    """
+    if timestamp.utcoffset() is None:
+        return timestamp
+    return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def normalize_timestamps(timestamps: List[datetime]) -> List[datetime]:
+    """
+    Timestamps converted with to_naive_utc. Written, partitioned, rolled up and queried
+    timestamps are all normalized like this, so the result does not depend on how the
+    value is passed to the database (COPY, INSERT or spooled).
+    """
+    if all(timestamp.utcoffset() is None for timestamp in timestamps):
+        return timestamps
+    return [to_naive_utc(timestamp) for timestamp in timestamps]
@@ -5,9 +5,18 @@ CREATE TABLE iot_receiver.senders (
 	"id" SERIAL PRIMARY KEY,
 	"sender_name" VARCHAR(50) NOT NULL,
 	"hashed_key" TEXT NOT NULL,
+	"key_lookup" VARCHAR(16),
+	"previous_hashed_key" TEXT,
+	"previous_key_lookup" VARCHAR(16),
+	"previous_key_expires" TIMESTAMP,
     UNIQUE("hashed_key")
 );
 
+CREATE UNIQUE INDEX senders_key_lookup_idx ON iot_receiver.senders ("key_lookup");
+
+CREATE UNIQUE INDEX senders_previous_key_lookup_idx
+ON iot_receiver.senders ("previous_key_lookup");
+
 CREATE TABLE iot_receiver.endpoint_request_subsets (
 	"id" INT NOT NULL,
 	"endpoint" VARCHAR(50) NOT NULL,
@@ -15,4 +24,70 @@ CREATE TABLE iot_receiver.endpoint_request_subsets (
 	"subset" JSON NOT NULL,
 	FOREIGN KEY("id")
  	REFERENCES iot_receiver.senders("id")
-)
\ No newline at end of file
+);
+
+CREATE TABLE iot_receiver.gateway_senders (
+	"gateway_id" INT NOT NULL,
+	"sender_id" INT NOT NULL,
+	PRIMARY KEY("gateway_id", "sender_id"),
+	FOREIGN KEY("gateway_id")
+ 	REFERENCES iot_receiver.senders("id"),
+	FOREIGN KEY("sender_id")
+ 	REFERENCES iot_receiver.senders("id")
+);
+
+CREATE TABLE iot_receiver.cache_versions (
+	"name" TEXT PRIMARY KEY,
+	"version" BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO iot_receiver.cache_versions ("name")
+VALUES ('senders'), ('endpoint_request_subsets'), ('gateway_senders');
+
+-- Bumps the version of the table and sends the version, the operation and the key
+-- columns passed as trigger arguments of the changed row on the channel
+-- iot_receiver_cache
+CREATE FUNCTION iot_receiver.notify_cache_change() RETURNS trigger AS $$
+DECLARE
+	changed JSONB;
+	keys JSONB := '{}';
+	new_version BIGINT;
+BEGIN
+	IF TG_OP = 'DELETE' THEN
+		changed := to_jsonb(OLD);
+	ELSE
+		changed := to_jsonb(NEW);
+	END IF;
+	FOR i IN 0 .. TG_NARGS - 1 LOOP
+		keys := keys || jsonb_build_object(TG_ARGV[i], changed -> TG_ARGV[i]);
+	END LOOP;
+	EXECUTE format(
+		'UPDATE %I.cache_versions SET "version" = "version" + 1 '
+		'WHERE "name" = $1 RETURNING "version"',
+		TG_TABLE_SCHEMA
+	) INTO new_version USING TG_TABLE_NAME;
+	PERFORM pg_notify(
+		'iot_receiver_cache',
+		jsonb_build_object(
+			'schema', TG_TABLE_SCHEMA,
+			'table', TG_TABLE_NAME,
+			'operation', TG_OP,
+			'version', new_version,
+			'keys', keys
+		)::text
+	);
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER senders_cache_change
+AFTER INSERT OR UPDATE OR DELETE ON iot_receiver.senders
+FOR EACH ROW EXECUTE FUNCTION iot_receiver.notify_cache_change('id');
+
+CREATE TRIGGER endpoint_request_subsets_cache_change
+AFTER INSERT OR UPDATE OR DELETE ON iot_receiver.endpoint_request_subsets
+FOR EACH ROW EXECUTE FUNCTION iot_receiver.notify_cache_change('id', 'endpoint');
+
+CREATE TRIGGER gateway_senders_cache_change
+AFTER INSERT OR UPDATE OR DELETE ON iot_receiver.gateway_senders
+FOR EACH ROW EXECUTE FUNCTION iot_receiver.notify_cache_change('gateway_id');
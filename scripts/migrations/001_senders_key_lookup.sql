@@ -0,0 +1,6 @@
+-- Adds the indexed key lookup id to the senders table. Existing senders keep a NULL
+-- key_lookup and are migrated on their first successful request (see the
+-- auth.legacy_key_fallback setting).
+ALTER TABLE iot_receiver.senders ADD COLUMN "key_lookup" VARCHAR(16);
+
+CREATE UNIQUE INDEX senders_key_lookup_idx ON iot_receiver.senders ("key_lookup");
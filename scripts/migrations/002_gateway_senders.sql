@@ -0,0 +1,10 @@
+-- Adds the table assigning senders to gateways for the /gateway endpoint
+CREATE TABLE iot_receiver.gateway_senders (
+	"gateway_id" INT NOT NULL,
+	"sender_id" INT NOT NULL,
+	PRIMARY KEY("gateway_id", "sender_id"),
+	FOREIGN KEY("gateway_id")
+ 	REFERENCES iot_receiver.senders("id"),
+	FOREIGN KEY("sender_id")
+ 	REFERENCES iot_receiver.senders("id")
+);
@@ -0,0 +1,58 @@
+-- Adds the version stamps and triggers notifying running services of changed senders,
+-- registrations and gateway assignments, so their caches are invalidated immediately
+-- (see the [coherence] settings)
+CREATE TABLE iot_receiver.cache_versions (
+	"name" TEXT PRIMARY KEY,
+	"version" BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO iot_receiver.cache_versions ("name")
+VALUES ('senders'), ('endpoint_request_subsets'), ('gateway_senders');
+
+-- Bumps the version of the table and sends the version, the operation and the key
+-- columns passed as trigger arguments of the changed row on the channel
+-- iot_receiver_cache
+CREATE FUNCTION iot_receiver.notify_cache_change() RETURNS trigger AS $$
+DECLARE
+	changed JSONB;
+	keys JSONB := '{}';
+	new_version BIGINT;
+BEGIN
+	IF TG_OP = 'DELETE' THEN
+		changed := to_jsonb(OLD);
+	ELSE
+		changed := to_jsonb(NEW);
+	END IF;
+	FOR i IN 0 .. TG_NARGS - 1 LOOP
+		keys := keys || jsonb_build_object(TG_ARGV[i], changed -> TG_ARGV[i]);
+	END LOOP;
+	EXECUTE format(
+		'UPDATE %I.cache_versions SET "version" = "version" + 1 '
+		'WHERE "name" = $1 RETURNING "version"',
+		TG_TABLE_SCHEMA
+	) INTO new_version USING TG_TABLE_NAME;
+	PERFORM pg_notify(
+		'iot_receiver_cache',
+		jsonb_build_object(
+			'schema', TG_TABLE_SCHEMA,
+			'table', TG_TABLE_NAME,
+			'operation', TG_OP,
+			'version', new_version,
+			'keys', keys
+		)::text
+	);
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER senders_cache_change
+AFTER INSERT OR UPDATE OR DELETE ON iot_receiver.senders
+FOR EACH ROW EXECUTE FUNCTION iot_receiver.notify_cache_change('id');
+
+CREATE TRIGGER endpoint_request_subsets_cache_change
+AFTER INSERT OR UPDATE OR DELETE ON iot_receiver.endpoint_request_subsets
+FOR EACH ROW EXECUTE FUNCTION iot_receiver.notify_cache_change('id', 'endpoint');
+
+CREATE TRIGGER gateway_senders_cache_change
+AFTER INSERT OR UPDATE OR DELETE ON iot_receiver.gateway_senders
+FOR EACH ROW EXECUTE FUNCTION iot_receiver.notify_cache_change('gateway_id');
@@ -0,0 +1,9 @@
+-- Adds the previous key of a sender. After a rotation with the rotate_keys command the
+-- previous key stays valid until previous_key_expires (UTC), so devices can be updated
+-- while both keys are accepted.
+ALTER TABLE iot_receiver.senders ADD COLUMN "previous_hashed_key" TEXT;
+ALTER TABLE iot_receiver.senders ADD COLUMN "previous_key_lookup" VARCHAR(16);
+ALTER TABLE iot_receiver.senders ADD COLUMN "previous_key_expires" TIMESTAMP;
+
+CREATE UNIQUE INDEX senders_previous_key_lookup_idx
+ON iot_receiver.senders ("previous_key_lookup");
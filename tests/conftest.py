@@ -1,4 +1,6 @@
 from copy import deepcopy
+from pathlib import Path
+from typing import Optional
 
 import pytest
 from data_organizer.db.connection import DatabaseConnection
@@ -7,14 +9,20 @@ from fastapi.testclient import TestClient
 from sqlalchemy import text
 
 import iot_data_receiver
+from iot_data_receiver.database import get_connection_settings
 from iot_data_receiver.main import app
-from iot_data_receiver.utils import generate_token
+from iot_data_receiver.utils import generate_token, get_key_lookup
+
+COHERENCE_MIGRATION = (
+    Path(__file__).parent.parent / "scripts" / "migrations" / "003_cache_coherence.sql"
+)
 
 
 def setup_database(
     db: DatabaseConnection,
     settings_: LazySettings,
     hashed_token: str,
+    key_lookup: Optional[str] = None,
 ):
     with db.engine.connect() as connection:
         connection.execute(
@@ -24,7 +32,13 @@ def setup_database(
                     "id" SERIAL PRIMARY KEY,
                     "sender_name" VARCHAR(50) NOT NULL,
                     "hashed_key" TEXT NOT NULL,
-                    UNIQUE("hashed_key")
+                    "key_lookup" VARCHAR(16),
+                    "previous_hashed_key" TEXT,
+                    "previous_key_lookup" VARCHAR(16),
+                    "previous_key_expires" TIMESTAMP,
+                    UNIQUE("hashed_key"),
+                    UNIQUE("key_lookup"),
+                    UNIQUE("previous_key_lookup")
                 );
                 """
             )
@@ -44,14 +58,39 @@ def setup_database(
         connection.execute(
             text(
                 f"""
-                INSERT INTO {settings_.db.schema}.senders
-                VALUES (DEFAULT, 'test_name', '{hashed_token}');
+                CREATE TABLE {settings_.db.schema}.gateway_senders (
+                    "gateway_id" INT NOT NULL,
+                    "sender_id" INT NOT NULL,
+                    PRIMARY KEY("gateway_id", "sender_id")
+                )
                 """
             )
         )
+        connection.execute(
+            text(
+                f"""
+                INSERT INTO {settings_.db.schema}.senders
+                VALUES (DEFAULT, 'test_name', '{hashed_token}', :key_lookup);
+                """
+            ),
+            {"key_lookup": key_lookup},
+        )
 
         connection.commit()
 
+    # Version table and triggers of the cache listener
+    raw_connection = db.engine.raw_connection()
+    try:
+        with raw_connection.cursor() as cursor:
+            cursor.execute(
+                COHERENCE_MIGRATION.read_text().replace(
+                    "iot_receiver.", f"{settings_.db.schema}."
+                )
+            )
+        raw_connection.commit()
+    finally:
+        raw_connection.close()
+
 
 def drop_schema(db: DatabaseConnection, schema: str):
     with db.engine.connect() as connection:
@@ -59,6 +98,14 @@ def drop_schema(db: DatabaseConnection, schema: str):
         connection.commit()
 
 
+@pytest.fixture(autouse=True)
+def clear_caches():
+    iot_data_receiver.main.api_key_cache.clear()
+    iot_data_receiver.main.registration_cache.clear()
+    iot_data_receiver.main.gateway_cache.clear()
+    iot_data_receiver.main.partition_manager.clear()
+
+
 def mock_settings(mocker):
     settings_: LazySettings = deepcopy(iot_data_receiver.main.config.settings)
 
@@ -75,7 +122,25 @@ def test_session(mocker):
 
     token, hashed_token = generate_token(20)
 
-    db = DatabaseConnection(**settings_.db.to_dict(), name="IoTReceiver_test")
+    db = DatabaseConnection(
+        **get_connection_settings(settings_.db), name="IoTReceiver_test"
+    )
+    setup_database(db, settings_, hashed_token, get_key_lookup(token))
+
+    yield token, db
+
+    drop_schema(db, settings_.db.schema)
+
+
+@pytest.fixture
+def test_session_legacy_key(mocker):
+    settings_ = mock_settings(mocker)
+
+    token, hashed_token = generate_token(20)
+
+    db = DatabaseConnection(
+        **get_connection_settings(settings_.db), name="IoTReceiver_test"
+    )
     setup_database(db, settings_, hashed_token)
 
     yield token, db
@@ -89,8 +154,10 @@ def test_environment_session_full(mocker):
 
     token, hashed_token = generate_token(20)
 
-    db = DatabaseConnection(**settings_.db.to_dict(), name="IoTReceiver_test")
-    setup_database(db, settings_, hashed_token)
+    db = DatabaseConnection(
+        **get_connection_settings(settings_.db), name="IoTReceiver_test"
+    )
+    setup_database(db, settings_, hashed_token, get_key_lookup(token))
 
     with db.engine.connect() as connection:
         table_name = "test_name_environment"
@@ -138,8 +205,10 @@ def test_environment_session_minimal(mocker):
 
     token, hashed_token = generate_token(20)
 
-    db = DatabaseConnection(**settings_.db.to_dict(), name="IoTReceiver_test")
-    setup_database(db, settings_, hashed_token)
+    db = DatabaseConnection(
+        **get_connection_settings(settings_.db), name="IoTReceiver_test"
+    )
+    setup_database(db, settings_, hashed_token, get_key_lookup(token))
 
     with db.engine.connect() as connection:
         table_name = "test_name_environment"
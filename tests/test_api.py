@@ -1,17 +1,41 @@
+import gzip
+import json
+import time
 from copy import deepcopy
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
+import msgpack
 import pytest
 from data_organizer.db.connection import DatabaseConnection
 from dynaconf import LazySettings
+from fastapi.testclient import TestClient
+from psycopg2.errors import (
+    CheckViolation,
+    NotNullViolation,
+    NumericValueOutOfRange,
+    UniqueViolation,
+)
 from sqlalchemy import text
 
 import iot_data_receiver
+from iot_data_receiver.decoding import (
+    COLUMNAR_CONTENT_TYPE,
+    JSON_CONTENT_TYPE,
+    encode_columnar,
+)
+from iot_data_receiver.endpoints import EndpointRegistry, Registration
+from iot_data_receiver.hashing import get_crypt_context, hash_token
+from iot_data_receiver.limits import RateLimiter
+from iot_data_receiver.metrics import Metrics
+from iot_data_receiver.model import EnvironmentInput
+from iot_data_receiver.partitions import get_partitions
+from iot_data_receiver.utils import generate_token, get_key_lookup
 
 
 def test_health(test_session, client):
     response = client.get("/health")
     assert response.status_code == 200
+    assert response.json() == {"message": "All components up and running"}
 
 
 def test_health_invalid_conn(mocker, client):
@@ -26,6 +50,168 @@ def test_health_invalid_conn(mocker, client):
     assert response.status_code == 503
 
 
+def test_live(client):
+    response = client.get("/live")
+    assert response.status_code == 200
+
+
+def test_ready(test_session):
+    with TestClient(iot_data_receiver.main.app) as client:
+        iot_data_receiver.main.health_checker.run_checks()
+        response = client.get("/ready")
+
+    assert response.status_code == 200
+    assert response.json()["checks"]["tables"]["ok"]
+
+
+def test_ready_spool(test_session, mocker, tmp_path):
+    settings_: LazySettings = deepcopy(iot_data_receiver.main.config.settings)
+    settings_.ingest.spool.enabled = True
+    settings_.ingest.spool.directory = str(tmp_path / "spool")
+    mocker.patch.object(iot_data_receiver.main.config, "settings", settings_)
+
+    with TestClient(iot_data_receiver.main.app) as client:
+        iot_data_receiver.main.health_checker.run_checks()
+        response = client.get("/ready")
+
+    assert response.status_code == 200
+    assert response.json()["checks"]["spool"]["ok"]
+    assert response.json()["checks"]["spool"]["size"] == 0
+
+
+def test_ready_missing_tables(test_session):
+    _, db = test_session
+    with db.engine.connect() as connection:
+        connection.execute(text(f"DROP TABLE {db.schema}.endpoint_request_subsets;"))
+        connection.commit()
+
+    with TestClient(iot_data_receiver.main.app) as client:
+        iot_data_receiver.main.health_checker.run_checks()
+        response = client.get("/ready")
+
+    assert response.status_code == 503
+    assert response.json()["checks"]["tables"]["missing"] == [
+        "endpoint_request_subsets"
+    ]
+
+
+@pytest.mark.parametrize("overlap_hours", [1, 0])
+def test_rotated_key_overlap(test_session, client, overlap_hours):
+    key, db = test_session
+    token, hashed_token = generate_token(20)
+    with db.engine.connect() as connection:
+        # Like rotate_keys
+        connection.execute(
+            text(
+                """
+                UPDATE senders SET
+                    previous_hashed_key = hashed_key,
+                    previous_key_lookup = key_lookup,
+                    previous_key_expires = :expires,
+                    hashed_key = :hashed_key,
+                    key_lookup = :key_lookup
+                WHERE sender_name = 'test_name'
+                """
+            ),
+            {
+                "expires": datetime.utcnow() + timedelta(hours=overlap_hours),
+                "hashed_key": hashed_token,
+                "key_lookup": get_key_lookup(token),
+            },
+        )
+        connection.commit()
+    iot_data_receiver.main.api_key_cache.clear()
+
+    for api_key, valid in [(token, True), (key, overlap_hours > 0)]:
+        response = client.post(
+            "/register",
+            json={"endpoint": "environment", "fields": []},
+            headers={"access_token": api_key},
+        )
+
+        assert (response.status_code == 200) == valid
+
+
+def test_rehash_on_verify(mocker, test_session, client):
+    key, db = test_session
+    mocker.patch.object(
+        iot_data_receiver.main,
+        "pwd_context",
+        get_crypt_context("hmac_sha256", pepper="pepper"),
+    )
+
+    for _ in range(2):
+        iot_data_receiver.main.api_key_cache.clear()
+        response = client.post(
+            "/register",
+            json={"endpoint": "environment", "fields": []},
+            headers={"access_token": key},
+        )
+
+        assert response.status_code == 200
+
+    hashed_key = db.query(
+        "SELECT hashed_key FROM senders WHERE sender_name = 'test_name'"
+    )[0][0]
+
+    assert hashed_key == hash_token(key, scheme="hmac_sha256", pepper="pepper")
+
+
+def test_verify_disabled_scheme(mocker):
+    mocker.patch.object(
+        iot_data_receiver.main, "pwd_context", get_crypt_context("bcrypt")
+    )
+    hashed_key = hash_token("key", scheme="hmac_sha256", pepper="pepper")
+
+    assert not iot_data_receiver.main.verify_api_key("key", hashed_key, None, 1)
+
+
+def test_cache_coherence(test_session):
+    _, db = test_session
+    token, hashed_token = generate_token(20)
+
+    with TestClient(iot_data_receiver.main.app) as client:
+        listener = iot_data_receiver.main.cache_listener
+        for _ in range(50):
+            if listener.connected:
+                break
+            time.sleep(0.1)
+
+        response = client.get("/query/environment", headers={"access_token": token})
+
+        assert response.status_code == 403
+
+        # Added by another process, e.g. the create_sender cli tool
+        with db.engine.connect() as connection:
+            connection.execute(
+                text(
+                    f"""
+                    INSERT INTO {db.schema}.senders
+                    VALUES (DEFAULT, 'other_name', :hashed_key, :key_lookup);
+                    """
+                ),
+                {"hashed_key": hashed_token, "key_lookup": get_key_lookup(token)},
+            )
+            connection.commit()
+        for _ in range(50):
+            if listener.notifications:
+                break
+            time.sleep(0.1)
+
+        response = client.post(
+            "/register",
+            json={"endpoint": "environment", "fields": ["timestamp", "temperature"]},
+            headers={"access_token": token},
+        )
+
+    assert response.status_code == 200
+
+
+def test_ready_not_started(client):
+    response = client.get("/ready")
+    assert response.status_code == 503
+
+
 @pytest.mark.parametrize(
     "drop_tables",
     [
@@ -51,6 +237,21 @@ def test_register_invalid_key(test_session, client, header):
     assert response.status_code == 403
 
 
+def test_legacy_key_gets_migrated(test_session_legacy_key, client):
+    key, db = test_session_legacy_key
+    response = client.post(
+        "/register",
+        json={"endpoint": "environment", "fields": []},
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+
+    data = db.query("SELECT key_lookup FROM senders WHERE sender_name = 'test_name'")
+
+    assert data[0][0] == get_key_lookup(key)
+
+
 def test_register_invalid_endpoint(test_session, client):
     key, _ = test_session
     response = client.post(
@@ -139,3 +340,753 @@ def test_environment_minimal(test_environment_session_minimal, client):
     assert not data.empty
 
     assert (data.columns == ["timestamp", "temperature"]).all()
+
+
+def test_environment_after_register(test_session, client):
+    key, db = test_session
+
+    payload = {"timestamp": [datetime.now().isoformat()], "temperature": [1.1]}
+    response = client.post("/environment", json=payload, headers={"access_token": key})
+
+    assert response.status_code == 400
+
+    client.post(
+        "/register",
+        json={"endpoint": "environment", "fields": ["timestamp", "temperature"]},
+        headers={"access_token": key},
+    )
+    response = client.post("/environment", json=payload, headers={"access_token": key})
+
+    assert response.status_code == 200
+
+
+def test_environment_missing_registered_field(test_environment_session_full, client):
+    key, _ = test_environment_session_full
+
+    response = client.post(
+        "/environment",
+        json={"timestamp": [datetime.now().isoformat()], "temperature": [1.1]},
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 400
+
+
+def test_environment_copy(test_environment_session_minimal, client):
+    key, db = test_environment_session_minimal
+    iot_data_receiver.main.config.settings.ingest.copy_threshold = 2
+
+    time_stamps = [datetime(2022, 1, 1, 0, minute).isoformat() for minute in range(3)]
+    response = client.post(
+        "/environment",
+        json={"timestamp": time_stamps, "temperature": [1.1, 2.2, 3.3]},
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+
+    for time_stamp in time_stamps:
+        assert not get_data(db, "test_name_environment", time_stamp).empty
+
+
+def test_environment_aware_timestamp(test_environment_session_minimal, client):
+    key, db = test_environment_session_minimal
+    payload = {"timestamp": ["2022-06-15T00:30:00+02:00"], "temperature": [1.1]}
+
+    response = client.post("/environment", json=payload, headers={"access_token": key})
+
+    assert response.status_code == 200
+    assert not get_data(db, "test_name_environment", "2022-06-14T22:30:00").empty
+
+    # The same value is written with COPY, so it conflicts with the inserted row
+    iot_data_receiver.main.config.settings.ingest.copy_threshold = 1
+    response = client.post("/environment", json=payload, headers={"access_token": key})
+
+    assert response.status_code == 409
+
+
+def test_get_registered_columns_aware_timestamp():
+    data = EnvironmentInput(
+        timestamp=[datetime(2022, 6, 15, 0, 30, tzinfo=timezone(timedelta(hours=2)))],
+        temperature=[1.1],
+    )
+    registration = Registration("table", ["timestamp", "temperature"])
+
+    columns = iot_data_receiver.main.get_registered_columns(data, registration)
+
+    assert columns == [[datetime(2022, 6, 14, 22, 30)], [1.1]]
+
+
+def test_environment_conflict_error(test_environment_session_minimal, client):
+    key, _ = test_environment_session_minimal
+
+    payload = {"timestamp": [datetime.now().isoformat()], "temperature": [1.1]}
+    response = client.post("/environment", json=payload, headers={"access_token": key})
+
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 1
+
+    response = client.post("/environment", json=payload, headers={"access_token": key})
+
+    assert response.status_code == 409
+
+
+def test_environment_partitioned(test_session, client):
+    key, db = test_session
+    response = client.post(
+        "/register",
+        json={
+            "endpoint": "environment",
+            "fields": ["timestamp", "temperature"],
+            "partitioning": "month",
+            "retention_days": 365,
+        },
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+    assert get_partitions(db, "test_name_environment")
+
+    time_stamps = ["2022-01-31T23:00:00", "2022-03-01T01:00:00"]
+    response = client.post(
+        "/environment",
+        json={"timestamp": time_stamps, "temperature": [1.1, 2.2]},
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 2
+
+    partitions = get_partitions(db, "test_name_environment")
+    for month in [1, 2, 3]:
+        assert datetime(2022, month, 1) in partitions
+
+
+def test_environment_partitioned_aware_timestamp(test_session, client):
+    key, db = test_session
+    client.post(
+        "/register",
+        json={
+            "endpoint": "environment",
+            "fields": ["timestamp", "temperature"],
+            "partitioning": "day",
+        },
+        headers={"access_token": key},
+    )
+
+    response = client.post(
+        "/environment",
+        json={"timestamp": ["2022-06-15T00:30:00+02:00"], "temperature": [1.1]},
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 1
+
+    partitions = get_partitions(db, "test_name_environment")
+    assert datetime(2022, 6, 14) in partitions
+    assert datetime(2022, 6, 15) not in partitions
+    assert not get_data(db, partitions[datetime(2022, 6, 14)], "2022-06-14T22:30").empty
+
+
+def test_environment_partition_dropped_elsewhere(test_session, client):
+    key, db = test_session
+    client.post(
+        "/register",
+        json={
+            "endpoint": "environment",
+            "fields": ["timestamp", "temperature"],
+            "partitioning": "month",
+        },
+        headers={"access_token": key},
+    )
+    client.post(
+        "/environment",
+        json={"timestamp": ["2022-01-31T23:00:00"], "temperature": [1.1]},
+        headers={"access_token": key},
+    )
+    # Dropped by another process, so the partition is still known to this one
+    partition = get_partitions(db, "test_name_environment")[datetime(2022, 1, 1)]
+    with db.engine.connect() as connection:
+        connection.execute(text(f'DROP TABLE "{partition}"'))
+        connection.commit()
+
+    response = client.post(
+        "/environment",
+        json={"timestamp": ["2022-01-31T22:00:00"], "temperature": [1.1]},
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+    assert datetime(2022, 1, 1) in get_partitions(db, "test_name_environment")
+
+
+def test_ingest_defined_endpoint(mocker, test_session, client):
+    key, db = test_session
+    registry = EndpointRegistry.load(
+        {
+            "soil": {
+                "timestamp": {"ctype": "TIMESTAMP", "is_primary": True},
+                "moisture": {"ctype": "FLOAT"},
+                "battery": {"ctype": "INT", "is_nullable": True},
+            }
+        },
+        use_entry_points=False,
+    )
+    mocker.patch.object(iot_data_receiver.main, "endpoint_registry", registry)
+
+    response = client.post(
+        "/register",
+        json={"endpoint": "soil", "fields": []},
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+
+    response = client.post(
+        "/ingest/soil",
+        json={
+            "timestamp": ["2022-01-01T00:00:00", "2022-01-01T00:01:00"],
+            "moisture": [0.3, 0.4],
+            "battery": [98, 97],
+        },
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 2
+    assert db.query_to_df("SELECT * FROM test_name_soil")["battery"].tolist() == [
+        98,
+        97,
+    ]
+
+    response = client.post("/ingest/unknown", json={}, headers={"access_token": key})
+
+    assert response.status_code == 404
+
+
+@pytest.mark.parametrize(
+    ("content_type", "encode", "exp_status_code"),
+    [
+        (JSON_CONTENT_TYPE, lambda columns: json.dumps(columns).encode(), 422),
+        (
+            COLUMNAR_CONTENT_TYPE,
+            lambda columns: encode_columnar(
+                columns, {"timestamp": "q", "moisture": "d", "battery": "q"}
+            ),
+            400,
+        ),
+    ],
+)
+def test_ingest_defined_endpoint_out_of_range(
+    mocker, test_session, client, content_type, encode, exp_status_code
+):
+    key, db = test_session
+    registry = EndpointRegistry.load(
+        {
+            "soil": {
+                "timestamp": {"ctype": "TIMESTAMP", "is_primary": True},
+                "moisture": {"ctype": "FLOAT"},
+                "battery": {"ctype": "SMALLINT"},
+            }
+        },
+        use_entry_points=False,
+    )
+    mocker.patch.object(iot_data_receiver.main, "endpoint_registry", registry)
+    client.post(
+        "/register",
+        json={"endpoint": "soil", "fields": []},
+        headers={"access_token": key},
+    )
+
+    response = client.post(
+        "/ingest/soil",
+        data=encode(
+            {"timestamp": [0], "moisture": [0.3], "battery": [2**15]}
+            if content_type == COLUMNAR_CONTENT_TYPE
+            else {
+                "timestamp": ["2022-01-01T00:00:00"],
+                "moisture": [0.3],
+                "battery": [2**15],
+            }
+        ),
+        headers={"access_token": key, "Content-Type": content_type},
+    )
+
+    assert response.status_code == exp_status_code
+
+
+def test_query_defined_endpoint_int_column(mocker, test_session, client):
+    key, db = test_session
+    registry = EndpointRegistry.load(
+        {
+            "soil": {
+                "timestamp": {"ctype": "TIMESTAMP", "is_primary": True},
+                "battery": {"ctype": "INT"},
+            }
+        },
+        use_entry_points=False,
+    )
+    mocker.patch.object(iot_data_receiver.main, "endpoint_registry", registry)
+    client.post(
+        "/register",
+        json={"endpoint": "soil", "fields": []},
+        headers={"access_token": key},
+    )
+    client.post(
+        "/ingest/soil",
+        json={
+            "timestamp": ["2022-01-01T00:00:00", "2022-01-01T00:01:00"],
+            "battery": [98, 97],
+        },
+        headers={"access_token": key},
+    )
+
+    response = client.get(
+        "/query/soil",
+        params={
+            "start": "2022-01-01T00:00:00",
+            "end": "2022-01-02T00:00:00",
+            "bucket": 3600,
+            "aggregation": "mean",
+        },
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["rows"] == [["2022-01-01T00:00:00", 97.5]]
+
+
+def test_ingest_environment(test_environment_session_minimal, client):
+    key, _ = test_environment_session_minimal
+
+    response = client.post(
+        "/ingest/environment",
+        json={"timestamp": [datetime(2022, 1, 1).isoformat()], "temperature": [1.1]},
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["message"] == "Received environment data"
+
+
+def test_rate_limit(mocker, test_environment_session_minimal, client):
+    key, _ = test_environment_session_minimal
+    mocker.patch.object(
+        iot_data_receiver.main,
+        "rate_limiter",
+        RateLimiter(rate=0.01, burst=1, endpoints={}, senders={}, maxsize=10),
+    )
+    data = {"timestamp": [datetime(2022, 1, 1).isoformat()], "temperature": [1.1]}
+
+    response = client.post("/environment", json=data, headers={"access_token": key})
+
+    assert response.status_code == 200
+
+    response = client.post("/environment", json=data, headers={"access_token": key})
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+
+def test_query_rollups(test_session, client):
+    key, db = test_session
+    response = client.post(
+        "/register",
+        json={
+            "endpoint": "environment",
+            "fields": ["timestamp", "temperature"],
+            "rollups": [60, 3600],
+        },
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+
+    time_stamps = [
+        datetime(2022, 1, 1, hour, 0, second).isoformat()
+        for hour in range(2)
+        for second in [0, 30]
+    ]
+    client.post(
+        "/environment",
+        json={"timestamp": time_stamps, "temperature": [1.0, 2.0, 3.0, 5.0]},
+        headers={"access_token": key},
+    )
+
+    rollup = db.query_to_df("SELECT * FROM test_name_environment_rollup_3600")
+
+    assert rollup["count"].tolist() == [2, 2]
+    assert rollup["temperature_sum"].tolist() == [3.0, 8.0]
+
+    params = {
+        "start": "2022-01-01T00:00:00",
+        "end": "2022-01-02T00:00:00",
+        "bucket": 7200,
+        "aggregation": "mean",
+    }
+    for use_rollups in [True, False]:
+        response = client.get(
+            "/query/environment",
+            params={**params, "use_rollups": use_rollups},
+            headers={"access_token": key},
+        )
+
+        assert response.status_code == 200
+        assert response.json()["rows"] == [["2022-01-01T00:00:00", 2.75]]
+
+
+def test_query(test_environment_session_minimal, client):
+    key, _ = test_environment_session_minimal
+    time_stamps = [datetime(2022, 1, 1, 0, minute).isoformat() for minute in range(4)]
+    client.post(
+        "/environment",
+        json={"timestamp": time_stamps, "temperature": [1.0, 2.0, 3.0, 4.0]},
+        headers={"access_token": key},
+    )
+
+    params = {"start": "2022-01-01T00:00:00", "end": "2022-01-02T00:00:00", "limit": 3}
+    response = client.get(
+        "/query/environment", params=params, headers={"access_token": key}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["rows"] == [
+        [time_stamps[0], 1.0],
+        [time_stamps[1], 2.0],
+        [time_stamps[2], 3.0],
+    ]
+
+    response = client.get(
+        "/query/environment",
+        params={**params, "cursor": response.json()["next_cursor"]},
+        headers={"access_token": key},
+    )
+
+    assert response.json()["rows"] == [[time_stamps[3], 4.0]]
+    assert response.json()["next_cursor"] is None
+
+
+def test_query_aware_bounds(test_environment_session_minimal, client):
+    key, _ = test_environment_session_minimal
+    client.post(
+        "/environment",
+        json={"timestamp": ["2022-06-15T00:30:00+02:00"], "temperature": [1.0]},
+        headers={"access_token": key},
+    )
+
+    response = client.get(
+        "/query/environment",
+        params={
+            "start": "2022-06-15T00:00:00+02:00",
+            "end": "2022-06-15T01:00:00+02:00",
+        },
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["rows"] == [["2022-06-14T22:30:00", 1.0]]
+
+
+@pytest.mark.parametrize(
+    ("aggregation", "exp_values"),
+    [("mean", [1.5, 3.5]), ("max", [2.0, 4.0]), ("last", [2.0, 4.0])],
+)
+def test_query_bucket(
+    test_environment_session_minimal, client, aggregation, exp_values
+):
+    key, _ = test_environment_session_minimal
+    time_stamps = [datetime(2022, 1, 1, 0, minute).isoformat() for minute in range(4)]
+    client.post(
+        "/environment",
+        json={"timestamp": time_stamps, "temperature": [1.0, 2.0, 3.0, 4.0]},
+        headers={"access_token": key},
+    )
+
+    response = client.get(
+        "/query/environment",
+        params={
+            "start": "2022-01-01T00:00:00",
+            "end": "2022-01-02T00:00:00",
+            "bucket": 120,
+            "aggregation": aggregation,
+            "fields": ["temperature"],
+        },
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+    assert [value for _, value in response.json()["rows"]] == exp_values
+
+
+def test_query_unregistered_field(test_environment_session_minimal, client):
+    key, _ = test_environment_session_minimal
+
+    response = client.get(
+        "/query/environment",
+        params={
+            "start": "2022-01-01T00:00:00",
+            "end": "2022-01-02T00:00:00",
+            "fields": ["pressure"],
+        },
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    ("on_conflict", "exp_counts"),
+    [
+        ("nothing", {"inserted": 1, "updated": 0, "skipped": 1}),
+        ("update", {"inserted": 1, "updated": 1, "skipped": 0}),
+    ],
+)
+def test_environment_conflict_policy(test_session, client, on_conflict, exp_counts):
+    key, db = test_session
+    client.post(
+        "/register",
+        json={
+            "endpoint": "environment",
+            "fields": ["timestamp", "temperature"],
+            "on_conflict": on_conflict,
+        },
+        headers={"access_token": key},
+    )
+
+    time_stamps = [datetime(2022, 1, 1, 0, minute).isoformat() for minute in range(2)]
+    client.post(
+        "/environment",
+        json={"timestamp": time_stamps[:1], "temperature": [1.1]},
+        headers={"access_token": key},
+    )
+    response = client.post(
+        "/environment",
+        json={"timestamp": time_stamps, "temperature": [2.2, 2.2]},
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+    assert {name: response.json()[name] for name in exp_counts} == exp_counts
+
+
+def test_environment_upsert_duplicates(test_session, client):
+    key, db = test_session
+    client.post(
+        "/register",
+        json={
+            "endpoint": "environment",
+            "fields": ["timestamp", "temperature"],
+            "on_conflict": "update",
+        },
+        headers={"access_token": key},
+    )
+
+    time_stamp = datetime(2022, 1, 1).isoformat()
+    response = client.post(
+        "/environment",
+        json={"timestamp": [time_stamp, time_stamp], "temperature": [1.1, 2.2]},
+        headers={"access_token": key},
+    )
+
+    assert response.status_code == 200
+    assert response.json()["inserted"] == 1
+    assert response.json()["skipped"] == 1
+    data = db.query_to_df("SELECT * FROM test_name_environment")
+    assert data["temperature"].tolist() == [2.2]
+
+
+@pytest.mark.parametrize(
+    ("error", "exp_status_code"),
+    [
+        (UniqueViolation("duplicate key"), 409),
+        (NotNullViolation("null value"), 400),
+        (CheckViolation("no partition of relation found for row"), 500),
+        (CheckViolation("new row violates check constraint"), 400),
+    ],
+)
+def test_get_integrity_error(error, exp_status_code):
+    http_exception = iot_data_receiver.main.get_integrity_error(error)
+
+    assert http_exception.status_code == exp_status_code
+
+
+def test_get_data_error():
+    http_exception = iot_data_receiver.main.get_data_error(
+        NumericValueOutOfRange("smallint out of range")
+    )
+
+    assert http_exception.status_code == 400
+    assert "smallint out of range" in http_exception.detail
+
+
+@pytest.mark.parametrize(
+    ("content_type", "encode"),
+    [
+        (
+            "application/msgpack",
+            lambda columns: msgpack.packb(columns, datetime=True),
+        ),
+        (
+            "application/x-iot-columnar",
+            lambda columns: encode_columnar(
+                columns, {"timestamp": "q", "temperature": "d"}
+            ),
+        ),
+    ],
+)
+def test_environment_binary(
+    test_environment_session_minimal, client, content_type, encode
+):
+    key, db = test_environment_session_minimal
+
+    time_stamp = datetime(2022, 1, 1, 12, 0)
+    body = gzip.compress(
+        encode(
+            {
+                "timestamp": [time_stamp.replace(tzinfo=timezone.utc)],
+                "temperature": [1.1],
+            }
+        )
+    )
+    response = client.post(
+        "/environment",
+        data=body,
+        headers={
+            "access_token": key,
+            "Content-Type": content_type,
+            "Content-Encoding": "gzip",
+        },
+    )
+
+    assert response.status_code == 200
+
+    data = get_data(db, "test_name_environment", time_stamp.isoformat())
+
+    assert not data.empty
+
+
+def test_environment_unsupported_content_type(test_environment_session_minimal, client):
+    key, _ = test_environment_session_minimal
+
+    response = client.post(
+        "/environment",
+        data=b"data",
+        headers={"access_token": key, "Content-Type": "text/plain"},
+    )
+
+    assert response.status_code == 415
+
+
+def test_environment_stream(test_environment_session_minimal, client):
+    key, db = test_environment_session_minimal
+
+    time_stamps = [datetime(2022, 1, 1, 0, minute).isoformat() for minute in range(3)]
+    chunks = [
+        {"timestamp": time_stamps[:2], "temperature": [1.1, 2.2]},
+        {"timestamp": time_stamps[2:], "temperature": [3.3]},
+        {"timestamp": time_stamps[2:], "temperature": ["bogus"]},
+    ]
+    response = client.post(
+        "/environment/stream",
+        data="\n".join(json.dumps(chunk) for chunk in chunks),
+        headers={"access_token": key, "Content-Type": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 422
+    assert response.json()["committed_chunks"] == 2
+    assert response.json()["inserted"] == 3
+
+    for time_stamp in time_stamps:
+        assert not get_data(db, "test_name_environment", time_stamp).empty
+
+
+def test_environment_stream_invalid_utf8(test_environment_session_minimal, client):
+    key, db = test_environment_session_minimal
+
+    chunk = {"timestamp": [datetime(2022, 1, 1).isoformat()], "temperature": [1.1]}
+    response = client.post(
+        "/environment/stream",
+        data=json.dumps(chunk).encode() + b'\n{"timestamp": "\xff"}\n',
+        headers={"access_token": key, "Content-Type": "application/x-ndjson"},
+    )
+
+    assert response.status_code == 422
+    assert response.json()["committed_chunks"] == 1
+
+
+def test_gateway(test_environment_session_minimal, client):
+    key, db = test_environment_session_minimal
+
+    with db.engine.connect() as connection:
+        connection.execute(text("INSERT INTO gateway_senders VALUES (1, 1)"))
+        connection.commit()
+
+    time_stamps = [datetime(2022, 1, 1, 0, minute).isoformat() for minute in range(2)]
+    items = [
+        {
+            "sender": "test_name",
+            "data": {"timestamp": [time_stamp], "temperature": [1.1]},
+        }
+        for time_stamp in time_stamps
+    ]
+    response = client.post(
+        "/gateway", json={"items": items}, headers={"access_token": key}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["results"][0]["inserted"] == 2
+
+    for time_stamp in time_stamps:
+        assert not get_data(db, "test_name_environment", time_stamp).empty
+
+
+def test_gateway_forbidden_sender(test_environment_session_minimal, client):
+    key, db = test_environment_session_minimal
+
+    with db.engine.connect() as connection:
+        connection.execute(text("INSERT INTO gateway_senders VALUES (1, 1)"))
+        connection.commit()
+
+    time_stamp = datetime(2022, 1, 1).isoformat()
+    items = [
+        {
+            "sender": sender,
+            "data": {"timestamp": [time_stamp], "temperature": [1.1]},
+        }
+        for sender in ["test_name", "other_sender"]
+    ]
+    response = client.post(
+        "/gateway", json={"items": items}, headers={"access_token": key}
+    )
+
+    assert response.status_code == 207
+    assert [result["status_code"] for result in response.json()["results"]] == [
+        200,
+        403,
+    ]
+
+
+def test_metrics_disabled(client):
+    response = client.get("/metrics")
+
+    assert response.status_code == 404
+
+
+def test_metrics(mocker, test_environment_session_minimal, client):
+    key, _ = test_environment_session_minimal
+    mocker.patch.object(iot_data_receiver.main, "metrics", Metrics(enabled=True))
+
+    client.post(
+        "/environment",
+        json={"timestamp": [datetime.now().isoformat()], "temperature": [1.1]},
+        headers={"access_token": key},
+    )
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    for stage in ["verify_key", "sender_lookup", "registration_lookup", "write"]:
+        assert f'stage="{stage}"' in response.text
+    assert 'iot_receiver_rows_total{endpoint="environment",sender="test_name"} 1.0' in (
+        response.text
+    )
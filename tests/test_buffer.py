@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+from iot_data_receiver.buffer import BufferFull, WriteBuffer
+from iot_data_receiver.endpoints import Registration
+from iot_data_receiver.metrics import current_endpoint
+
+
+class FakeWriter:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.writes = []
+
+    def __call__(self, registration, columns):
+        if self.fail_on is not None and self.fail_on in columns[0]:
+            raise ValueError("Bad data")
+        self.writes.append((registration.table_name, columns))
+        return {"inserted": len(columns[0]), "updated": 0, "skipped": 0}
+
+
+@pytest.fixture
+def registration():
+    return Registration("test_table", ["timestamp", "temperature"])
+
+
+def test_write_buffer_coalesces_batches(registration):
+    writer = FakeWriter()
+    write_buffer = WriteBuffer(writer, max_rows=100, flush_rows=4, flush_interval=60)
+
+    futures = [write_buffer.add(registration, [[i, i + 1], [1.0, 2.0]]) for i in [0, 2]]
+    for future in futures:
+        assert future.result(timeout=5)["inserted"] == 4
+
+    write_buffer.close()
+
+    assert writer.writes == [("test_table", [[0, 1, 2, 3], [1.0, 2.0, 1.0, 2.0]])]
+    assert write_buffer.stats()["flushes"] == 1
+
+
+def test_write_buffer_flush_interval(registration):
+    writer = FakeWriter()
+    write_buffer = WriteBuffer(
+        writer, max_rows=100, flush_rows=100, flush_interval=0.01
+    )
+
+    future = write_buffer.add(registration, [[0], [1.0]])
+
+    assert future.result(timeout=5)["inserted"] == 1
+    write_buffer.close()
+
+
+def test_write_buffer_context(registration):
+    endpoints = []
+
+    def write(registration, columns):
+        endpoints.append(current_endpoint.get())
+        return {"inserted": len(columns[0]), "updated": 0, "skipped": 0}
+
+    write_buffer = WriteBuffer(write, max_rows=100, flush_rows=100, flush_interval=60)
+    token = current_endpoint.set("/environment")
+    try:
+        write_buffer.add(registration, [[0], [1.0]])
+    finally:
+        current_endpoint.reset(token)
+    write_buffer.close()
+
+    assert endpoints == ["/environment"]
+
+
+def test_write_buffer_close_drains(registration):
+    writer = FakeWriter()
+    write_buffer = WriteBuffer(writer, max_rows=100, flush_rows=100, flush_interval=60)
+
+    future = write_buffer.add(registration, [[0], [1.0]])
+    write_buffer.close()
+
+    assert future.done()
+    assert writer.writes == [("test_table", [[0], [1.0]])]
+
+
+def test_write_buffer_full(registration):
+    event = threading.Event()
+
+    def blocking_writer(registration, columns):
+        event.wait(5)
+        return {}
+
+    write_buffer = WriteBuffer(
+        blocking_writer, max_rows=2, flush_rows=100, flush_interval=60
+    )
+    write_buffer.add(registration, [[0, 1], [1.0, 2.0]])
+
+    with pytest.raises(BufferFull):
+        write_buffer.add(registration, [[2], [3.0]])
+
+    event.set()
+    write_buffer.close()
+
+
+def test_write_buffer_failing_batch(registration):
+    writer = FakeWriter(fail_on=2)
+    write_buffer = WriteBuffer(writer, max_rows=100, flush_rows=100, flush_interval=60)
+
+    good_future = write_buffer.add(registration, [[0, 1], [1.0, 2.0]])
+    bad_future = write_buffer.add(registration, [[2], [3.0]])
+    write_buffer.close()
+
+    assert good_future.result()["inserted"] == 2
+    with pytest.raises(ValueError, match="Bad data"):
+        bad_future.result()
+    assert write_buffer.stats()["failed_flushes"] == 1
@@ -0,0 +1,148 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from iot_data_receiver.cache import APIKeyCache, TTLCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expiry():
+    timer = FakeTimer()
+    cache = TTLCache(maxsize=10, ttl=5, timer=timer)
+    cache.set("a", 1)
+
+    assert cache.get("a") == 1
+    timer.now = 5
+    assert cache.get("a") is None
+    assert cache.stats() == {"size": 0, "hits": 1, "misses": 1}
+
+
+def test_ttl_cache_entry_ttl():
+    timer = FakeTimer()
+    cache = TTLCache(maxsize=10, ttl=5, timer=timer)
+    cache.set("a", 1, ttl=2)
+    cache.set("b", 2, ttl=10)
+
+    timer.now = 2
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    timer.now = 5
+    assert cache.get("b") is None
+
+
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+def test_ttl_cache_disabled():
+    cache = TTLCache(maxsize=0, ttl=60)
+    cache.set("a", 1)
+
+    assert cache.get("a") is None
+
+
+def test_ttl_cache_generation():
+    cache = TTLCache(maxsize=10, ttl=60)
+    generation = cache.generation
+    cache.pop("b")
+    cache.set("a", 1, generation=generation)
+
+    assert cache.get("a") is None
+
+    cache.set("a", 1, generation=cache.generation)
+
+    assert cache.get("a") == 1
+
+
+def get_api_key_cache(timer=None, negative_per_minute=2):
+    return APIKeyCache(
+        size=10,
+        ttl=60,
+        negative_size=10,
+        negative_ttl=10,
+        negative_per_minute=negative_per_minute,
+        timer=timer or FakeTimer(),
+    )
+
+
+def test_api_key_cache_invalidate_sender():
+    cache = get_api_key_cache()
+    cache.add("key_1", "sender_1", 1)
+    cache.add("key_2", "sender_2", 2)
+
+    assert cache.get("key_1") == ("sender_1", 1)
+    assert cache.invalidate_sender(1) == 1
+    assert cache.get("key_1") is None
+    assert cache.get("key_2") == ("sender_2", 2)
+
+
+def test_api_key_cache_stores_digest():
+    cache = get_api_key_cache()
+    cache.add("key_1", "sender_1", 1)
+
+    assert "key_1" not in cache.accepted._data
+
+
+def test_api_key_cache_negative_rate_limit():
+    timer = FakeTimer()
+    cache = get_api_key_cache(timer=timer, negative_per_minute=2)
+    for key in ["bad_1", "bad_2", "bad_3"]:
+        cache.reject(key)
+
+    assert cache.is_rejected("bad_1")
+    assert cache.is_rejected("bad_2")
+    assert not cache.is_rejected("bad_3")
+
+    timer.now = 60
+    cache.reject("bad_3")
+    assert cache.is_rejected("bad_3")
+
+
+def test_api_key_cache_negative_rate_limit_concurrent():
+    cache = APIKeyCache(
+        size=10,
+        ttl=60,
+        negative_size=1000,
+        negative_ttl=10,
+        negative_per_minute=10,
+        timer=FakeTimer(),
+    )
+    switch_interval = sys.getswitchinterval()
+    # Switch threads as often as possible to provoke races
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(cache.reject, [f"bad_{i}" for i in range(1000)]))
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert cache.stats()["rejected"]["size"] == 10
+
+
+def test_api_key_cache_generation():
+    cache = get_api_key_cache()
+    generation = cache.generation
+    cache.invalidate_sender(1)
+    cache.add("key_1", "sender_1", 1, generation=generation)
+
+    assert cache.get("key_1") is None
+
+    generation = cache.generation
+    cache.clear_rejected()
+    cache.reject("bad_1", generation)
+
+    assert not cache.is_rejected("bad_1")
@@ -1,6 +1,24 @@
+import csv
+import json
+import stat
+from datetime import datetime
+
+import pytest
 from click.testing import CliRunner
+from passlib.context import CryptContext
+from sqlalchemy import text
 
-from iot_data_receiver.cli_tools import create_sender
+from iot_data_receiver.cli_tools import (
+    add_gateway_senders,
+    backfill_rollups,
+    create_sender,
+    create_senders,
+    partition_table,
+    read_sender_names,
+    rotate_keys,
+)
+from iot_data_receiver.partitions import get_partitions
+from iot_data_receiver.utils import get_key_lookup
 
 
 def test_create_sender(test_session):
@@ -29,3 +47,265 @@ def test_create_sender(test_session):
     )
 
     assert len(data) == 1
+
+
+def test_add_gateway_senders(test_session):
+    _, db = test_session
+
+    runner = CliRunner()
+    options = ["--config_base", "config/", "--schema", "iot_receiver_test"]
+    runner.invoke(create_sender, ["cli_test_sender", *options])
+    result = runner.invoke(
+        add_gateway_senders, ["test_name", "cli_test_sender", *options]
+    )
+
+    assert result.exit_code == 0
+
+    data = db.query_to_df("SELECT * FROM gateway_senders")
+
+    assert len(data) == 1
+
+
+@pytest.mark.parametrize(
+    ("file_name", "content"),
+    [
+        ("senders.csv", "name,location\nsensor_1,roof\nsensor_2,cellar\n"),
+        ("senders.csv", "sensor_1\nsensor_2\n"),
+        ("senders.json", json.dumps(["sensor_1", "sensor_2"])),
+        ("senders.json", json.dumps([{"name": "sensor_1"}, {"name": "sensor_2"}])),
+    ],
+)
+def test_read_sender_names(tmp_path, file_name, content):
+    path = tmp_path / file_name
+    path.write_text(content)
+
+    assert read_sender_names(path) == ["sensor_1", "sensor_2"]
+
+
+@pytest.mark.parametrize(
+    "names", [[], ["sensor_1", "sensor_1"], ["sensor_1", ""], ["x" * 51], [1]]
+)
+def test_read_sender_names_invalid(tmp_path, names):
+    path = tmp_path / "senders.json"
+    path.write_text(json.dumps(names))
+
+    with pytest.raises(ValueError):
+        read_sender_names(path)
+
+
+def read_keys(path):
+    with path.open(newline="") as f:
+        return {row["name"]: row["key"] for row in csv.DictReader(f)}
+
+
+def test_create_senders(test_session, tmp_path):
+    _, db = test_session
+    names = tmp_path / "senders.json"
+    names.write_text(json.dumps(["bulk_sender_1", "bulk_sender_2"]))
+    output = tmp_path / "keys.csv"
+
+    runner = CliRunner()
+    result = runner.invoke(
+        create_senders,
+        [
+            str(names),
+            "--output",
+            str(output),
+            "--register",
+            "environment",
+            "--processes",
+            "2",
+            "--config_base",
+            "config/",
+            "--schema",
+            "iot_receiver_test",
+        ],
+    )
+
+    assert result.exit_code == 0
+    assert stat.S_IMODE(output.stat().st_mode) == 0o600
+
+    keys = read_keys(output)
+    senders = dict(
+        (name, (hashed_key, key_lookup))
+        for name, hashed_key, key_lookup in db.query(
+            "SELECT sender_name, hashed_key, key_lookup FROM senders "
+            "WHERE sender_name LIKE 'bulk_sender_%'"
+        )
+    )
+
+    assert sorted(keys) == sorted(senders) == ["bulk_sender_1", "bulk_sender_2"]
+    for name, (hashed_key, key_lookup) in senders.items():
+        assert key_lookup == get_key_lookup(keys[name])
+        assert CryptContext(schemes=["bcrypt"]).verify(keys[name], hashed_key)
+    assert len(db.query_to_df("SELECT * FROM bulk_sender_1_environment")) == 0
+    assert len(db.query_to_df("SELECT * FROM endpoint_request_subsets")) == 2
+
+    # Nothing is created if one of the senders exists
+    result = runner.invoke(
+        create_senders,
+        [
+            str(names),
+            "--output",
+            str(tmp_path / "more_keys.csv"),
+            "--config_base",
+            "config/",
+            "--schema",
+            "iot_receiver_test",
+        ],
+    )
+
+    assert "already exist" in result.output
+    assert not (tmp_path / "more_keys.csv").exists()
+
+
+def test_rotate_keys(test_session, tmp_path):
+    key, db = test_session
+    names = tmp_path / "senders.csv"
+    names.write_text("test_name\n")
+    output = tmp_path / "keys.csv"
+
+    runner = CliRunner()
+    result = runner.invoke(
+        rotate_keys,
+        [
+            str(names),
+            "--output",
+            str(output),
+            "--overlap_hours",
+            "2",
+            "--processes",
+            "1",
+            "--config_base",
+            "config/",
+            "--schema",
+            "iot_receiver_test",
+        ],
+    )
+
+    assert result.exit_code == 0
+
+    new_key = read_keys(output)["test_name"]
+    key_lookup, previous_key_lookup, previous_key_expires = db.query(
+        "SELECT key_lookup, previous_key_lookup, previous_key_expires FROM senders "
+        "WHERE sender_name = 'test_name'"
+    )[0]
+
+    assert key_lookup == get_key_lookup(new_key)
+    assert previous_key_lookup == get_key_lookup(key)
+    assert previous_key_expires > datetime.utcnow()
+
+
+def test_rotate_keys_legacy_key(test_session_legacy_key, tmp_path):
+    key, db = test_session_legacy_key
+    names = tmp_path / "senders.csv"
+    names.write_text("test_name\n")
+    output = tmp_path / "keys.csv"
+
+    args = [
+        str(names),
+        "--output",
+        str(output),
+        "--processes",
+        "1",
+        "--config_base",
+        "config/",
+        "--schema",
+        "iot_receiver_test",
+    ]
+    runner = CliRunner()
+    result = runner.invoke(rotate_keys, args + ["--overlap_hours", "2"])
+
+    assert result.exit_code == 0
+    assert "have no key lookup" in result.output
+    assert not output.exists()
+
+    result = runner.invoke(rotate_keys, args + ["--overlap_hours", "0"])
+
+    assert result.exit_code == 0
+    new_key = read_keys(output)["test_name"]
+    key_lookup, previous_key_lookup = db.query(
+        "SELECT key_lookup, previous_key_lookup FROM senders "
+        "WHERE sender_name = 'test_name'"
+    )[0]
+    assert key_lookup == get_key_lookup(new_key)
+    assert previous_key_lookup is None
+
+
+def test_partition_table(test_environment_session_minimal):
+    _, db = test_environment_session_minimal
+    with db.engine.connect() as connection:
+        connection.execute(
+            text(
+                """
+                INSERT INTO test_name_environment
+                VALUES ('2022-01-01 12:00', 1.1), ('2022-03-01 12:00', 2.2)
+                """
+            )
+        )
+        connection.commit()
+
+    runner = CliRunner()
+    result = runner.invoke(
+        partition_table,
+        [
+            "test_name_environment",
+            "--interval",
+            "month",
+            "--config_base",
+            "config/",
+            "--schema",
+            "iot_receiver_test",
+        ],
+    )
+
+    assert result.exit_code == 0
+
+    partitions = get_partitions(db, "test_name_environment")
+
+    assert datetime(2022, 2, 1) in partitions
+    assert len(db.query_to_df("SELECT * FROM test_name_environment")) == 2
+    assert len(db.query_to_df(f"SELECT * FROM {partitions[datetime(2022, 3, 1)]}")) == 1
+
+
+def test_backfill_rollups(test_environment_session_minimal):
+    _, db = test_environment_session_minimal
+    with db.engine.connect() as connection:
+        connection.execute(
+            text(
+                """
+                INSERT INTO test_name_environment
+                VALUES ('2022-01-01 12:00', 1.0), ('2022-01-03 12:30', 2.0),
+                       ('2022-01-03 12:45', 4.0)
+                """
+            )
+        )
+        connection.commit()
+
+    runner = CliRunner()
+    result = runner.invoke(
+        backfill_rollups,
+        [
+            "test_name_environment",
+            "--resolution",
+            "3600",
+            "--no_wait",
+            "--config_base",
+            "config/",
+            "--schema",
+            "iot_receiver_test",
+        ],
+    )
+
+    assert result.exit_code == 0
+
+    rollup = db.query_to_df(
+        "SELECT * FROM test_name_environment_rollup_3600 ORDER BY bucket"
+    )
+
+    assert rollup["count"].tolist() == [1, 2]
+    assert rollup["temperature_max"].tolist() == [1.0, 4.0]
+    assert db.query(
+        "SELECT subset FROM endpoint_request_subsets "
+        "WHERE \"table\" = 'test_name_environment'"
+    )[0][0]["rollups"] == [3600]
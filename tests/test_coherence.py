@@ -0,0 +1,84 @@
+import json
+import threading
+
+from iot_data_receiver.coherence import CacheListener
+
+
+def get_listener(changes, resets):
+    connect_called = threading.Event()
+
+    def connect():
+        connect_called.set()
+        raise OSError("No database")
+
+    listener = CacheListener(
+        connect,
+        schema="iot_receiver",
+        on_change=lambda table, operation, keys: changes.append(
+            (table, operation, keys)
+        ),
+        on_reset=resets.append,
+        poll_interval=60,
+    )
+    connect_called.wait(timeout=5)
+    return listener
+
+
+def test_cache_listener_notification():
+    changes, resets = [], []
+    listener = get_listener(changes, resets)
+
+    listener.handle_notification(
+        json.dumps(
+            {
+                "schema": "iot_receiver",
+                "table": "endpoint_request_subsets",
+                "operation": "INSERT",
+                "version": 3,
+                "keys": {"id": 1, "endpoint": "environment"},
+            }
+        )
+    )
+    listener.handle_notification(
+        json.dumps(
+            {
+                "schema": "other",
+                "table": "senders",
+                "operation": "UPDATE",
+                "version": 1,
+                "keys": {"id": 1},
+            }
+        )
+    )
+    listener.handle_notification("bogus")
+    listener.close()
+
+    assert changes == [
+        ("endpoint_request_subsets", "INSERT", {"id": 1, "endpoint": "environment"})
+    ]
+    assert listener.stats() == {"connected": False, "notifications": 1, "resets": 0}
+
+
+def test_cache_listener_missed_changes():
+    changes, resets = [], []
+    listener = get_listener(changes, resets)
+    listener.close()
+
+    assert listener.apply_versions({"senders": 1, "gateway_senders": 5}) == []
+
+    listener.handle_notification(
+        json.dumps(
+            {
+                "schema": "iot_receiver",
+                "table": "senders",
+                "operation": "DELETE",
+                "version": 2,
+                "keys": {},
+            }
+        )
+    )
+
+    assert listener.apply_versions({"senders": 2, "gateway_senders": 5}) == []
+    assert listener.apply_versions({"senders": 4, "gateway_senders": 5}) == ["senders"]
+    assert resets == [["senders"]]
+    assert listener.apply_versions({"senders": 4, "gateway_senders": 5}) == []
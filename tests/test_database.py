@@ -0,0 +1,68 @@
+from datetime import datetime
+
+import pytest
+from dynaconf import Dynaconf
+
+from iot_data_receiver.database import (
+    CopyReader,
+    deduplicate_columns,
+    format_copy_value,
+    get_connection_settings,
+    get_pool_settings,
+)
+from iot_data_receiver.endpoints import Registration
+from iot_data_receiver.model import ConflictPolicy
+
+
+def test_split_db_settings():
+    settings_ = Dynaconf()
+    settings_.set(
+        "db",
+        {"database": "Development", "schema": "iot_receiver", "pool_size": 3},
+    )
+
+    assert get_connection_settings(settings_.db) == {
+        "database": "Development",
+        "schema": "iot_receiver",
+    }
+    assert get_pool_settings(settings_.db) == {"pool_size": 3}
+
+
+@pytest.mark.parametrize(
+    ("value", "exp_value"),
+    [
+        (None, "\\N"),
+        (1.5, "1.5"),
+        (datetime(2022, 1, 1, 12), "2022-01-01T12:00:00"),
+        ("a\tb\\c", "a\\tb\\\\c"),
+    ],
+)
+def test_format_copy_value(value, exp_value):
+    assert format_copy_value(value) == exp_value
+
+
+@pytest.mark.parametrize("size", [-1, 1, 5, 100])
+def test_copy_reader(size):
+    reader = CopyReader(zip([1, 2, 3], [1.5, None, 3.5]))
+
+    data = ""
+    while True:
+        chunk = reader.read(size)
+        if not chunk:
+            break
+        data += chunk
+
+    assert data == "1\t1.5\n2\t\\N\n3\t3.5\n"
+
+
+def test_deduplicate_columns():
+    registration = Registration(
+        "test_table",
+        ["timestamp", "temperature"],
+        primary_fields=["timestamp"],
+        on_conflict=ConflictPolicy.UPDATE,
+    )
+    columns = [[1, 2, 1, 3], [1.0, 2.0, 3.0, 4.0]]
+
+    assert registration.upserts
+    assert deduplicate_columns(registration, columns) == [[2, 1, 3], [2.0, 3.0, 4.0]]
@@ -0,0 +1,178 @@
+import asyncio
+import gzip
+from datetime import datetime, timezone
+
+import msgpack
+import pytest
+import zstandard
+
+from iot_data_receiver.decoding import (
+    COLUMNAR_HEADER,
+    COLUMNAR_MAGIC,
+    COLUMNAR_VERSION,
+    DecodeError,
+    UnsupportedEncoding,
+    decode_body,
+    decode_columnar,
+    decompress,
+    encode_columnar,
+    get_content_type,
+    iter_lines,
+)
+from iot_data_receiver.endpoints import DefinedEndpointDescription
+from iot_data_receiver.model import EnvironmentInput
+
+TYPECODES = {"timestamp": "q", "temperature": "d", "pressure": "f"}
+
+
+@pytest.mark.parametrize(
+    ("header", "exp_content_type"),
+    [
+        (None, "application/json"),
+        ("application/json; charset=utf-8", "application/json"),
+        ("Application/MsgPack", "application/msgpack"),
+    ],
+)
+def test_get_content_type(header, exp_content_type):
+    assert get_content_type(header) == exp_content_type
+
+
+@pytest.mark.parametrize(
+    ("encoding", "compress"),
+    [
+        (None, lambda data: data),
+        ("Identity", lambda data: data),
+        ("gzip", gzip.compress),
+        ("GZIP", gzip.compress),
+        (" Gzip ", gzip.compress),
+        ("zstd", zstandard.compress),
+        ("ZSTD", zstandard.compress),
+    ],
+)
+def test_decompress(encoding, compress):
+    data = b"data" * 100
+
+    assert decompress(compress(data), encoding, 1000) == data
+
+    with pytest.raises(DecodeError):
+        decompress(compress(data), encoding, 100)
+
+
+def test_decompress_unsupported():
+    with pytest.raises(UnsupportedEncoding):
+        decompress(b"data", "br", 100)
+
+
+def test_decode_body_msgpack():
+    time_stamp = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    body = msgpack.packb(
+        {"timestamp": [time_stamp], "temperature": [1.5]}, datetime=True
+    )
+
+    assert decode_body(body, "application/msgpack") == {
+        "timestamp": [time_stamp],
+        "temperature": [1.5],
+    }
+
+
+def test_columnar_roundtrip():
+    columns = {
+        "timestamp": [datetime(2022, 1, 1), datetime(2022, 1, 1, 0, 1)],
+        "temperature": [1.1, 2.2],
+        "pressure": [1000.5, 1001.5],
+    }
+
+    environment_input = decode_columnar(
+        encode_columnar(columns, TYPECODES), EnvironmentInput
+    )
+
+    assert isinstance(environment_input, EnvironmentInput)
+    assert environment_input.timestamp == columns["timestamp"]
+    assert environment_input.temperature == columns["temperature"]
+    assert environment_input.pressure == columns["pressure"]
+    assert environment_input.humidity is None
+
+
+@pytest.mark.parametrize(
+    ("columns", "typecodes"),
+    [
+        ({"timestamp": [0]}, TYPECODES),
+        ({"timestamp": [0], "temperature": [1.1]}, {**TYPECODES, "timestamp": "d"}),
+        ({"timestamp": [0], "bogus": [1.1]}, {**TYPECODES, "bogus": "d"}),
+    ],
+)
+def test_decode_columnar_invalid(columns, typecodes):
+    with pytest.raises(DecodeError):
+        decode_columnar(encode_columnar(columns, typecodes), EnvironmentInput)
+
+
+def test_decode_columnar_truncated():
+    body = encode_columnar({"timestamp": [0], "temperature": [1.1]}, TYPECODES)
+
+    with pytest.raises(DecodeError):
+        decode_columnar(body[:-1], EnvironmentInput)
+
+
+def test_decode_columnar_timestamp_out_of_range():
+    body = encode_columnar(
+        {"timestamp": [2**63 - 1], "temperature": [1.1]}, TYPECODES
+    )
+
+    with pytest.raises(DecodeError, match="out of range"):
+        decode_columnar(body, EnvironmentInput)
+
+
+def test_decode_columnar_int_out_of_range():
+    model = DefinedEndpointDescription(
+        "soil",
+        {
+            "timestamp": {"ctype": "TIMESTAMP", "is_primary": True},
+            "battery": {"ctype": "SMALLINT"},
+        },
+    ).get_input_model()
+    typecodes = {"timestamp": "q", "battery": "q"}
+
+    body = encode_columnar({"timestamp": [0], "battery": [2**15 - 1]}, typecodes)
+    assert decode_columnar(body, model).battery == [2**15 - 1]
+
+    body = encode_columnar({"timestamp": [0], "battery": [2**15]}, typecodes)
+    with pytest.raises(DecodeError, match="out of range"):
+        decode_columnar(body, model)
+
+
+def test_decode_columnar_duplicate_column():
+    body = encode_columnar({"timestamp": [0], "temperature": [1.1]}, TYPECODES)
+    # Append the temperature column a second time
+    temperature = encode_columnar({"temperature": [2.2]}, TYPECODES)
+    body = (
+        COLUMNAR_HEADER.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, 3, 1)
+        + body[COLUMNAR_HEADER.size :]
+        + temperature[COLUMNAR_HEADER.size :]
+    )
+
+    with pytest.raises(DecodeError, match="Duplicate column"):
+        decode_columnar(body, EnvironmentInput)
+
+
+async def to_stream(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def collect_lines(chunks, max_line_size):
+    return [line async for line in iter_lines(to_stream(chunks), max_line_size)]
+
+
+def test_iter_lines():
+    chunks = [b'{"a"', b":1}\n", b'{"b":2}\n\n{"c"', b":3}"]
+
+    assert asyncio.run(collect_lines(chunks, 100)) == [
+        b'{"a":1}',
+        b'{"b":2}',
+        b'{"c":3}',
+    ]
+
+
+def test_iter_lines_too_long():
+    with pytest.raises(DecodeError):
+        asyncio.run(collect_lines([b"a" * 60, b"a" * 60 + b"\n"], 100))
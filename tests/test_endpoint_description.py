@@ -1,7 +1,13 @@
 import pytest
 from data_organizer.db.model import TableSetting
+from pydantic import ValidationError
 
-from iot_data_receiver.endpoints import EnvironmentEndpointDescription
+from iot_data_receiver.endpoints import (
+    EndpointRegistry,
+    EnvironmentEndpointDescription,
+    Registration,
+)
+from iot_data_receiver.model import ConflictPolicy, PartitionInterval
 
 
 @pytest.mark.parametrize("fields", [[], ["field_1", "field_3"]])
@@ -45,3 +51,126 @@ def test_generate_table_structure(mocker, fields):
         assert column.ctype == properties[column.name]["pg_type"]
         assert column.is_primary == properties[column.name]["pg_is_primary"]
         assert column.is_unique == properties[column.name]["pg_is_unique"]
+
+
+def test_registration():
+    registration = Registration("test_table", ["timestamp", "temperature"])
+
+    assert registration.insert_sql == (
+        'INSERT INTO "test_table" ("timestamp", "temperature") VALUES %s'
+        " RETURNING (xmax = 0)"
+    )
+
+
+@pytest.mark.parametrize(
+    ("on_conflict", "primary_fields", "exp_clause"),
+    [
+        (ConflictPolicy.ERROR, ["timestamp"], "VALUES %s RETURNING"),
+        (ConflictPolicy.NOTHING, ["timestamp"], "ON CONFLICT DO NOTHING"),
+        (
+            ConflictPolicy.UPDATE,
+            ["timestamp"],
+            'ON CONFLICT ("timestamp") DO UPDATE SET '
+            '"temperature" = EXCLUDED."temperature"',
+        ),
+        (ConflictPolicy.UPDATE, [], "ON CONFLICT DO NOTHING"),
+    ],
+)
+def test_registration_conflict_policy(on_conflict, primary_fields, exp_clause):
+    registration = Registration(
+        "test_table",
+        ["timestamp", "temperature"],
+        primary_fields=primary_fields,
+        on_conflict=on_conflict,
+    )
+
+    assert exp_clause in registration.insert_sql
+    assert exp_clause.replace("VALUES %s", "") in registration.insert_from_staging_sql
+
+
+@pytest.mark.parametrize("partitioning", [None, PartitionInterval.WEEK])
+def test_registration_dict(partitioning):
+    registration = Registration(
+        "test_table",
+        ["timestamp", "temperature"],
+        primary_fields=["timestamp"],
+        on_conflict=ConflictPolicy.NOTHING,
+        partitioning=partitioning,
+        retention_days=30 if partitioning else None,
+        rollups=[3600, 60] if partitioning else None,
+    )
+
+    restored = Registration.from_dict(registration.to_dict())
+
+    assert restored.to_dict() == registration.to_dict()
+    assert restored.partitioning == partitioning
+    assert restored.rollups == ([60, 3600] if partitioning else [])
+
+
+def test_endpoint_registry():
+    registry = EndpointRegistry.load(
+        {
+            "soil": {
+                "timestamp": {"ctype": "TIMESTAMP", "is_primary": True},
+                "moisture": {"ctype": "FLOAT"},
+                "battery": {"ctype": "INT", "is_nullable": True},
+            }
+        },
+        use_entry_points=False,
+    )
+
+    assert registry.names() == ["environment", "soil"]
+
+    soil = registry["soil"]
+
+    assert soil.get_primary_fields() == ["timestamp"]
+    assert soil.get_column_types([]) == {
+        "timestamp": "TIMESTAMP",
+        "moisture": "FLOAT",
+        "battery": "INT",
+    }
+    for fast_validation in [True, False]:
+        data = soil.parse(
+            {"timestamp": ["2022-01-01T00:00:00"], "moisture": ["0.5"]},
+            fast_validation,
+        )
+        assert data.moisture == [0.5]
+        assert data.battery is None
+
+
+@pytest.mark.parametrize("fast_validation", [True, False])
+@pytest.mark.parametrize(
+    ("ctype", "value"),
+    [("SMALLINT", 2**15), ("INT", -(2**31) - 1), ("BIGINT", 2**63)],
+)
+def test_defined_endpoint_int_range(ctype, value, fast_validation):
+    registry = EndpointRegistry.load(
+        {
+            "soil": {
+                "timestamp": {"ctype": "TIMESTAMP", "is_primary": True},
+                "battery": {"ctype": ctype},
+            }
+        },
+        use_entry_points=False,
+    )
+
+    with pytest.raises(ValidationError):
+        registry["soil"].parse(
+            {"timestamp": ["2022-01-01T00:00:00"], "battery": [value]},
+            fast_validation,
+        )
+
+
+@pytest.mark.parametrize(
+    "definitions",
+    [
+        {"soil": {"timestamp": {"ctype": "JSON"}}},
+        {"environment": {"timestamp": {"ctype": "TIMESTAMP"}}},
+        {"soil": {"moisture": {"ctype": "FLOAT"}}},
+        {"soil": {"timestamp": {"ctype": "FLOAT"}}},
+        {"soil": {"timestamp": {"ctype": "TIMESTAMP", "is_nullable": True}}},
+    ],
+)
+def test_endpoint_registry_invalid(definitions):
+    with pytest.raises(ValueError):
+        EndpointRegistry.load(definitions, use_entry_points=False)
@@ -0,0 +1,46 @@
+import pytest
+
+from iot_data_receiver.hashing import get_crypt_context, hash_token
+from iot_data_receiver.utils import generate_token
+
+
+def test_hmac_sha256():
+    token, hashed_token = generate_token(20, scheme="hmac_sha256", pepper="pepper")
+    context = get_crypt_context("hmac_sha256", pepper="pepper")
+
+    assert hashed_token.startswith("$hmac-sha256$")
+    assert token not in hashed_token
+    assert hashed_token == hash_token(token, scheme="hmac_sha256", pepper="pepper")
+    assert context.verify(token, hashed_token)
+    assert not context.verify(generate_token(20)[0], hashed_token)
+    assert not get_crypt_context("hmac_sha256", pepper="other").verify(
+        token, hashed_token
+    )
+
+
+@pytest.mark.parametrize(
+    ("old_scheme", "new_scheme"),
+    [("bcrypt", "hmac_sha256"), ("hmac_sha256", "bcrypt")],
+)
+def test_deprecated_scheme_is_rehashed(old_scheme, new_scheme):
+    token, hashed_token = generate_token(20, scheme=old_scheme, pepper="pepper")
+    context = get_crypt_context(new_scheme, pepper="pepper")
+
+    valid, new_hash = context.verify_and_update(token, hashed_token)
+
+    assert valid
+    assert context.identify(new_hash) == new_scheme
+    assert context.verify_and_update(token, new_hash) == (True, None)
+
+
+def test_bcrypt_without_pepper():
+    token, hashed_token = generate_token(20, scheme="bcrypt", bcrypt_rounds=4)
+
+    assert hashed_token.startswith("$2b$04$")
+    assert get_crypt_context().verify_and_update(token, hashed_token) == (True, None)
+
+
+@pytest.mark.parametrize("settings", [{"scheme": "md5"}, {"scheme": "hmac_sha256"}])
+def test_invalid_settings(settings):
+    with pytest.raises(ValueError):
+        get_crypt_context(**settings)
@@ -0,0 +1,70 @@
+import threading
+
+from iot_data_receiver.health import HealthChecker
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_health_checker_caches_result():
+    calls = []
+    checked = threading.Event()
+
+    def check():
+        calls.append(1)
+        checked.set()
+        return {"database": {"ok": True}}
+
+    checker = HealthChecker(check, interval=60, max_age=60)
+    checked.wait(timeout=5)
+
+    for _ in range(3):
+        ready, result = checker.result()
+        assert ready
+        assert result["checks"] == {"database": {"ok": True}}
+
+    checker.close()
+
+    assert len(calls) == 1
+
+
+def test_health_checker_failed_check():
+    checker = HealthChecker(
+        lambda: {"database": {"ok": True}, "tables": {"ok": False}},
+        interval=60,
+        max_age=60,
+    )
+    checker.close()
+
+    assert not checker.result()[0]
+
+
+def test_health_checker_exception():
+    def check():
+        raise RuntimeError("Connection refused")
+
+    checker = HealthChecker(check, interval=60, max_age=60)
+    checker.close()
+
+    ready, result = checker.result()
+    assert not ready
+    assert result["checks"]["checks"]["error"] == "Connection refused"
+
+
+def test_health_checker_stale_result():
+    timer = FakeTimer()
+    checker = HealthChecker(
+        lambda: {"database": {"ok": True}}, interval=60, max_age=30, timer=timer
+    )
+    checker.close()
+
+    assert checker.result()[0]
+
+    timer.now = 31
+
+    assert not checker.result()[0]
@@ -0,0 +1,76 @@
+import pytest
+
+from iot_data_receiver.limits import AdmissionControl, RateLimiter
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_rate_limiter():
+    timer = FakeTimer()
+    limiter = RateLimiter(
+        rate=1, burst=2, endpoints={}, senders={}, maxsize=10, timer=timer
+    )
+
+    assert limiter.check("sender", "environment") == 0
+    assert limiter.check("sender", "environment") == 0
+    assert limiter.check("sender", "environment") == pytest.approx(1)
+    # Other senders and endpoints have their own buckets
+    assert limiter.check("other", "environment") == 0
+    assert limiter.check("sender", "gateway") == 0
+
+    timer.now = 1.5
+
+    assert limiter.check("sender", "environment") == 0
+    assert limiter.check("sender", "environment") == pytest.approx(0.5)
+    assert limiter.stats()["throttled"] == 2
+
+
+def test_rate_limiter_overrides():
+    limiter = RateLimiter(
+        rate=0,
+        burst=10,
+        endpoints={"gateway": {"rate": 5}},
+        senders={"noisy": {"rate": 0.1, "burst": 1}},
+        maxsize=10,
+    )
+
+    assert limiter.get_limit("sender", "environment") == (0, 10)
+    assert limiter.get_limit("sender", "gateway") == (5, 10)
+    assert limiter.get_limit("noisy", "gateway") == (0.1, 1)
+
+    for _ in range(100):
+        assert limiter.check("sender", "environment") == 0
+    assert limiter.check("noisy", "environment") == 0
+    assert limiter.check("noisy", "environment") > 0
+
+
+def test_rate_limiter_maxsize():
+    limiter = RateLimiter(rate=1, burst=1, endpoints={}, senders={}, maxsize=2)
+
+    for sender in ["a", "b", "c"]:
+        limiter.check(sender, "environment")
+
+    assert limiter.stats()["buckets"] == 2
+    # The bucket of a was dropped, so a starts with a full bucket again
+    assert limiter.check("a", "environment") == 0
+
+
+def test_admission_control():
+    admission = AdmissionControl(max_concurrent=3, max_per_sender=2)
+
+    assert admission.acquire("a") is None
+    assert admission.acquire("a") is None
+    assert admission.acquire("a") == AdmissionControl.SENDER
+    assert admission.acquire("b") is None
+    assert admission.acquire("c") == AdmissionControl.TOTAL
+
+    admission.release("a")
+
+    assert admission.acquire("c") is None
+    assert admission.stats() == {"active": 3, "rejected": {"sender": 1, "total": 1}}
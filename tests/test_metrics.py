@@ -0,0 +1,131 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from iot_data_receiver.metrics import Metrics, MetricsMiddleware
+
+
+def get_sample(metrics, name, labels):
+    return metrics.registry.get_sample_value(name, labels)
+
+
+def test_metrics_disabled():
+    metrics = Metrics(enabled=False)
+
+    with metrics.stage("write"):
+        pass
+    metrics.count_rows("sender", "environment", 10)
+    metrics.count_auth_failure("invalid")
+
+    assert not hasattr(metrics, "registry")
+
+
+def test_metrics_stage():
+    metrics = Metrics(enabled=True)
+
+    with metrics.stage("write"):
+        pass
+
+    labels = {"stage": "write", "endpoint": "none"}
+    assert get_sample(metrics, "iot_receiver_stage_seconds_count", labels) == 1
+
+
+def test_metrics_counters():
+    metrics = Metrics(enabled=True)
+
+    metrics.count_rows("sender", "environment", 10)
+    metrics.count_rows("sender", "environment", 5)
+    metrics.count_auth_failure("invalid")
+    metrics.count_db_error("integrity")
+    metrics.count_throttled("sender", "environment", "rate")
+
+    labels = {"sender": "sender", "endpoint": "environment"}
+    assert get_sample(metrics, "iot_receiver_rows_total", labels) == 15
+    assert (
+        get_sample(metrics, "iot_receiver_auth_failures_total", {"reason": "invalid"})
+        == 1
+    )
+    assert (
+        get_sample(metrics, "iot_receiver_db_errors_total", {"error": "integrity"}) == 1
+    )
+    assert (
+        get_sample(
+            metrics, "iot_receiver_throttled_total", {**labels, "reason": "rate"}
+        )
+        == 1
+    )
+
+
+def test_metrics_pool():
+    metrics = Metrics(
+        enabled=True,
+        pool_stats=lambda: {"size": 5, "checked_out": 2, "overflow": 0},
+    )
+
+    assert get_sample(metrics, "iot_receiver_db_pool_checked_out", {}) == 2
+    assert b"iot_receiver_db_pool_size 5.0" in metrics.generate()
+
+
+def test_metrics_stats():
+    stats = {"size": 1, "hits": 2, "rejected": {"total": 3}, "connected": True}
+    metrics = Metrics(enabled=True)
+    metrics.register_stats("cache", lambda: stats)
+    metrics.register_stats("spool", lambda: None)
+
+    assert get_sample(metrics, "iot_receiver_cache_hits", {}) == 2
+    assert get_sample(metrics, "iot_receiver_cache_rejected_total", {}) == 3
+    assert get_sample(metrics, "iot_receiver_cache_connected", {}) == 1
+    assert b"iot_receiver_spool" not in metrics.generate()
+
+
+def test_metrics_middleware():
+    metrics = Metrics(enabled=True)
+    app = FastAPI()
+
+    @app.post("/data")
+    def data():
+        with metrics.stage("write"):
+            return {}
+
+    @app.get("/items/{name}")
+    def item(name: str):
+        with metrics.stage("read"):
+            return {}
+
+    app.add_middleware(
+        MetricsMiddleware, metrics=metrics, routes=app.routes, paths=["/items/a"]
+    )
+    client = TestClient(app)
+
+    client.post("/data", data=b"x" * 100)
+    client.post("/unknown")
+    client.get("/items/a")
+    client.get("/items/b")
+
+    request_labels = {"endpoint": "/data", "method": "POST", "status": "200"}
+    assert get_sample(metrics, "iot_receiver_request_seconds_count", request_labels)
+    assert get_sample(
+        metrics,
+        "iot_receiver_request_seconds_count",
+        {"endpoint": "other", "method": "POST", "status": "404"},
+    )
+    assert get_sample(
+        metrics,
+        "iot_receiver_stage_seconds_count",
+        {"stage": "write", "endpoint": "/data"},
+    )
+    assert (
+        get_sample(
+            metrics, "iot_receiver_request_body_bytes_sum", {"endpoint": "/data"}
+        )
+        == 100
+    )
+    assert get_sample(
+        metrics,
+        "iot_receiver_stage_seconds_count",
+        {"stage": "read", "endpoint": "/items/{name}"},
+    )
+    assert get_sample(
+        metrics,
+        "iot_receiver_request_seconds_count",
+        {"endpoint": "/items/a", "method": "GET", "status": "200"},
+    )
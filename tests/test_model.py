@@ -1,9 +1,17 @@
 from datetime import datetime
 
 import pytest
-from pydantic import ValidationError
+from pydantic import ValidationError, conint
 
-from iot_data_receiver.model import EnvironmentInput
+from iot_data_receiver.model import (
+    EnvironmentInput,
+    PartitionInterval,
+    RegisterInput,
+    get_column_parser,
+    parse_bounded_ints,
+    parse_columns,
+    parse_ints,
+)
 
 
 def test_environment_input_validate_length():
@@ -15,3 +23,82 @@ def test_environment_input_validate_length():
             ],
             temperatur=[2.5],
         )
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"timestamp": ["2022-01-01T00:01:00"], "temperature": [2.5]},
+        {"timestamp": ["2022-01-01T00:01:00+01:00"], "temperature": ["2.5"]},
+        {
+            "timestamp": ["2022-01-01 00:01:00", 1640995260],
+            "temperature": [2, 2.5],
+            "pressure": [1000, 1001.5],
+        },
+    ],
+)
+def test_parse_columns(data):
+    assert parse_columns(EnvironmentInput, data) == EnvironmentInput.parse_obj(data)
+
+
+@pytest.mark.parametrize(
+    ("data", "exp_loc"),
+    [
+        ({"temperature": [2.5]}, ("timestamp",)),
+        ({"timestamp": "2022-01-01T00:01:00", "temperature": [2.5]}, ("timestamp",)),
+        (
+            {"timestamp": ["2022-01-01T00:01:00"], "temperature": [2.5, 3.5]},
+            ("temperature",),
+        ),
+        (
+            {
+                "timestamp": ["2022-01-01T00:01:00", "2022-01-01T00:02:00"],
+                "temperature": [2.5, "bogus"],
+            },
+            ("temperature", 1),
+        ),
+        (
+            {"timestamp": ["2022-01-01T00:01:00", "bogus"], "temperature": [1, 2]},
+            ("timestamp", 1),
+        ),
+    ],
+)
+def test_parse_columns_invalid(data, exp_loc):
+    with pytest.raises(ValidationError) as e:
+        parse_columns(EnvironmentInput, data)
+
+    assert e.value.errors()[0]["loc"] == exp_loc
+
+
+def test_parse_ints():
+    assert parse_ints([1, "2", 3.0]) == [1, 2, 3]
+
+    with pytest.raises(Exception):
+        parse_ints([1, "bogus"])
+
+
+def test_parse_bounded_ints():
+    assert parse_bounded_ints([1, "2"], ge=0, le=2) == [1, 2]
+
+    with pytest.raises(Exception):
+        parse_bounded_ints([1, 3], ge=0, le=2)
+    with pytest.raises(Exception):
+        parse_bounded_ints([-1, 1], ge=0, le=2)
+
+
+def test_get_column_parser():
+    assert get_column_parser(int) is parse_ints
+    assert get_column_parser(conint(ge=0, le=2))([2]) == [2]
+    assert get_column_parser(conint(gt=0)) is None
+    assert get_column_parser(str) is None
+
+
+def test_register_input_retention_requires_partitioning():
+    with pytest.raises(ValidationError):
+        RegisterInput(endpoint="environment", fields=[], retention_days=30)
+
+    register_input = RegisterInput(
+        endpoint="environment", fields=[], partitioning="month", retention_days=30
+    )
+
+    assert register_input.partitioning == PartitionInterval.MONTH
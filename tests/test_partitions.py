@@ -0,0 +1,192 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from psycopg2.errors import CheckViolation
+
+import iot_data_receiver.partitions
+from iot_data_receiver.endpoints import Registration
+from iot_data_receiver.model import PartitionInterval
+from iot_data_receiver.partitions import (
+    PartitionManager,
+    get_create_partition_sql,
+    get_create_partitioned_table_sql,
+    get_migration_sql,
+    get_next_partition_start,
+    get_partition_name,
+    get_partition_start,
+    get_partition_start_from_name,
+    is_missing_partition_error,
+    iter_partition_starts,
+)
+from iot_data_receiver.utils import get_suffixed_name
+
+
+@pytest.mark.parametrize(
+    ("interval", "exp_start", "exp_next"),
+    [
+        (PartitionInterval.DAY, datetime(2022, 12, 29), datetime(2022, 12, 30)),
+        (PartitionInterval.WEEK, datetime(2022, 12, 26), datetime(2023, 1, 2)),
+        (PartitionInterval.MONTH, datetime(2022, 12, 1), datetime(2023, 1, 1)),
+    ],
+)
+def test_partition_start(interval, exp_start, exp_next):
+    start = get_partition_start(datetime(2022, 12, 29, 13, 45), interval)
+
+    assert start == exp_start
+    assert get_next_partition_start(start, interval) == exp_next
+
+
+def test_partition_start_aware():
+    timestamp = datetime(2022, 1, 1, 0, 30, tzinfo=timezone(timedelta(hours=1)))
+
+    assert get_partition_start(timestamp, PartitionInterval.DAY) == datetime(
+        2021, 12, 31
+    )
+
+
+def test_iter_partition_starts():
+    starts = list(
+        iter_partition_starts(
+            datetime(2022, 1, 31, 23), datetime(2022, 3, 1), PartitionInterval.MONTH
+        )
+    )
+
+    assert starts == [datetime(2022, 1, 1), datetime(2022, 2, 1), datetime(2022, 3, 1)]
+
+
+@pytest.mark.parametrize("table_name", ["sender_environment", "s" * 60])
+def test_partition_name(table_name):
+    start = datetime(2022, 2, 1)
+    name = get_partition_name(table_name, start)
+
+    assert len(name) <= 63
+    assert get_partition_start_from_name(name) == start
+    assert get_partition_name("t" + table_name[1:], start) != name
+
+
+def test_partition_sql():
+    assert get_create_partitioned_table_sql(
+        "test_table", {"timestamp": "TIMESTAMP", "temperature": "FLOAT"}, ["timestamp"]
+    ) == (
+        'CREATE TABLE "test_table" ("timestamp" TIMESTAMP NOT NULL, '
+        '"temperature" FLOAT NOT NULL, PRIMARY KEY ("timestamp")) '
+        'PARTITION BY RANGE ("timestamp")'
+    )
+    assert get_create_partition_sql(
+        "test_table", datetime(2022, 1, 1), PartitionInterval.MONTH
+    ) == (
+        'CREATE TABLE IF NOT EXISTS "test_table_p20220101" PARTITION OF "test_table" '
+        "FOR VALUES FROM ('2022-01-01T00:00:00') TO ('2022-02-01T00:00:00')"
+    )
+
+
+def test_migration_sql():
+    statements = get_migration_sql(
+        "test_table",
+        [datetime(2022, 1, 1), datetime(2022, 2, 1)],
+        PartitionInterval.MONTH,
+    )
+
+    assert (
+        statements[0] == 'ALTER TABLE "test_table" RENAME TO "test_table_unpartitioned"'
+    )
+    assert sum("PARTITION OF" in statement for statement in statements) == 2
+    assert statements[-1] == 'DROP TABLE "test_table_unpartitioned"'
+
+
+def test_migration_sql_long_name():
+    table_name = "s" * 60
+    statements = get_migration_sql(table_name, [], PartitionInterval.MONTH)
+
+    legacy_table = get_suffixed_name(table_name, "_unpartitioned")
+    assert len(legacy_table) <= 63
+    assert statements[0] == f'ALTER TABLE "{table_name}" RENAME TO "{legacy_table}"'
+
+
+def test_partition_manager(monkeypatch):
+    created = []
+    monkeypatch.setattr(
+        iot_data_receiver.partitions,
+        "create_partitions",
+        lambda db, table_name, starts, interval: created.extend(starts),
+    )
+    registration = Registration(
+        "test_table", ["timestamp"], partitioning=PartitionInterval.DAY
+    )
+    manager = PartitionManager()
+
+    timestamps = [datetime(2022, 1, 2, 12), datetime(2022, 1, 1, 12)]
+    assert manager.ensure(None, registration, timestamps) == 2
+    assert manager.ensure(None, registration, ["2022-01-01T18:00:00"]) == 0
+    assert manager.ensure(None, registration, ["2022-01-03T00:00:00"]) == 1
+
+    assert created == [
+        datetime(2022, 1, 1),
+        datetime(2022, 1, 2),
+        datetime(2022, 1, 3),
+    ]
+
+    manager.forget("test_table")
+
+    assert manager.ensure(None, registration, timestamps) == 2
+
+
+def test_partition_manager_aware(monkeypatch):
+    created = []
+    monkeypatch.setattr(
+        iot_data_receiver.partitions,
+        "create_partitions",
+        lambda db, table_name, starts, interval: created.extend(starts),
+    )
+    registration = Registration(
+        "test_table", ["timestamp"], partitioning=PartitionInterval.DAY
+    )
+
+    timestamp = datetime(2022, 6, 15, 0, 30, tzinfo=timezone(timedelta(hours=2)))
+    assert PartitionManager().ensure(None, registration, [timestamp]) == 1
+
+    assert created == [datetime(2022, 6, 14)]
+
+
+def test_partition_manager_refresh(monkeypatch):
+    created = []
+    monkeypatch.setattr(
+        iot_data_receiver.partitions,
+        "create_partitions",
+        lambda db, table_name, starts, interval: created.extend(starts),
+    )
+    # Only the partition of 2022-01-02 still exists in the database
+    monkeypatch.setattr(
+        iot_data_receiver.partitions,
+        "get_partitions",
+        lambda db, table_name: {datetime(2022, 1, 2): "test_table_p20220102"},
+    )
+    registration = Registration(
+        "test_table", ["timestamp"], partitioning=PartitionInterval.DAY
+    )
+    manager = PartitionManager()
+    timestamps = [datetime(2022, 1, 1, 12), datetime(2022, 1, 2, 12)]
+    manager.ensure(None, registration, timestamps)
+
+    manager.refresh(None, "test_table")
+
+    assert manager.ensure(None, registration, timestamps) == 1
+    assert created[-1] == datetime(2022, 1, 1)
+
+
+@pytest.mark.parametrize(
+    ("error", "exp_missing"),
+    [
+        (CheckViolation('no partition of relation "test_table" found for row'), True),
+        (CheckViolation("new row violates check constraint"), False),
+        (ValueError("no partition of relation"), False),
+    ],
+)
+def test_is_missing_partition_error(error, exp_missing):
+    assert is_missing_partition_error(error) == exp_missing
+
+
+def test_partition_manager_unpartitioned():
+    registration = Registration("test_table", ["timestamp"])
+
+    assert PartitionManager().ensure(None, registration, [datetime.now()]) == 0
@@ -0,0 +1,167 @@
+import json
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from iot_data_receiver.model import Aggregation
+from iot_data_receiver.query import (
+    InvalidCursor,
+    build_query,
+    decode_cursor,
+    encode_cursor,
+    execute_query,
+    get_query_parameters,
+    stream_json,
+)
+
+
+def test_build_query_raw():
+    query = build_query(
+        "test_table", ["temperature"], Aggregation.MEAN, None, after_cursor=True
+    )
+
+    assert query == (
+        'SELECT "timestamp", "temperature" FROM "test_table" '
+        'WHERE "timestamp" >= %(start)s AND "timestamp" < %(end)s '
+        'AND "timestamp" > %(after)s ORDER BY 1 LIMIT %(limit)s'
+    )
+
+
+@pytest.mark.parametrize(
+    ("aggregation", "exp_expression"),
+    [
+        (Aggregation.MEAN, 'avg("temperature")::double precision'),
+        (Aggregation.MAX, 'max("temperature")'),
+        (
+            Aggregation.LAST,
+            '(array_agg("temperature" ORDER BY "timestamp" DESC))[1]',
+        ),
+    ],
+)
+def test_build_query_bucket(aggregation, exp_expression):
+    query = build_query(
+        "test_table", ["temperature"], aggregation, 60, after_cursor=False
+    )
+
+    assert 'date_bin(make_interval(secs => %(bucket)s), "timestamp"' in query
+    assert exp_expression in query
+    assert query.endswith("GROUP BY 1 ORDER BY 1 LIMIT %(limit)s")
+
+
+def test_cursor():
+    timestamp = datetime(2022, 1, 1, 12, 30)
+
+    assert decode_cursor(encode_cursor(timestamp)) == timestamp
+
+    with pytest.raises(InvalidCursor):
+        decode_cursor("bogus")
+
+
+def test_query_parameters_aware():
+    offset = timezone(timedelta(hours=2))
+    parameters = get_query_parameters(
+        datetime(2022, 1, 1, tzinfo=offset),
+        datetime(2022, 1, 2),
+        limit=10,
+        bucket=60,
+        after=datetime(2022, 1, 1, 12, tzinfo=offset),
+    )
+
+    assert parameters == {
+        "start": datetime(2021, 12, 31, 22),
+        "end": datetime(2022, 1, 2),
+        "limit": 10,
+        "bucket": 60,
+        "after": datetime(2022, 1, 1, 10),
+    }
+
+
+@pytest.mark.parametrize(("limit", "has_next"), [(3, True), (10, False)])
+def test_stream_json(limit, has_next):
+    chunks = [
+        [(datetime(2022, 1, 1, 0, 0), 1.0), (datetime(2022, 1, 1, 0, 1), 2.0)],
+        [(datetime(2022, 1, 1, 0, 2), None)],
+    ]
+
+    data = json.loads(b"".join(stream_json(["temperature"], iter(chunks), limit)))
+
+    assert data["fields"] == ["timestamp", "temperature"]
+    assert data["rows"] == [
+        ["2022-01-01T00:00:00", 1.0],
+        ["2022-01-01T00:01:00", 2.0],
+        ["2022-01-01T00:02:00", None],
+    ]
+    if has_next:
+        assert decode_cursor(data["next_cursor"]) == datetime(2022, 1, 1, 0, 2)
+    else:
+        assert data["next_cursor"] is None
+
+
+def test_stream_json_empty():
+    data = json.loads(b"".join(stream_json(["temperature"], iter([]), 10)))
+
+    assert data == {
+        "fields": ["timestamp", "temperature"],
+        "rows": [],
+        "next_cursor": None,
+    }
+
+
+class FakeCursor:
+    def __init__(self, rows, error):
+        self.rows = rows
+        self.error = error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, parameters):
+        if self.error is not None:
+            raise self.error
+
+    def fetchmany(self, size):
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+
+class FakeConnection:
+    def __init__(self, rows, error=None):
+        self.rows = rows
+        self.error = error
+        self.closed = False
+
+    def cursor(self, name):
+        return FakeCursor(self.rows, self.error)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def get_fake_db(connection):
+    return SimpleNamespace(engine=SimpleNamespace(raw_connection=lambda: connection))
+
+
+def test_execute_query():
+    rows = [(datetime(2022, 1, 1, 0, minute), 1.0) for minute in range(3)]
+    connection = FakeConnection(rows)
+
+    chunks = execute_query(get_fake_db(connection), "SELECT", {}, fetch_size=2)
+
+    assert list(chunks) == [rows[:2], rows[2:]]
+    assert connection.closed
+
+
+def test_execute_query_error():
+    connection = FakeConnection([], error=RuntimeError("Query failed"))
+
+    # Raised before the response would be streamed
+    with pytest.raises(RuntimeError):
+        execute_query(get_fake_db(connection), "SELECT", {}, fetch_size=2)
+    assert connection.closed
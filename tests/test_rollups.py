@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import iot_data_receiver.rollups
+from iot_data_receiver.endpoints import Registration
+from iot_data_receiver.model import Aggregation
+from iot_data_receiver.rollups import (
+    build_rollup_query,
+    choose_rollup,
+    get_bucket_start,
+    get_create_rollup_table_sql,
+    get_refresh_rollup_sql,
+    get_rollup_sources,
+    get_rollup_table_name,
+    is_aligned,
+    refresh_rollups_for_columns,
+)
+from iot_data_receiver.utils import MAX_IDENTIFIER_LENGTH
+
+
+def test_rollup_sources():
+    assert get_rollup_sources([86400, 60, 3600, 70]) == {
+        60: None,
+        70: None,
+        3600: 60,
+        86400: 3600,
+    }
+
+
+def test_rollup_table_name():
+    assert get_rollup_table_name("test_table", 60) == "test_table_rollup_60"
+    assert len(get_rollup_table_name("x" * 100, 60)) <= MAX_IDENTIFIER_LENGTH
+
+
+def test_bucket_start():
+    timestamp = datetime(2022, 1, 1, 12, 34, 56)
+
+    assert get_bucket_start(timestamp, 3600) == datetime(2022, 1, 1, 12)
+    assert get_bucket_start(datetime(2022, 1, 7), 86400 * 7) == datetime(2022, 1, 1)
+    assert is_aligned(datetime(2022, 1, 1, 12), 3600)
+    assert not is_aligned(timestamp, 60)
+
+
+def test_bucket_start_aware():
+    timestamp = datetime(2022, 6, 15, 0, 30, tzinfo=timezone(timedelta(hours=2)))
+
+    assert get_bucket_start(timestamp, 86400) == datetime(2022, 6, 14)
+    assert is_aligned(
+        datetime(2022, 6, 15, 2, tzinfo=timezone(timedelta(hours=2))), 86400
+    )
+
+
+def test_refresh_rollups_for_columns_aware(monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(
+        iot_data_receiver.rollups,
+        "refresh_rollups",
+        lambda db, registration, first, last: refreshed.append((first, last)),
+    )
+    registration = Registration("test_table", ["timestamp", "value"], rollups=[60])
+    offset = timezone(timedelta(hours=2))
+
+    refresh_rollups_for_columns(
+        None,
+        registration,
+        [datetime(2022, 6, 15, 0, 30, tzinfo=offset), datetime(2022, 6, 14, 23)],
+    )
+
+    assert refreshed == [(datetime(2022, 6, 14, 22, 30), datetime(2022, 6, 14, 23))]
+
+
+def test_create_rollup_table_sql():
+    sql = get_create_rollup_table_sql("test_table", 60, ["temperature"])
+
+    assert sql == (
+        'CREATE TABLE IF NOT EXISTS "test_table_rollup_60" ('
+        '"bucket" TIMESTAMP PRIMARY KEY, "count" BIGINT NOT NULL, '
+        '"temperature_min" DOUBLE PRECISION, "temperature_max" DOUBLE PRECISION, '
+        '"temperature_sum" DOUBLE PRECISION)'
+    )
+
+
+@pytest.mark.parametrize(
+    ("source", "exp_from", "exp_count", "exp_sum"),
+    [
+        (None, '"test_table"', "count(*)", 'sum("temperature")'),
+        (60, '"test_table_rollup_60"', 'sum("count")', 'sum("temperature_sum")'),
+    ],
+)
+def test_refresh_rollup_sql(source, exp_from, exp_count, exp_sum):
+    sql = get_refresh_rollup_sql("test_table", 3600, ["temperature"], source)
+
+    assert sql.startswith('INSERT INTO "test_table_rollup_3600"')
+    assert f"FROM {exp_from} " in sql
+    assert exp_count in sql
+    assert exp_sum in sql
+    assert 'ON CONFLICT ("bucket") DO UPDATE SET "count" = EXCLUDED."count"' in sql
+
+
+@pytest.mark.parametrize(
+    ("bucket", "start", "aggregation", "exp_resolution"),
+    [
+        (3600, datetime(2022, 1, 1), Aggregation.MEAN, 3600),
+        (7200, datetime(2022, 1, 1), Aggregation.MAX, 3600),
+        (1800, datetime(2022, 1, 1), Aggregation.MEAN, 60),
+        (3600, datetime(2022, 1, 1, 0, 30), Aggregation.MEAN, 60),
+        (3600, datetime(2022, 1, 1, 0, 0, 30), Aggregation.MEAN, None),
+        (90, datetime(2022, 1, 1), Aggregation.MEAN, None),
+        (3600, datetime(2022, 1, 1), Aggregation.LAST, None),
+    ],
+)
+def test_choose_rollup(bucket, start, aggregation, exp_resolution):
+    resolution = choose_rollup(
+        [60, 3600], bucket, start, datetime(2022, 1, 2), aggregation
+    )
+
+    assert resolution == exp_resolution
+
+
+def test_build_rollup_query():
+    query = build_rollup_query(
+        "test_table", 60, ["temperature"], Aggregation.MEAN, after_cursor=True
+    )
+
+    assert 'sum("temperature_sum") / sum("count")' in query
+    assert 'FROM "test_table_rollup_60"' in query
+    assert '"bucket" >= %(after)s + make_interval(secs => %(bucket)s)' in query
+    assert query.endswith("GROUP BY 1 ORDER BY 1 LIMIT %(limit)s")
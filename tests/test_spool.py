@@ -0,0 +1,167 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from iot_data_receiver.spool import (
+    InvalidRecord,
+    Spool,
+    SpoolFull,
+    SpoolReplayer,
+    lock_segment,
+    read_segment,
+)
+
+
+def get_spool(tmp_path, segment_size=1024, max_size=1024 * 1024):
+    return Spool(
+        str(tmp_path / "spool"),
+        segment_size=segment_size,
+        max_size=max_size,
+        fsync_interval=0,
+    )
+
+
+def test_spool_append_and_read(tmp_path):
+    spool = get_spool(tmp_path, segment_size=100)
+    records = [{"columns": [[datetime(2022, 1, 1, 0, i)], [1.0]]} for i in range(5)]
+    for record in records:
+        spool.append(record)
+    spool.rotate()
+
+    read_records = [
+        record for path in spool.closed_segments() for record in read_segment(path)
+    ]
+
+    assert len(spool.closed_segments()) > 1
+    assert read_records == [
+        {"columns": [[f"2022-01-01T00:0{i}:00"], [1.0]]} for i in range(5)
+    ]
+
+
+def test_spool_full(tmp_path):
+    spool = get_spool(tmp_path, max_size=100)
+    spool.append({"data": "a" * 50})
+
+    with pytest.raises(SpoolFull):
+        spool.append({"data": "a" * 50})
+
+
+def test_spool_truncated_record(tmp_path):
+    spool = get_spool(tmp_path)
+    spool.append({"data": 1})
+    spool.append({"data": 2})
+    spool.rotate()
+    (path,) = spool.closed_segments()
+    path.write_bytes(path.read_bytes()[:-3])
+
+    assert list(read_segment(path)) == [{"data": 1}]
+
+
+def test_spool_reopen(tmp_path):
+    spool = get_spool(tmp_path)
+    spool.append({"data": 1})
+    spool.close()
+
+    spool = get_spool(tmp_path)
+
+    assert spool.has_records()
+    assert [
+        record for path in spool.closed_segments() for record in read_segment(path)
+    ] == [{"data": 1}]
+
+
+def test_spool_replayer(tmp_path):
+    spool = get_spool(tmp_path, segment_size=50)
+    for i in range(4):
+        spool.append({"data": i})
+
+    written = []
+    fail = True
+
+    def write(record):
+        if fail and record["data"] == 2:
+            raise ConnectionError
+        written.append(record["data"])
+
+    replayer = SpoolReplayer(spool, write, replay_interval=60, replay_rate=0)
+
+    assert not replayer.replay()
+    fail = False
+    assert replayer.replay()
+    replayer.close()
+
+    assert written == [0, 1, 2, 3]
+    assert not spool.has_records()
+
+
+def test_spool_replayer_dead_letter(tmp_path):
+    spool = get_spool(tmp_path, segment_size=50)
+    for i in range(3):
+        spool.append({"data": i})
+
+    written = []
+
+    def write(record):
+        if record["data"] == 1:
+            raise InvalidRecord("Bad data")
+        written.append(record["data"])
+
+    replayer = SpoolReplayer(spool, write, replay_interval=60, replay_rate=0)
+
+    assert replayer.replay()
+    replayer.close()
+
+    assert written == [0, 2]
+    assert not spool.has_records()
+    assert spool.stats()["dead_letter_records"] == 1
+    assert [
+        json.loads(line) for line in spool.dead_letter_path.read_text().splitlines()
+    ] == [{"reason": "Bad data", "record": {"data": 1}}]
+
+
+def test_spool_shared_directory(tmp_path):
+    spool_1 = get_spool(tmp_path)
+    spool_2 = get_spool(tmp_path)
+    spool_1.append({"data": 1})
+    spool_2.append({"data": 2})
+
+    written = []
+    replayer = SpoolReplayer(
+        spool_2, lambda record: written.append(record["data"]), 60, 0
+    )
+
+    assert replayer.replay()
+    # The current segment of the other spool is locked
+    assert written == [2]
+    assert spool_1.has_records()
+
+    spool_1.append({"data": 3})
+    spool_1.rotate()
+
+    assert replayer.replay()
+    replayer.close()
+    spool_1.close()
+    spool_2.close()
+
+    assert written == [2, 1, 3]
+    assert list(tmp_path.joinpath("spool").iterdir()) == []
+
+
+def test_lock_segment(tmp_path):
+    spool = get_spool(tmp_path)
+    spool.append({"data": 1})
+
+    assert lock_segment(spool._current_path) is None
+
+    spool.rotate()
+    (path,) = spool.closed_segments()
+    segment = lock_segment(path)
+
+    assert segment is not None
+    assert lock_segment(path) is None
+
+    path.unlink()
+    segment.close()
+
+    assert lock_segment(path) is None
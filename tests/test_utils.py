@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta, timezone
+
+from iot_data_receiver.utils import (
+    KEY_LOOKUP_LENGTH,
+    MAX_IDENTIFIER_LENGTH,
+    generate_token,
+    get_key_lookup,
+    get_suffixed_name,
+    normalize_timestamps,
+    to_naive_utc,
+)
+
+
+def test_get_key_lookup():
+    token, hashed_token = generate_token(20)
+
+    key_lookup = get_key_lookup(token)
+
+    assert len(key_lookup) == KEY_LOOKUP_LENGTH
+    assert key_lookup == get_key_lookup(token)
+    assert key_lookup not in token
+    assert key_lookup not in hashed_token
+
+
+def test_get_suffixed_name():
+    assert get_suffixed_name("table", "_suffix") == "table_suffix"
+
+    long_name = get_suffixed_name("x" * 100, "_suffix")
+    other_name = get_suffixed_name("x" * 99 + "y", "_suffix")
+
+    assert len(long_name) == MAX_IDENTIFIER_LENGTH
+    assert long_name.endswith("_suffix")
+    assert long_name != other_name
+
+
+def test_to_naive_utc():
+    naive = datetime(2022, 6, 15, 0, 30)
+    aware = datetime(2022, 6, 15, 0, 30, tzinfo=timezone(timedelta(hours=2)))
+
+    assert to_naive_utc(naive) is naive
+    assert to_naive_utc(aware) == datetime(2022, 6, 14, 22, 30)
+    assert to_naive_utc(aware).tzinfo is None
+
+
+def test_normalize_timestamps():
+    naive = [datetime(2022, 6, 15, 0, 30)]
+    mixed = [
+        datetime(2022, 6, 15, 0, 30),
+        datetime(2022, 6, 15, 0, 30, tzinfo=timezone.utc),
+    ]
+
+    assert normalize_timestamps(naive) is naive
+    assert normalize_timestamps(mixed) == [datetime(2022, 6, 15, 0, 30)] * 2